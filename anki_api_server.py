@@ -7,8 +7,14 @@ from blueprint_notetypes import notetypes
 from blueprint_cards import cards
 from blueprint_study_sessions import study_sessions
 from blueprint_db import db
+from blueprint_media import media
+from blueprint_changes import changes
+from etags import add_etag, check_etag
+import os
 
 app = Flask(__name__)
+# Let a front-end server (nginx, Apache) send media files itself
+app.config['USE_X_SENDFILE'] = os.environ.get('ANKI_API_USE_X_SENDFILE', '') == '1'
 app.register_blueprint(imports)
 app.register_blueprint(exports)
 app.register_blueprint(users)
@@ -17,6 +23,10 @@ app.register_blueprint(notetypes)
 app.register_blueprint(cards)
 app.register_blueprint(study_sessions)
 app.register_blueprint(db)
+app.register_blueprint(media)
+app.register_blueprint(changes)
+app.before_request(check_etag)
+app.after_request(add_etag)
 
 # Start debugpy on 0.0.0.0:5678 and wait for the debugger to attach
 # Uncomment the next line if you want the server to pause until a debugger attaches:
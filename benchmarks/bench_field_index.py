@@ -0,0 +1,109 @@
+"""Benchmark trigram-narrowed field searches against the backend's ``re:`` search.
+
+Builds a throwaway collection of notes with random words, indexes it with
+:class:`field_index.FieldIndex`, and times regex and infix searches two ways:
+the plain ``"Field:re:..."`` search over the whole collection, and the same
+search run only over the candidates the index returns.
+
+    python benchmarks/bench_field_index.py --notes 100000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki.collection import AddNoteRequest, Collection
+from anki.decks import DeckId
+
+import field_index
+
+
+def build_collection(path: str, count: int) -> tuple:
+    col = Collection(path)
+    deck_id = col.decks.id("Bench")
+    notetype = col.models.by_name("Basic")
+    rng = random.Random(0)
+    vocabulary = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 9)))
+                  for _ in range(20000)]
+    requests = []
+    for _ in range(count):
+        note = col.new_note(notetype)
+        note["Front"] = " ".join(rng.choice(vocabulary) for _ in range(rng.randint(2, 8)))
+        note["Back"] = "<div>" + " ".join(rng.choice(vocabulary) for _ in range(rng.randint(10, 60))) + "</div>"
+        requests.append(AddNoteRequest(note=note, deck_id=DeckId(deck_id)))
+    col.add_notes(requests)
+    return col, vocabulary
+
+
+def searches(vocabulary) -> list:
+    """``(label, field, regex)`` for the searches to time."""
+    rng = random.Random(1)
+    word, other = rng.choice(vocabulary), rng.choice(vocabulary)
+    long_word = rng.choice([candidate for candidate in vocabulary if len(candidate) >= 8])
+    return [
+        ("infix", "Back", f".*{long_word[2:7]}.*"),
+        ("short infix", "Back", f".*{word[1:3]}.*"),
+        ("word", "Front", word),
+        ("anchored", "Front", f"^{word[:4]}"),
+        ("two literals", "Back", f"{word[:3]}.*{other[-3:]}"),
+        ("alternation", "Back", f"{word}|{other}"),
+        ("case-sensitive", "Back", f"(?-i){word[:4]}"),
+    ]
+
+
+def timed(fn, repeat: int) -> tuple:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def indexed_search(index, col, field: str, pattern: str, query: str):
+    candidates = index.candidates(col, [(field, pattern, "regex")])
+    if candidates is None:
+        return col.find_notes(query)
+    return field_index.find_notes_among(col, query, candidates)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--notes", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"building collection with {args.notes} notes...")
+        col, vocabulary = build_collection(os.path.join(tmp, "collection.anki2"), args.notes)
+        try:
+            index = field_index.FieldIndex("bench")
+            start = time.perf_counter()
+            with index._lock:
+                index._refresh(col, full=True)
+            stats = index.stats()
+            print(f"index built in {time.perf_counter() - start:.1f} s, "
+                  f"{stats['trigram_bytes'] / 1024 / 1024:.1f} MiB of trigram postings")
+
+            print(f"{'search':<16} {'re: search':>12} {'indexed':>12} {'candidates':>11} {'notes':>7}")
+            for label, field, pattern in searches(vocabulary):
+                query = f'"{field}:re:{pattern}"'
+                backend, expected = timed(lambda: col.find_notes(query), args.repeat)
+                indexed, found = timed(lambda: indexed_search(index, col, field, pattern, query), args.repeat)
+                assert sorted(found) == sorted(expected), label
+                candidates = index.candidates(col, [(field, pattern, "regex")])
+                print(f"{label:<16} {backend * 1000:9.1f} ms {indexed * 1000:9.1f} ms "
+                      f"{'-' if candidates is None else len(candidates):>11} {len(expected):>7}")
+        finally:
+            col.close()
+
+
+if __name__ == "__main__":
+    main()
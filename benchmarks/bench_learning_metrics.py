@@ -0,0 +1,111 @@
+"""Benchmark the learning-metrics filters against the old per-card loop.
+
+Builds a throwaway collection with review history and times the by-ease
+filter three ways: one ``col.get_card`` per card (the previous
+implementation), :func:`learning_metrics.select_cards` with NumPy, and the
+same without NumPy.
+
+    python benchmarks/bench_learning_metrics.py --cards 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki.collection import AddNoteRequest, Collection
+from anki.cards import CardId
+from anki.consts import QUEUE_TYPE_NEW, QUEUE_TYPE_SUSPENDED
+from anki.decks import DeckId
+
+import learning_metrics
+
+# Default by-ease criteria
+BOUNDS = {"reviews": (3, None), "factor": (2000, 2750), "ratio": (0.2, 1.0)}
+
+
+def build_collection(path: str, count: int) -> tuple:
+    col = Collection(path)
+    deck_id = col.decks.id("Bench")
+    notetype = col.models.by_name("Basic")
+    requests = []
+    for i in range(count):
+        note = col.new_note(notetype)
+        note["Front"] = f"front {i}"
+        note["Back"] = f"back {i}"
+        requests.append(AddNoteRequest(note=note, deck_id=deck_id))
+    col.add_notes(requests)
+
+    rng = random.Random(0)
+    updates = []
+    for card_id in col.find_cards(f"did:{deck_id}"):
+        if rng.random() < 0.1:
+            continue  # leave some cards new
+        updates.append((rng.randint(1, 40), rng.randint(1, 300), rng.choice(range(1300, 3100, 50)),
+                        rng.randint(0, 8), card_id))
+    col.db.executemany("update cards set type=2, queue=2, reps=?, ivl=?, factor=?, lapses=? where id=?", updates)
+    return col, deck_id
+
+
+def per_card_loop(col, deck_id) -> list:
+    """The by-ease filter as it was written before select_cards."""
+    selected = []
+    for card_id in col.decks.cids(DeckId(deck_id), children=True):
+        card = col.get_card(CardId(card_id))
+        if card.queue in (QUEUE_TYPE_SUSPENDED, QUEUE_TYPE_NEW):
+            continue
+        ratio = card.reps / card.ivl if card.ivl > 0 else float("inf")
+        if card.reps >= 3 and 2000 <= card.factor <= 2750 and 0.2 <= ratio <= 1.0:
+            selected.append(card.id)
+    return selected
+
+
+def timed(label: str, fn, repeat: int) -> list:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:<24} {best * 1000:10.1f} ms  ({len(result)} cards)")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cards", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"building collection with {args.cards} cards...")
+        col, deck_id = build_collection(os.path.join(tmp, "collection.anki2"), args.cards)
+        exclude = [QUEUE_TYPE_NEW, QUEUE_TYPE_SUSPENDED]
+        try:
+            expected = timed("per-card loop", lambda: per_card_loop(col, deck_id), 1)
+
+            numpy = learning_metrics.np
+            if numpy is not None:
+                rows = timed("select_cards (numpy)",
+                             lambda: learning_metrics.select_cards(col, deck_id, BOUNDS, exclude), args.repeat)
+                assert [row.id for row in rows] == expected
+            else:
+                print("select_cards (numpy)     skipped, numpy is not installed")
+
+            learning_metrics.np = None
+            try:
+                rows = timed("select_cards (python)",
+                             lambda: learning_metrics.select_cards(col, deck_id, BOUNDS, exclude), args.repeat)
+                assert [row.id for row in rows] == expected
+            finally:
+                learning_metrics.np = numpy
+        finally:
+            col.close()
+
+
+if __name__ == "__main__":
+    main()
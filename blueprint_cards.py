@@ -1,6 +1,6 @@
 # blueprint_cards.py
 from flask import jsonify, request, Blueprint
-from anki.collection import  Collection
+from anki.collection import  Collection, AddNoteRequest
 
 from anki.models import NotetypeId, ChangeNotetypeRequest, ModelManager
 from anki.notes import NoteId
@@ -9,6 +9,7 @@ from anki.cards import CardQueue
 
 from anki.decks import DeckId
 from anki.cards import CardId
+from anki.errors import InvalidInput, SearchError
 
 from anki.consts import (
     QUEUE_TYPE_MANUALLY_BURIED,
@@ -23,7 +24,17 @@ from anki.consts import (
 
 
 import os
-from anki_paths import collection_path as get_collection_path
+import time
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_reader, collection_writer
+from learning_metrics import METRICS, cursor_key as metrics_cursor_key, select_cards, valid_cursor as valid_metrics_cursor
+from pagination import PageRequest, page_request
+from card_fetch import fetch_cards_in_deck, fetch_cards_of_notes, fetch_notes, notes_by_notetype, target_card_ids
+from streaming import stream_ndjson, wants_ndjson
+from result_cache import cached_result
+import field_index
+from search_planner import combined_query, deck_search, parse_conditions, run_search
+from bulk_operations import OPERATIONS
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -39,54 +50,191 @@ state_map = {
 
 cards = Blueprint('cards', __name__)
 
+# Largest number of notes /api/cards/create-batch accepts at once
+MAX_BATCH_NOTES = int(os.environ.get("ANKI_API_MAX_BATCH_NOTES", 10000))
+
 ###----------------------- HELPERS -----------------------###
-def change_notetype(col, note_id, new_notetype_id, match_by_name):
+def field_mapping(old_notetype, new_notetype, match_by_name):
+    """``new_fields`` of a :class:`ChangeNotetypeRequest`: for each field of the
+    new notetype, the index of the old field it takes its content from, or -1."""
+    old_fields = old_notetype['flds']
+    new_fields = new_notetype['flds']
+    if match_by_name:
+        old_positions = {field['name']: i for i, field in enumerate(old_fields)}
+        return [old_positions.get(field['name'], -1) for field in new_fields]
+    return [field['ord'] if field['ord'] < len(old_fields) else -1 for field in new_fields]
+
+def change_notetypes(col, note_ids, new_notetype_id, match_by_name, dry_run=False):
+    """Change *note_ids* to *new_notetype_id* with one backend request per old notetype.
+
+    The field mapping is worked out once per group.  Notes already of the new
+    notetype are reported as skipped.  Returns one report per group, in the
+    order the groups first appear in *note_ids*.
+    """
     try:
-        card_id = col.card_ids_of_note(note_id)[0]
         new_notetype_id = int(new_notetype_id)
-        card = col.get_card(CardId(card_id))
-        old_notetype_id = card.note_type()["id"]
-        current_schema = col.db.scalar("select scm from col")
-
-        # Fetch field names and 'ord' values for both notetypes
-        old_notetype = col.models.get(NotetypeId(old_notetype_id))
         new_notetype = col.models.get(NotetypeId(new_notetype_id))
-        old_fields = old_notetype['flds']
-        new_fields = new_notetype['flds']
-
-        # Create field mapping based on 'match_by_name' variable
-        field_mapping = []
-        if match_by_name:
-            old_field_names = [field['name'] for field in old_fields]
-            new_field_names = [field['name'] for field in new_fields]
-            for old_field in old_field_names:
-                if old_field in new_field_names:
-                    field_mapping.append(new_field_names.index(old_field))
-                else:
-                    field_mapping.append(-1)  # Field does not exist in new notetype
-        else:
-            for old_field in old_fields:
-                matching_field = next((f for f in new_fields if f['ord'] == old_field['ord']), None)
-                if matching_field:
-                    field_mapping.append(matching_field['ord'])
-                else:
-                    field_mapping.append(-1)  # Field does not exist in new notetype
-
-        # Prepare the change notetype request
-        change_request = ChangeNotetypeRequest()
-        change_request.note_ids.extend([note_id])
-        change_request.old_notetype_id = old_notetype_id
-        change_request.new_notetype_id = new_notetype_id
-        change_request.current_schema = current_schema
-        change_request.new_fields.extend(field_mapping)
-
-        # Execute the change notetype operation
-        col.models.change_notetype_of_notes(change_request)
+        if new_notetype is None:
+            raise LookupError(f"Notetype {new_notetype_id} not found")
+
+        reports = []
+        for old_notetype_id, group in notes_by_notetype(col, note_ids).items():
+            report = {"old_notetype_id": old_notetype_id, "notes": len(group)}
+            reports.append(report)
+            if old_notetype_id == new_notetype_id:
+                report["skipped"] = True
+                continue
+            if dry_run:
+                continue
+            started = time.perf_counter()
+            change_request = ChangeNotetypeRequest()
+            change_request.note_ids.extend(group)
+            change_request.old_notetype_id = old_notetype_id
+            change_request.new_notetype_id = new_notetype_id
+            # Each change bumps the schema, so read it again for every group
+            change_request.current_schema = col.db.scalar("select scm from col")
+            change_request.new_fields.extend(
+                field_mapping(col.models.get(NotetypeId(old_notetype_id)), new_notetype, match_by_name)
+            )
+            col.models.change_notetype_of_notes(change_request)
+            report["ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return reports
     except Exception as e:
         raise Exception(f"error in change notetype request: {str(e)}")
 
+def change_notetype(col, note_id, new_notetype_id, match_by_name):
+    if not change_notetypes(col, [note_id], new_notetype_id, match_by_name):
+        raise Exception(f"error in change notetype request: note {note_id} not found")
+
+def change_notetypes_response(message, reports, started):
+    """Response for a grouped notetype change: notes changed per old notetype, and how long it took."""
+    return jsonify({
+        "message": message,
+        "count": sum(report["notes"] for report in reports if not report.get("skipped")),
+        "groups": reports,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+    }), 200
+
+def cards_in_state(col, queue_type, deck_id=None, tag=None, page=None):
+    """Return the cards in *queue_type*, optionally narrowed to a deck and/or tag.
+
+    The queue, deck and note restrictions are applied in the card query itself,
+    so cards in other states are never loaded.  A *page* limits the result to
+    the next page of cards by id.
+    """
+    page = page or PageRequest()
+    if tag:
+        note_ids = col.find_notes(f"tag:{tag}")
+        return fetch_cards_of_notes(col, note_ids, deck_id=deck_id, queue=queue_type,
+                                    after_id=page.after_id, limit=page.limit)
+    return fetch_cards_in_deck(col, deck_id, queue=queue_type, after_id=page.after_id, limit=page.limit)
+
+def new_note_from_request(col, item, default_note_type, default_deck_id, notetypes, decks):
+    """Build the note for one entry of a batch create; return ``(note, deck_id)``.
+
+    *notetypes* and *decks* cache lookups across the batch.  Raises
+    :class:`ValueError` describing what is wrong with the entry.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("each note must be an object")
+    note_type = item.get('note_type', default_note_type)
+    deck_id = item.get('deck_id', default_deck_id)
+    fields = item.get('fields')
+    tags = item.get('tags', [])
+
+    if not note_type or not deck_id or not fields or not isinstance(fields, dict):
+        raise ValueError("note_type, deck_id, and fields are required")
+
+    if note_type not in notetypes:
+        notetypes[note_type] = col.models.by_name(note_type)
+    notetype = notetypes[note_type]
+    if not notetype:
+        raise ValueError(f"Invalid note type: {note_type}")
+
+    try:
+        deck_id = int(deck_id)
+    except (TypeError, ValueError):
+        raise ValueError("deck_id must be an integer")
+    if deck_id not in decks:
+        decks[deck_id] = col.decks.get(DeckId(deck_id), default=False) is not None
+    if not decks[deck_id]:
+        raise ValueError(f"Deck not found: {deck_id}")
+
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+
+    note = col.new_note(notetype)
+    for field, value in fields.items():
+        if field not in note:
+            raise ValueError(f"Note type {note_type} has no field {field}")
+        if not isinstance(value, str):
+            raise ValueError(f"Field {field} must be a string")
+        note[field] = value
+    note.tags = tags
+    return note, deck_id
+
+def apply_bulk_change(username, operation_name, params, message, tag=None, deck_id=None, queue=None):
+    """Apply :data:`bulk_operations.OPERATIONS` *operation_name* to the cards of
+    notes tagged *tag*, or of *deck_id* and its subdecks, for the by-tag and
+    by-deck routes.  *params* is the request body.
+    """
+    if deck_id is not None:
+        try:
+            deck_id = int(deck_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "deck_id must be an integer"}), 400
+
+    operation = OPERATIONS[operation_name]
+    started = time.perf_counter()
+    col = acquire_collection(username)
+
+    try:
+        kwargs = operation.prepare(col, params)
+    except ValueError as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        card_ids = target_card_ids(col, tag=tag, deck_id=deck_id, queue=queue)
+        if card_ids:
+            operation.apply(col, card_ids, **kwargs)
+        release_collection(col)
+        return jsonify({
+            "message": message,
+            "count": len(card_ids),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }), 200
+    except Exception as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+def cursor_key(card):
+    """Paging position of a :class:`card_fetch.CardRow`."""
+    return (card.id,)
+
+def metrics_card_data(card, note, include_fields=True):
+    """Response entry for a :class:`learning_metrics.MetricRow`; *note* is
+    already limited to the requested fields."""
+    card_data = {
+        "id": card.id,
+        "note_id": card.nid,
+        "deck_id": card.did,
+        "queue": card.queue,
+        "ease_factor": card.factor / 10,  # Convert to percentage (250 = 250%)
+        "interval": card.interval,
+        "reviews": card.reviews,
+        "lapses": card.lapses,
+        "review_to_interval_ratio": card.ratio,
+        "tags": note.tags
+    }
+    # Include field contents if requested
+    if include_fields:
+        card_data["fields"] = note.field_dict()
+    return card_data
+
 ###------------------------- CARDS -------------------------###
 @cards.route('/api/cards/create', methods=['POST'])
+@collection_writer
 def create_card():
     data = request.json
     username = data.get('username')
@@ -98,12 +246,12 @@ def create_card():
     if not note_type or not deck_id or not fields:
         return jsonify({"error": "note_type, deck_id, and fields are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype = col.models.by_name(note_type)
         if not notetype:
+            release_collection(col)
             return jsonify({"error": "Invalid note type"}), 400
 
         note = col.new_note(notetype)
@@ -113,13 +261,84 @@ def create_card():
 
         col.add_note(note, DeckId(deck_id))
         card_ids = col.card_ids_of_note(note.id)
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card created successfully", "note_id": note.id, "card_ids": card_ids}), 201
     except Exception as e:
-        col.close()
+        release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+@cards.route('/api/cards/create-batch', methods=['POST'])
+@collection_writer
+def create_cards_batch():
+    """Add many notes in one backend call.
+
+    Each entry of ``notes`` has the ``note_type``, ``deck_id``, ``fields``
+    and ``tags`` of ``/api/cards/create``; a top-level ``note_type`` or
+    ``deck_id`` is used for entries without one.  ``results`` lists, in
+    input order, each note's ``note_id`` and ``card_ids`` or its ``error``.
+    """
+    data = request.json
+    username = data.get('username')
+    notes = data.get('notes')
+    default_note_type = data.get('note_type')
+    default_deck_id = data.get('deck_id')
+
+    if not username or not isinstance(notes, list) or not notes:
+        return jsonify({"error": "username and a non-empty notes list are required"}), 400
+    if len(notes) > MAX_BATCH_NOTES:
+        return jsonify({"error": f"At most {MAX_BATCH_NOTES} notes can be created per request"}), 400
+
+    started = time.perf_counter()
+    col = acquire_collection(username)
+
+    try:
+        results = [None] * len(notes)
+        requests = []
+        positions = []
+        notetypes, decks = {}, {}
+        for position, item in enumerate(notes):
+            try:
+                note, deck_id = new_note_from_request(col, item, default_note_type, default_deck_id, notetypes, decks)
+            except ValueError as e:
+                results[position] = {"index": position, "error": str(e)}
+                continue
+            requests.append(AddNoteRequest(note=note, deck_id=DeckId(deck_id)))
+            positions.append(position)
+
+        if requests:
+            try:
+                col.add_notes(requests)
+            except Exception:
+                # One bad note fails the whole call; add the notes one by one to find it
+                for add_request, position in zip(requests, positions):
+                    try:
+                        col.add_note(add_request.note, add_request.deck_id)
+                    except Exception as e:
+                        add_request.note.id = 0
+                        results[position] = {"index": position, "error": str(e)}
+
+        added = [(add_request.note.id, position) for add_request, position in zip(requests, positions)
+                 if add_request.note.id]
+        card_ids = {}
+        for card in fetch_cards_of_notes(col, [note_id for note_id, _ in added]):
+            card_ids.setdefault(card.nid, []).append(card.id)
+        for note_id, position in added:
+            results[position] = {"index": position, "note_id": note_id, "card_ids": card_ids.get(note_id, [])}
+
+        release_collection(col)
+        failed = sum(1 for result in results if "error" in result)
+        return jsonify({
+            "results": results,
+            "created": len(added),
+            "failed": failed,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }), 201 if added else 400
+    except Exception as e:
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/<note_id>/change-notetype', methods=['POST'])
+@collection_writer
 def change_card_notetype(note_id):
     data = request.json
     username = data.get('username')
@@ -129,20 +348,20 @@ def change_card_notetype(note_id):
     if not new_notetype_id:
         return jsonify({"error": "New notetype ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         note_id = int(note_id)
         change_notetype(col, note_id, new_notetype_id, match_by_name)
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Notetype changed successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
 @cards.route('/api/cards/change-notetype-by-tag', methods=['POST'])
+@collection_writer
 def change_notetype_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -153,23 +372,20 @@ def change_notetype_by_tag():
     if not tag or not new_notetype_id:
         return jsonify({"error": "Tag and new notetype ID are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
-        new_notetype_id = int(new_notetype_id)
+        started = time.perf_counter()
         note_ids = col.find_notes(f"tag:{tag}")
-
-        for note_id in note_ids:
-            change_notetype(col, note_id, new_notetype_id, match_by_name)
-
-        col.close()
-        return jsonify({"message": "Notetypes changed successfully"}), 200
+        reports = change_notetypes(col, note_ids, new_notetype_id, match_by_name)
+        release_collection(col)
+        return change_notetypes_response("Notetypes changed successfully", reports, started)
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/change-notetype-by-current', methods=['POST'])
+@collection_writer
 def change_notetype_by_current():
     data = request.json
     current_notetype_id = data.get('current_notetype_id')
@@ -180,24 +396,71 @@ def change_notetype_by_current():
     if not current_notetype_id or not new_notetype_id:
         return jsonify({"error": "Current and new notetype IDs are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
+        started = time.perf_counter()
         current_notetype_id = int(current_notetype_id)
-        new_notetype_id = int(new_notetype_id)
         note_ids = col.find_notes(f"mid:{current_notetype_id}")
+        reports = change_notetypes(col, note_ids, new_notetype_id, match_by_name)
+        release_collection(col)
+        return change_notetypes_response("Notetypes changed successfully", reports, started)
+    except Exception as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+@cards.route('/api/cards/change-notetype-bulk', methods=['POST'])
+@collection_writer
+def change_notetype_bulk():
+    """Change the notetype of the notes in ``note_ids``, or matched by ``search``.
+
+    Notes are converted in one request per old notetype; the response gives
+    each group's note count and time.  With ``dry_run`` the groups are only
+    counted.
+    """
+    data = request.json
+    username = data.get('username')
+    note_ids = data.get('note_ids')
+    search = data.get('search')
+    new_notetype_id = data.get('new_notetype_id')
+    match_by_name = data.get('match_by_name', True)
+    dry_run = data.get('dry_run', False)
+
+    if not username or not new_notetype_id:
+        return jsonify({"error": "username and new_notetype_id are required"}), 400
+    if (note_ids is None) == (search is None):
+        return jsonify({"error": "Provide either note_ids or search"}), 400
+    if note_ids is not None and (not isinstance(note_ids, list)
+                                 or not all(isinstance(note_id, int) for note_id in note_ids)):
+        return jsonify({"error": "note_ids must be a list of integers"}), 400
+    try:
+        new_notetype_id = int(new_notetype_id)
+    except (TypeError, ValueError):
+        return jsonify({"error": "new_notetype_id must be an integer"}), 400
 
-        for note_id in note_ids:
-            change_notetype(col, note_id, new_notetype_id, match_by_name)
+    started = time.perf_counter()
+    col = acquire_collection(username)
 
-        col.close()
-        return jsonify({"message": "Notetypes changed successfully"}), 200
+    if col.models.get(NotetypeId(new_notetype_id)) is None:
+        release_collection(col)
+        return jsonify({"error": "Notetype not found"}), 404
+
+    try:
+        if search is not None:
+            note_ids = col.find_notes(search)
+        reports = change_notetypes(col, note_ids, new_notetype_id, match_by_name, dry_run=bool(dry_run))
+        release_collection(col)
+        message = "Notetypes counted" if dry_run else "Notetypes changed successfully"
+        return change_notetypes_response(message, reports, started)
+    except SearchError as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/move-cards', methods=['POST'])
+@collection_writer
 def move_cards():
     data = request.json
     card_ids = data.get('card_ids')
@@ -207,8 +470,7 @@ def move_cards():
     if not card_ids or not target_deck_name or not username:
         return jsonify({"error": "card_ids, target_deck_name, and username are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         # Convert card IDs from string to CardId type
@@ -217,17 +479,75 @@ def move_cards():
         # Get the target deck ID
         target_deck_id = col.decks.id_for_name(target_deck_name)
         if not target_deck_id:
+            release_collection(col)
             return jsonify({"error": "Target deck not found"}), 404
 
         # Move the cards to the target deck
         col.set_deck(card_ids, target_deck_id)
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Cards moved successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+@cards.route('/api/cards/bulk', methods=['POST'])
+@collection_writer
+def bulk_operation():
+    """Apply one operation to every card an Anki search matches.
+
+    ``operation`` is a key of :data:`bulk_operations.OPERATIONS` and
+    ``params`` its arguments.  With ``dry_run`` only the matching cards are
+    counted.
+    """
+    data = request.json
+    username = data.get('username')
+    search = data.get('search')
+    operation_name = data.get('operation')
+    params = data.get('params') or {}
+    dry_run = data.get('dry_run', False)
+
+    if not username or not search or not operation_name:
+        return jsonify({"error": "username, search and operation are required"}), 400
+
+    operation = OPERATIONS.get(operation_name)
+    if operation is None:
+        return jsonify({"error": f"operation must be one of: {', '.join(OPERATIONS)}"}), 400
+    if not isinstance(params, dict):
+        return jsonify({"error": "params must be an object"}), 400
+
+    started = time.perf_counter()
+    col = acquire_collection(username)
+
+    try:
+        kwargs = operation.prepare(col, params)
+    except ValueError as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 400
+    except LookupError as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 404
+
+    try:
+        card_ids = col.find_cards(search)
+        search_ms = round((time.perf_counter() - started) * 1000, 3)
+        result = {"operation": operation_name, "search": search, "dry_run": bool(dry_run),
+                  "count": len(card_ids), "search_ms": search_ms}
+        if not dry_run:
+            applied = time.perf_counter()
+            result["changed"] = operation.apply(col, card_ids, **kwargs) if card_ids else 0
+            result["apply_ms"] = round((time.perf_counter() - applied) * 1000, 3)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        release_collection(col)
+        return jsonify(result), 200
+    except SearchError as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/<card_id>/reschedule', methods=['POST'])
+@collection_writer
 def reschedule_card(card_id):
     data = request.json
     new_due_date = data.get('new_due_date')
@@ -236,19 +556,19 @@ def reschedule_card(card_id):
     if not new_due_date:
         return jsonify({"error": "New due date is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         card_id = int(card_id)
         col.sched.set_due_date([card_id], str(new_due_date))
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card rescheduled successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/reschedule/by-tag', methods=['POST'])
+@collection_writer
 def reschedule_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -261,43 +581,12 @@ def reschedule_cards_by_tag():
     if not tag or (not new_due_date and (start_days is None or end_days is None)):
         return jsonify({"error": "Tag and new due date or start and end days are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        card_ids = []
-        cards_to_reschedule = []
-        for note_id in note_ids:
-            card_ids.extend(col.card_ids_of_note(note_id))
-    except Exception as e:
-        col.close()
-        return jsonify({"error": f"error was in gathering note_ids: {e}"}), 500
-
-    try:
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            if only_if_due and card.queue != CardQueue.DUE:
-                continue
-            else:
-                cards_to_reschedule.append(card_id)
-    except Exception as e:
-        col.close()
-        return jsonify({"error": f"error was in gathering card_ids: {e}"}), 500
-    
-    try:
-        if new_due_date:
-            col.sched.set_due_date(cards_to_reschedule, new_due_date)
-        else:
-            col.sched.set_due_date(cards_to_reschedule, f'{start_days}-{end_days}')
-
-        col.close()
-        return jsonify({"message": "Cards rescheduled successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": f"error was in rescheduling cards: {e}"}, {"cards_to_reschedule": str(cards_to_reschedule)}), 500
+    # 'Due' cards are those in the review queue, as for the by-state routes
+    return apply_bulk_change(username, "reschedule", data, "Cards rescheduled successfully",
+                             tag=tag, queue=QUEUE_TYPE_REV if only_if_due else None)
 
 @cards.route('/api/cards/reschedule/by-deck', methods=['POST'])
+@collection_writer
 def reschedule_cards_by_deck():
     data = request.json
     deck_id = data.get('deck_id')
@@ -310,38 +599,12 @@ def reschedule_cards_by_deck():
     if not deck_id or (not new_due_date and (start_days is None or end_days is None)):
         return jsonify({"error": "Deck ID and new due date or start and end days are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        cards_to_reschedule = []
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            if only_if_due and card.queue != CardQueue.DUE:
-                continue
-            else:
-                cards_to_reschedule.append(card_id)
-        
-        if new_due_date:
-            days = str(new_due_date)
-        else:
-            days = f'{start_days}-{end_days}'
-
-        # Ensure days is a string
-        if not isinstance(days, str):
-            raise ValueError("Days parameter must be a string")
-
-        col.sched.set_due_date(cards_to_reschedule, days)
-
-        col.close()
-        return jsonify({"message": "Cards rescheduled successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": f"error was in rescheduling cards: {e}, {days}"}), 500
+    # 'Due' cards are those in the review queue, as for the by-state routes
+    return apply_bulk_change(username, "reschedule", data, "Cards rescheduled successfully",
+                             deck_id=deck_id, queue=QUEUE_TYPE_REV if only_if_due else None)
 
 @cards.route('/api/cards/<card_id>/reposition', methods=['POST'])
+@collection_writer
 def reposition_card(card_id):
     data = request.json
     new_position = data.get('new_position')
@@ -352,83 +615,59 @@ def reposition_card(card_id):
     if new_position is None:
         return jsonify({"error": "New position is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         card_id = int(card_id)
         col.sched.reposition_new_cards([card_id], new_position, 1, randomize, increment_collection)
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card repositioned successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
     
 @cards.route('/api/cards/reposition/by-tag', methods=['POST'])
+@collection_writer
 def reposition_cards_by_tag():
     data = request.json
     tag = data.get('tag')
     new_position = data.get('new_position')
-    increment_collection = data.get('increment_collection', False)
-    randomize = data.get('randomize', False)
     username = data.get('username')
 
     if not tag or new_position is None:
         return jsonify({"error": "Tag and new position are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        card_ids = [card_id for note_id in note_ids for card_id in col.card_ids_of_note(note_id)]
-        col.sched.reposition_new_cards(card_ids, new_position, 1, randomize, increment_collection)
-        col.close()
-        return jsonify({"message": "Cards repositioned successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "reposition", data, "Cards repositioned successfully", tag=tag)
 
 @cards.route('/api/cards/reposition/by-deck', methods=['POST'])
+@collection_writer
 def reposition_cards_by_deck():
     data = request.json
     deck_id = data.get('deck_id')
     new_position = data.get('new_position')
-    increment_collection = data.get('increment_collection', False)
-    randomize = data.get('randomize', False)
     username = data.get('username')
 
     if not deck_id or new_position is None:
         return jsonify({"error": "Deck ID and new position are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        col.sched.reposition_new_cards(card_ids, new_position, 1, randomize, increment_collection)
-        col.close()
-        return jsonify({"message": "Cards repositioned successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "reposition", data, "Cards repositioned successfully", deck_id=deck_id)
 
 @cards.route('/api/cards/<card_id>/reset', methods=['POST'])
+@collection_writer
 def reset_card(card_id):
-    collection_path = get_collection_path("User 1")
-    col = Collection(collection_path)
+    col = acquire_collection("User 1")
 
     try:
         card_id = int(card_id)
         col.sched.schedule_cards_as_new([card_id])
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card reset successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
     
 @cards.route('/api/cards/reset/by-tag', methods=['POST'])
+@collection_writer
 def reset_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -437,23 +676,10 @@ def reset_cards_by_tag():
     if not tag:
         return jsonify({"error": "Tag is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    return apply_bulk_change(username, "reset", data, "Cards reset successfully", tag=tag)
 
-    try:
-        cards_to_reset = []
-        note_ids = col.find_notes(f"tag:{tag}")
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            cards_to_reset.extend(card_ids)
-        col.sched.schedule_cards_as_new(cards_to_reset)
-        col.close()
-        return jsonify({"message": "Cards reset successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
-    
 @cards.route('/api/cards/reset/by-deck', methods=['POST'])
+@collection_writer
 def reset_cards_by_deck():
     data = request.json
     deck_id = data.get('deck_id')
@@ -462,37 +688,27 @@ def reset_cards_by_deck():
     if not deck_id:
         return jsonify({"error": "Deck ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        col.sched.schedule_cards_as_new(card_ids)
-        col.close()
-        return jsonify({"message": "Cards reset successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "reset", data, "Cards reset successfully", deck_id=deck_id)
 
 @cards.route('/api/cards/<card_id>/suspend', methods=['POST'])
+@collection_writer
 def suspend_card(card_id):
     data = request.json
     username = data.get('username')
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         card_id = int(card_id)
         col.sched.suspend_cards([card_id])
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card suspended successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
     
 @cards.route('/api/cards/suspend/by-tag', methods=['POST'])
+@collection_writer
 def suspend_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -501,23 +717,10 @@ def suspend_cards_by_tag():
     if not tag:
         return jsonify({"error": "Tag is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    return apply_bulk_change(username, "suspend", data, "Cards suspended successfully", tag=tag)
 
-    try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        cards_to_suspend = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            cards_to_suspend.extend(card_ids)
-        col.sched.suspend_cards(cards_to_suspend)
-        col.close()
-        return jsonify({"message": "Cards suspended successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
-    
 @cards.route('/api/cards/suspend/by-deck', methods=['POST'])
+@collection_writer
 def suspend_cards_by_deck():
     data = request.json
     deck_id = data.get('deck_id')
@@ -526,39 +729,29 @@ def suspend_cards_by_deck():
     if not deck_id:
         return jsonify({"error": "Deck ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        col.sched.suspend_cards(card_ids)
-        col.close()
-        return jsonify({"message": "Cards suspended successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "suspend", data, "Cards suspended successfully", deck_id=deck_id)
 
 @cards.route('/api/cards/<card_id>/bury', methods=['POST'])
+@collection_writer
 def bury_card(card_id):
     data = request.json
     username = data.get('username')
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         card_id = int(card_id)
         card = col.get_card(CardId(card_id))
         card.queue = QUEUE_TYPE_MANUALLY_BURIED  # Set queue to scheduler buried
         col.update_card(card)  # Save changes
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Card buried successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/bury/by-tag', methods=['POST'])
+@collection_writer
 def bury_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -567,24 +760,10 @@ def bury_cards_by_tag():
     if not tag:
         return jsonify({"error": "Tag is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                card.queue = QUEUE_TYPE_MANUALLY_BURIED  # Set queue to scheduler buried
-                col.update_card(card)  # Save changes
-        col.close()
-        return jsonify({"message": "Cards buried successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "bury", data, "Cards buried successfully", tag=tag)
 
 @cards.route('/api/cards/bury/by-deck', methods=['POST'])
+@collection_writer
 def bury_cards_by_deck():
     data = request.json
     deck_id = data.get('deck_id')
@@ -593,81 +772,69 @@ def bury_cards_by_deck():
     if not deck_id:
         return jsonify({"error": "Deck ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
-    try:
-        deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            card.queue = QUEUE_TYPE_MANUALLY_BURIED  # Set queue to scheduler buried
-            col.update_card(card)  # Save changes
-        col.close()
-        return jsonify({"message": "Cards buried successfully"}), 200
-    except Exception as e:
-        col.close()
-        return jsonify({"error": str(e)}), 500
+    return apply_bulk_change(username, "bury", data, "Cards buried successfully", deck_id=deck_id)
 
 @cards.route('/api/cards/<card_id>/contents', methods=['GET'])
+@collection_reader
 def get_card_contents(card_id):
     data = request.json
     username = data.get('username')
 
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         card_id = int(card_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         card = col.get_card(CardId(card_id))
         if card:
             note = col.get_note(card.nid)
             field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            col.close()
+            release_collection(col)
             return jsonify({"id": card.id, "note_id": card.nid, "deck_id": card.did, "fields": field_contents})
         else:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Card not found"}), 404
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid card ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
 @cards.route('/api/cards/<note_id>', methods=['GET'])
+@collection_reader
 def get_card_by_id(note_id):
     data = request.json
     username = data.get('username')
 
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         note_id = int(note_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         card = col.get_card(CardId(note_id))
         if card:
             card_detail = {'id': card.id, 'note_id': card.nid, 'deck_id': card.did, 'queue': card.queue}
-            col.close()
+            release_collection(col)
             return jsonify(card_detail)
         else:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Card not found"}), 404
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid card ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-tag', methods=['GET'])
+@collection_reader
+@cached_result
 def get_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -677,41 +844,48 @@ def get_cards_by_tag():
     if not tag:
         return jsonify({"error": "Tag is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    col = acquire_collection(username)
 
     try:
-        # Find notes with the given tag
+        # Find notes with the given tag, then load their cards and notes in bulk
         note_ids = col.find_notes(f"tag:{tag}")
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                note = col.get_note(note_id)
-                if inclusions is not None:
-                    field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-                else:
-                    field_contents = {field_name: note[field_name] for field_name in note.keys()}
-                cards.append({
+        matching, next_cursor = page.trim(
+            fetch_cards_of_notes(col, note_ids, after_id=page.after_id, limit=page.limit), key=cursor_key)
+
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                note = notes[card.nid]
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
-                    "fields": field_contents,
+                    "fields": note.field_dict(),
                     "queue": card.queue,
                     "due": card.due
-                })
-        col.close()
-        return jsonify(cards), 200
+                }
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/<deck_id>/by-state', methods=['GET'])
+@collection_reader
 def get_cards_by_state(deck_id):
     data = request.json
     state = data.get('state')
     username = data.get('username')
+    tag = data.get('tag')  # Optional: only cards of notes with this tag
     inclusions = data.get('inclusions', None)
 
     if not state:
@@ -723,44 +897,48 @@ def get_cards_by_state(deck_id):
 
     queue_type = state_map[state]
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    col = acquire_collection(username)
 
     try:
         deck_id = int(deck_id)
         # Find cards with the specified state
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        cards = []
+        matching, next_cursor = page.trim(cards_in_state(col, queue_type, deck_id=deck_id, tag=tag, page=page), key=cursor_key)
 
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            note = col.get_note(card.nid)
-            if inclusions is not None:
-                field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-            else:
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            if card.queue == queue_type:
-                cards.append({
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                note = notes[card.nid]
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
-                    "fields": field_contents,
+                    "fields": note.field_dict(),
                     "queue": card.queue,
                     "tags": note.tags
-                })
+                }
 
-        col.close()
-        return jsonify(cards), 200
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/<deck_id>/by-state-without-fields', methods=['GET'])
+@collection_reader
 def get_cards_by_state_without_fields(deck_id):
     data = request.json
     state = data.get('state')
     username = data.get('username')
+    tag = data.get('tag')  # Optional: only cards of notes with this tag
 
     if not state:
         return jsonify({"error": "State parameter is required"}), 400
@@ -771,150 +949,165 @@ def get_cards_by_state_without_fields(deck_id):
 
     queue_type = state_map[state]
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    col = acquire_collection(username)
 
     try:
         deck_id = int(deck_id)
-        # Find cards with the specified state
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        cards = []
+        # Find cards with the specified state; only the tags of their notes are read
+        matching, next_cursor = page.trim(cards_in_state(col, queue_type, deck_id=deck_id, tag=tag, page=page), key=cursor_key)
 
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            note = col.get_note(card.nid)
-            field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            if card.queue == queue_type:
-                cards.append({
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, fields=False)
+            for card in batch:
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
                     "queue": card.queue,
-                    "tags": note.tags
-                })
+                    "tags": notes[card.nid].tags
+                }
 
-        col.close()
-        return jsonify(cards), 200
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-tag-and-state', methods=['GET'])
+@collection_reader
 def get_cards_by_tag_and_state():
     data = request.json
     tag = data.get('tag')
     state = data.get('state')
     username = data.get('username')
+    deck_id = data.get('deck_id')  # Optional: only cards in this deck and its children
     inclusions = data.get('inclusions', None)
 
     if not tag or not state:
         return jsonify({"error": "Tag and State parameters are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
     if state not in state_map:
         return jsonify({"error": "Invalid state"}), 400
 
     queue_type = state_map[state]
 
     try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                note = col.get_note(note_id)
-                if inclusions is not None:
-                    field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-                else:
-                    field_contents = {field_name: note[field_name] for field_name in note.keys()}
-                if card.queue == queue_type:
-                    cards.append({
-                        "id": card.id,
-                        "note_id": card.nid,
-                        "deck_id": card.did,
-                        "fields": field_contents,
-                        "queue": card.queue
-                    })
-        col.close()
-        return jsonify(cards), 200
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    col = acquire_collection(username)
+
+    try:
+        deck_id = int(deck_id) if deck_id is not None else None
+        matching, next_cursor = page.trim(cards_in_state(col, queue_type, deck_id=deck_id, tag=tag, page=page), key=cursor_key)
+
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                yield {
+                    "id": card.id,
+                    "note_id": card.nid,
+                    "deck_id": card.did,
+                    "fields": notes[card.nid].field_dict(),
+                    "queue": card.queue
+                }
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-tag-and-state-without-fields', methods=['GET'])
+@collection_reader
 def get_cards_by_tag_and_state_without_fields():
     data = request.json
     tag = data.get('tag')
     state = data.get('state')
     username = data.get('username')
+    deck_id = data.get('deck_id')  # Optional: only cards in this deck and its children
 
     if not tag or not state:
         return jsonify({"error": "Tag and State parameters are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-
     if state not in state_map:
         return jsonify({"error": "Invalid state"}), 400
 
     queue_type = state_map[state]
 
     try:
-        note_ids = col.find_notes(f"tag:{tag}")
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                note = col.get_note(note_id)
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
-                if card.queue == queue_type:
-                    cards.append({
-                        "id": card.id,
-                        "note_id": card.nid,
-                        "deck_id": card.did,
-                        "queue": card.queue
-                    })
-        col.close()
-        return jsonify(cards), 200
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    col = acquire_collection(username)
+
+    try:
+        deck_id = int(deck_id) if deck_id is not None else None
+        matching, next_cursor = page.trim(cards_in_state(col, queue_type, deck_id=deck_id, tag=tag, page=page), key=cursor_key)
+
+        def entries(batch):
+            for card in batch:
+                yield {
+                    "id": card.id,
+                    "note_id": card.nid,
+                    "deck_id": card.did,
+                    "queue": card.queue
+                }
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/delete/<card_id>', methods=['DELETE'])
+@collection_writer
 def delete_card(card_id):
     data = request.json
     username = data.get('username')
 
 
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         card_id = int(card_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         card = col.get_card(CardId(card_id))
         if card:
             col.remove_notes_by_card([CardId(card_id)])
-            col.close()
+            release_collection(col)
             return jsonify({"message": f"Card {card_id} deleted successfully"}), 200
         else:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Card not found"}), 404
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid card ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/delete/by-tag', methods=['DELETE'])
+@collection_writer
 def delete_cards_by_tag():
     data = request.json
     tag = data.get('tag')
@@ -923,28 +1116,25 @@ def delete_cards_by_tag():
     if not tag:
         return jsonify({"error": "Tag is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
-        # Find notes with the given tag
-        note_ids = col.find_notes(f"tag:{tag}")
-        card_ids = []
-        for note_id in note_ids:
-            card_ids.extend(col.card_ids_of_note(note_id))
+        # Every card of the tagged notes, so their notes go with them
+        card_ids = target_card_ids(col, tag=tag)
 
         if not card_ids:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "No cards found with the given tag"}), 404
 
-        col.remove_notes_by_card(card_ids)
-        col.close()
+        col.remove_cards_and_orphaned_notes(card_ids)
+        release_collection(col)
         return jsonify({"message": f"Cards with tag '{tag}' deleted successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
     
 @cards.route('/api/cards/delete/by-deck', methods=['DELETE'])
+@collection_writer
 def delete_cards_by_deck():
     data = request.json
     deck_identifier = data.get('deck')
@@ -953,8 +1143,7 @@ def delete_cards_by_deck():
     if not deck_identifier:
         return jsonify({"error": "Deck identifier (name or ID) is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         # Try to interpret the deck identifier as an ID
@@ -964,22 +1153,26 @@ def delete_cards_by_deck():
             # If conversion fails, treat it as a deck name
             deck_id = col.decks.id_for_name(deck_identifier)
             if not deck_id:
+                release_collection(col)
                 return jsonify({"error": "Deck not found"}), 404
 
         # Get all card IDs for the specified deck
         card_ids = col.decks.cids(DeckId(deck_id), children=True)
         if not card_ids:
+            release_collection(col)
             return jsonify({"error": "No cards found in the specified deck"}), 404
 
         # Remove notes by card IDs
         col.remove_notes_by_card(card_ids)
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Cards from deck '{deck_identifier}' deleted successfully"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-ease', methods=['GET'])
+@collection_reader
+@cached_result
 def get_cards_by_ease():
     """
     Find difficult cards based on predefined criteria:
@@ -1000,77 +1193,55 @@ def get_cards_by_ease():
     max_ratio = data.get('max_ratio', 1.0)  # Maximum reviews/interval ratio
     include_suspended = data.get('include_suspended', False)  # Whether to include suspended cards
     include_fields = data.get('include_fields', True)  # Whether to include field contents
+    sort_by = data.get('sort_by')  # Optional: reviews, interval, factor, lapses or ratio
+    descending = data.get('descending', False)
     
     if not deck_id or not username:
         return jsonify({"error": "deck_id and username are required"}), 400
+
+    if sort_by is not None and sort_by not in METRICS:
+        return jsonify({"error": f"sort_by must be one of {', '.join(METRICS)}"}), 400
     
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page.after is not None and not valid_metrics_cursor(page.after, sort_by):
+        return jsonify({"error": "cursor does not match sort_by"}), 400
+
+    col = acquire_collection(username)
     
     try:
         deck_id = int(deck_id)
-        # Get all cards in the deck
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        difficult_cards = []
+        # New cards have no review history; suspended ones only on request
+        exclude_queues = [QUEUE_TYPE_NEW] if include_suspended else [QUEUE_TYPE_NEW, QUEUE_TYPE_SUSPENDED]
+        matching = select_cards(col, deck_id, {
+            "reviews": (min_reviews, None),
+            "factor": (min_factor, max_factor),
+            "ratio": (min_ratio, max_ratio),
+        }, exclude_queues=exclude_queues, sort_by=sort_by, descending=descending,
+            limit=page.limit if page.enabled else None, after=page.after, by_id=page.enabled)
+        matching, next_cursor = page.trim(matching, key=lambda card: metrics_cursor_key(card, sort_by))
         
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            
-            # Skip suspended cards if not including them
-            if not include_suspended and card.queue == QUEUE_TYPE_SUSPENDED:
-                continue
-                
-            # Skip new cards (no review history)
-            if card.queue == QUEUE_TYPE_NEW:
-                continue
-                
-            # Get card stats - using the correct property names from Anki's codebase
-            reviews = card.reps  # Number of reviews
-            interval = card.ivl  # Current interval
-            factor = card.factor  # Ease factor (stored as permille, 2500 = 250%)
-            
-            # Calculate ratio of reviews to interval
-            ratio = reviews / interval if interval > 0 else float('inf')
-            
-            # Check if this card meets the difficult criteria
-            if (reviews >= min_reviews and 
-                factor >= min_factor and 
-                factor <= max_factor and 
-                ratio >= min_ratio and
-                ratio <= max_ratio):
-                
-                note = col.get_note(card.nid)
-                card_data = {
-                    "id": card.id,
-                    "note_id": card.nid,
-                    "deck_id": card.did,
-                    "queue": card.queue,
-                    "ease_factor": factor / 10,  # Convert to percentage (250 = 250%)
-                    "interval": interval,
-                    "reviews": reviews,
-                    "lapses": card.lapses,
-                    "review_to_interval_ratio": ratio,
-                    "tags": note.tags
-                }
-                
-                # Include field contents if requested
-                if include_fields:
-                    if inclusions is not None:
-                        field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-                    else:
-                        field_contents = {field_name: note[field_name] for field_name in note.keys()}
-                    card_data["fields"] = field_contents
-                
-                difficult_cards.append(card_data)
-        
-        col.close()
-        return jsonify(difficult_cards), 200
+        # Load notes only for the cards that passed the filters
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions, fields=include_fields)
+            for card in batch:
+                yield metrics_card_data(card, notes[card.nid], include_fields)
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        difficult_cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(difficult_cards, next_cursor)), 200
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-learning-metrics', methods=['GET'])
+@collection_reader
+@cached_result
 def get_cards_by_learning_metrics():
     """
     Flexible filtering of cards based on various learning metrics:
@@ -1100,88 +1271,61 @@ def get_cards_by_learning_metrics():
     include_new = data.get('include_new', False)
     include_fields = data.get('include_fields', True)
     limit = data.get('limit', 100)  # Default limit to prevent excessively large responses
+    sort_by = data.get('sort_by')  # Optional: reviews, interval, factor, lapses or ratio
+    descending = data.get('descending', False)
     
     if not deck_id or not username:
         return jsonify({"error": "deck_id and username are required"}), 400
+
+    if sort_by is not None and sort_by not in METRICS:
+        return jsonify({"error": f"sort_by must be one of {', '.join(METRICS)}"}), 400
     
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if page.after is not None and not valid_metrics_cursor(page.after, sort_by):
+        return jsonify({"error": "cursor does not match sort_by"}), 400
+
+    col = acquire_collection(username)
     
     try:
         deck_id = int(deck_id)
-        # Get all cards in the deck
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        filtered_cards = []
-        
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            
-            # Skip suspended cards if not including them
-            if not include_suspended and card.queue == QUEUE_TYPE_SUSPENDED:
-                continue
-                
-            # Skip new cards if not including them
-            if not include_new and card.queue == QUEUE_TYPE_NEW:
-                continue
-                
-            # Get card stats - using the correct property names from Anki's codebase
-            reviews = card.reps
-            interval = card.ivl
-            factor = card.factor / 10  # Convert to percentage (250 = 250%)
-            lapses = card.lapses
-            
-            # Calculate ratio of reviews to interval
-            ratio = reviews / interval if interval > 0 else float('inf')
-            
-            # Apply filters
-            if ((min_reviews is not None and reviews < min_reviews) or
-                (max_reviews is not None and reviews > max_reviews) or
-                (min_interval is not None and interval < min_interval) or
-                (max_interval is not None and interval > max_interval) or
-                (min_factor is not None and factor < min_factor) or
-                (max_factor is not None and factor > max_factor) or
-                (min_lapses is not None and lapses < min_lapses) or
-                (max_lapses is not None and lapses > max_lapses) or
-                (min_ratio is not None and ratio < min_ratio) or
-                (max_ratio is not None and ratio > max_ratio)):
-                continue
-            
-            note = col.get_note(card.nid)
-            card_data = {
-                "id": card.id,
-                "note_id": card.nid,
-                "deck_id": card.did,
-                "queue": card.queue,
-                "ease_factor": factor,
-                "interval": interval,
-                "reviews": reviews,
-                "lapses": lapses,
-                "review_to_interval_ratio": ratio,
-                "tags": note.tags
-            }
-            
-            # Include field contents if requested
-            if include_fields:
-                if inclusions is not None:
-                    field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-                else:
-                    field_contents = {field_name: note[field_name] for field_name in note.keys()}
-                card_data["fields"] = field_contents
-            
-            filtered_cards.append(card_data)
-            
-            # Apply limit
-            if len(filtered_cards) >= limit:
-                break
+        exclude_queues = []
+        if not include_suspended:
+            exclude_queues.append(QUEUE_TYPE_SUSPENDED)
+        if not include_new:
+            exclude_queues.append(QUEUE_TYPE_NEW)
+        # Factor bounds are given as a percentage (250 = 250%)
+        matching = select_cards(col, deck_id, {
+            "reviews": (min_reviews, max_reviews),
+            "interval": (min_interval, max_interval),
+            "factor": (min_factor * 10 if min_factor is not None else None,
+                       max_factor * 10 if max_factor is not None else None),
+            "lapses": (min_lapses, max_lapses),
+            "ratio": (min_ratio, max_ratio),
+        }, exclude_queues=exclude_queues, sort_by=sort_by, descending=descending,
+            limit=page.limit if page.enabled else limit, after=page.after, by_id=page.enabled)
+        matching, next_cursor = page.trim(matching, key=lambda card: metrics_cursor_key(card, sort_by))
         
-        col.close()
-        return jsonify(filtered_cards), 200
+        # Load notes only for the cards that passed the filters
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions, fields=include_fields)
+            for card in batch:
+                yield metrics_card_data(card, notes[card.nid], include_fields)
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        filtered_cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(filtered_cards, next_cursor)), 200
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/reset-difficult', methods=['POST'])
+@collection_writer
 def reset_difficult_cards():
     """
     Find and reset cards that meet the difficult criteria.
@@ -1200,50 +1344,35 @@ def reset_difficult_cards():
     if not deck_id or not username:
         return jsonify({"error": "deck_id and username are required"}), 400
     
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     
     try:
         deck_id = int(deck_id)
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        cards_to_reset = []
-        
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            
-            # Skip new cards
-            if card.queue == QUEUE_TYPE_NEW:
-                continue
-                
-            reviews = card.reps
-            interval = card.ivl
-            factor = card.factor
-            lapses = card.lapses
-            
-            ratio = reviews / interval if interval > 0 else float('inf')
-            
-            if (reviews >= min_reviews and 
-                factor <= max_factor and 
-                ratio >= min_ratio and
-                lapses >= min_lapses):
-                cards_to_reset.append(card_id)
+        # Skip new cards
+        cards_to_reset = [card.id for card in select_cards(col, deck_id, {
+            "reviews": (min_reviews, None),
+            "factor": (None, max_factor),
+            "ratio": (min_ratio, None),
+            "lapses": (min_lapses, None),
+        }, exclude_queues=[QUEUE_TYPE_NEW])]
         
         if cards_to_reset:
             col.sched.schedule_cards_as_new(cards_to_reset)
-            col.close()
+            release_collection(col)
             return jsonify({
                 "message": f"Reset {len(cards_to_reset)} difficult cards",
                 "cards_reset": len(cards_to_reset)
             }), 200
         else:
-            col.close()
+            release_collection(col)
             return jsonify({"message": "No difficult cards found that meet the criteria"}), 200
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-note-id/<note_id>', methods=['GET'])
+@collection_reader
 def get_cards_by_note_id(note_id):
     data = request.json or {}
     username = data.get('username')
@@ -1252,32 +1381,26 @@ def get_cards_by_note_id(note_id):
     if not username:
         return jsonify({"error": "Username is required"}), 400
 
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         note_id = int(note_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         # First check if the note exists
-        try:
-            note = col.get_note(note_id)
-        except Exception:
-            col.close()
+        note = fetch_notes(col, [note_id], inclusions).get(note_id)
+        if note is None:
+            release_collection(col)
             return jsonify({"error": f"Note with ID {note_id} not found"}), 404
             
-        card_ids = col.card_ids_of_note(note_id)
+        note_cards = fetch_cards_of_notes(col, [note_id])
         
-        if not card_ids:
-            col.close()
+        if not note_cards:
+            release_collection(col)
             return jsonify({"error": f"No cards found for note ID {note_id}"}), 404
             
+        field_contents = note.field_dict()
         cards = []
-        for card_id in card_ids:
-            card = col.get_card(card_id)
-            if inclusions is not None:
-                field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-            else:
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
+        for card in note_cards:
             cards.append({
                 "id": card.id,
                 "note_id": card.nid,
@@ -1285,20 +1408,22 @@ def get_cards_by_note_id(note_id):
                 "fields": field_contents,
                 "queue": card.queue,
                 "tags": note.tags,
-                "due": getattr(card, 'due', None)
+                "due": card.due
             })
-        col.close()
+        release_collection(col)
         return jsonify(cards), 200
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid note ID format"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-field-content', methods=['GET'])
+@collection_reader
+@cached_result
 def get_cards_by_field_content():
     data = request.json
     username = data.get('username')
@@ -1311,8 +1436,17 @@ def get_cards_by_field_content():
     if not username or not field_name or not field_content:
         return jsonify({"error": "username, field_name, and field_content are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        deck_id = int(deck_id) if deck_id else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "deck_id must be an integer"}), 400
+
+    col = acquire_collection(username)
 
     try:
         # Construct the search query based on exact_match parameter
@@ -1323,43 +1457,46 @@ def get_cards_by_field_content():
             # For partial match, we use the "field:*content*" syntax
             search_query = f"\"{field_name}:*{field_content}*\""
         
-        # Add deck restriction if deck_id is provided
-        if deck_id:
-            deck_id = int(deck_id)
-            search_query = f"deck:{deck_id} {search_query}"
+        # Add deck restriction if deck_id is provided, including its subdecks
+        if deck_id is not None:
+            search_query = f"{deck_search(col.decks.deck_and_child_ids(deck_id))} {search_query}"
         
         # Find notes matching the search query
-        note_ids = col.find_notes(search_query)
-        
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            note = col.get_note(note_id)
-            
-            # Filter fields based on inclusions if provided
-            if inclusions is not None:
-                field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-            else:
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                cards.append({
+        note_ids = field_index.find_notes(
+            col, username, search_query, [(field_name, field_content, "exact" if exact_match else "contains")])
+        matching, next_cursor = page.trim(
+            fetch_cards_of_notes(col, note_ids, deck_id=deck_id, after_id=page.after_id, limit=page.limit),
+            key=cursor_key)
+
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                note = notes[card.nid]
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
-                    "fields": field_contents,
+                    # Only the fields named in inclusions were read, if given
+                    "fields": note.field_dict(),
                     "queue": card.queue,
                     "tags": note.tags
-                })
-        
-        col.close()
-        return jsonify(cards), 200
+                }
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
+    except (SearchError, InvalidInput) as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @cards.route('/api/cards/by-field-substring', methods=['GET'])
+@collection_reader
+@cached_result
 def get_cards_by_field_substring():
     data = request.json
     username = data.get('username')
@@ -1372,53 +1509,64 @@ def get_cards_by_field_substring():
     if not username or not field_name or not substring:
         return jsonify({"error": "username, field_name, and substring are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        deck_id = int(deck_id) if deck_id else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "deck_id must be an integer"}), 400
+
+    col = acquire_collection(username)
 
     try:
         # Construct the search query based on case sensitivity
         # Note: Anki's regex search is case-insensitive by default
-        search_modifier = "re" if case_sensitive else "re:i"
+        search_modifier = "(?-i)" if case_sensitive else ""
         # The regex pattern will search for the substring within the field contents
-        search_query = f"{search_modifier}:{field_name}:.*{substring}.*"
+        search_query = f"\"{field_name}:re:{search_modifier}.*{substring}.*\""
         
-        # Add deck restriction if deck_id is provided
-        if deck_id:
-            deck_id = int(deck_id)
-            search_query = f"deck:{deck_id} {search_query}"
+        # Add deck restriction if deck_id is provided, including its subdecks
+        if deck_id is not None:
+            search_query = f"{deck_search(col.decks.deck_and_child_ids(deck_id))} {search_query}"
         
         # Find notes matching the search query
-        note_ids = col.find_notes(search_query)
-        
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            note = col.get_note(note_id)
-            
-            # Filter fields based on inclusions if provided
-            if inclusions is not None:
-                field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-            else:
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                cards.append({
+        note_ids = field_index.find_notes(col, username, search_query, [(field_name, substring, "substring")])
+        matching, next_cursor = page.trim(
+            fetch_cards_of_notes(col, note_ids, deck_id=deck_id, after_id=page.after_id, limit=page.limit),
+            key=cursor_key)
+
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                note = notes[card.nid]
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
-                    "fields": field_contents,
+                    # Only the fields named in inclusions were read, if given
+                    "fields": note.field_dict(),
                     "queue": card.queue,
                     "tags": note.tags
-                })
-        
-        col.close()
-        return jsonify(cards), 200
+                }
+
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, page.trailer(next_cursor))
+        cards = list(entries(matching))
+        release_collection(col)
+        return jsonify(page.body(cards, next_cursor)), 200
+    except (SearchError, InvalidInput) as e:
+        release_collection(col)
+        return jsonify({"error": str(e), "query": search_query}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e), "query": search_query}), 500
 
 @cards.route('/api/cards/advanced-field-search', methods=['POST'])
+@collection_reader
+@cached_result
 def advanced_field_search():
     data = request.json
     username = data.get('username')
@@ -1433,65 +1581,54 @@ def advanced_field_search():
     if join_operator not in ('AND', 'OR'):
         return jsonify({"error": "join_operator must be 'AND' or 'OR'"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    try:
+        page = page_request(data)
+        conditions = parse_conditions(field_conditions)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
     try:
-        # Build the search query from field conditions
-        condition_queries = []
-        
-        for condition in field_conditions:
-            field_name = condition.get('field_name')
-            operation = condition.get('operation', 'is')  # 'is', 'contains', 'regex'
-            value = condition.get('value')
-            case_sensitive = condition.get('case_sensitive', False)
-            
-            if not field_name or not value:
-                continue
-                
-            if operation == 'is':
-                condition_queries.append(f"\"{field_name}:{value}\"")
-            elif operation == 'contains':
-                condition_queries.append(f"\"{field_name}:*{value}*\"")
-            elif operation == 'regex':
-                re_modifier = "re" if case_sensitive else "re:i"
-                condition_queries.append(f"{re_modifier}:{field_name}:{value}")
-        
-        # Join the conditions with the specified operator
-        search_query = f" {join_operator} ".join(condition_queries)
-        
-        # Add deck restriction if deck_id is provided
-        if deck_id:
-            deck_id = int(deck_id)
-            search_query = f"deck:{deck_id} {search_query}"
-        
-        # Find notes matching the search query
-        note_ids = col.find_notes(search_query)
-        
-        cards = []
-        for note_id in note_ids:
-            card_ids = col.card_ids_of_note(note_id)
-            note = col.get_note(note_id)
-            
-            # Get field contents
-            if inclusions is not None:
-                field_contents = {field: note[field] for field in inclusions if field in note.keys()}
-            else:
-                field_contents = {field_name: note[field_name] for field_name in note.keys()}
-            
-            for card_id in card_ids:
-                card = col.get_card(CardId(card_id))
-                cards.append({
+        deck_id = int(deck_id) if deck_id else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "deck_id must be an integer"}), 400
+
+    search_query = combined_query(conditions, join_operator)
+    col = acquire_collection(username)
+
+    try:
+        # Cheap, selective conditions run first; the rest only over their survivors
+        note_ids, plan = run_search(col, username, conditions, join_operator, deck_id)
+        search_query = plan["query"]
+        matching, next_cursor = page.trim(
+            fetch_cards_of_notes(col, note_ids, deck_id=deck_id, after_id=page.after_id, limit=page.limit),
+            key=cursor_key)
+
+        def entries(batch):
+            notes = fetch_notes(col, {card.nid for card in batch}, inclusions)
+            for card in batch:
+                note = notes[card.nid]
+                yield {
                     "id": card.id,
                     "note_id": card.nid,
                     "deck_id": card.did,
-                    "fields": field_contents,
+                    "fields": note.field_dict(),
                     "queue": card.queue,
                     "tags": note.tags
-                })
-        
-        col.close()
-        return jsonify({"cards": cards, "query": search_query, "count": len(cards)}), 200
+                }
+
+        summary = {"query": search_query, "count": len(matching)}
+        if page.enabled:
+            summary["next_cursor"] = next_cursor
+        summary["plan"] = plan
+        if wants_ndjson():
+            return stream_ndjson(col, matching, entries, summary)
+        cards = list(entries(matching))
+        release_collection(col)
+        result = {"cards": cards, **summary}
+        return jsonify(result), 200
+    except (SearchError, InvalidInput) as e:
+        release_collection(col)
+        return jsonify({"error": str(e), "query": search_query}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e), "query": search_query}), 500
@@ -0,0 +1,167 @@
+# blueprint_changes.py
+from flask import jsonify, request, Blueprint
+
+import time
+
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_reader
+from card_fetch import fetch_notes
+from streaming import stream_ndjson, wants_ndjson
+
+changes = Blueprint('changes', __name__)
+
+# graves.type -> kind of deleted object
+GRAVE_KINDS = {0: "card", 1: "note", 2: "deck"}
+
+CHANGED_CARD_COLUMNS = "id, nid, did, ord, type, queue, due, ivl, mod, usn"
+
+###----------------------- HELPERS -----------------------###
+def change_filter(since_usn=None, since_mtime=None, since_local_mtime=None):
+    """Return ``(where, args, matches)`` selecting rows changed after a mark.
+
+    By usn, rows synced after *since_usn* match, plus local changes not yet
+    synced (usn -1) modified at or after *since_local_mtime*.  By mtime, rows
+    modified at or after *since_mtime* (in seconds) match.  Marks from
+    :func:`next_mtime_mark` repeat a second only while it is still current,
+    so nothing written in it is missed.
+    *matches* applies the same test to a ``(mod, usn)`` pair.
+    """
+    if since_usn is not None:
+        local_mtime = since_local_mtime or 0
+        return ("(usn > ? or (usn = -1 and mod >= ?))", [since_usn, local_mtime],
+                lambda mod, usn: usn > since_usn or (usn == -1 and mod >= local_mtime))
+    return "mod >= ?", [since_mtime], lambda mod, usn: mod >= since_mtime
+
+def pending_graves_mark(col):
+    """A mark that changes whenever the set of unsynced deletions does."""
+    return ":".join(str(value) for value in col.db.first(
+        "select count(), coalesce(sum(oid & 4294967295), 0), coalesce(sum(oid >> 32), 0), coalesce(sum(type), 0)"
+        " from graves where usn = -1"))
+
+def collect_changes(col, since_usn=None, since_mtime=None, since_local_mtime=None, since_graves=None):
+    """Return ``(rows, high_water)`` for everything changed after the mark.
+
+    *rows* is a list of ``(kind, row)`` pairs: changed decks, notetypes,
+    notes and cards, then deletions.  Deletions carry no time or order, so
+    the unsynced ones are listed only when they differ from *since_graves*,
+    and then all of them; applying one twice is harmless.
+    """
+    if since_usn is not None:
+        # Below -1 the usn test would also take every unsynced row
+        since_usn = max(since_usn, -1)
+    where, args, matches = change_filter(since_usn, since_mtime, since_local_mtime)
+    rows = []
+    for deck in col.decks.all():
+        if matches(deck['mod'], deck['usn']):
+            rows.append(("deck", deck))
+    for notetype in col.models.all():
+        if matches(notetype['mod'], notetype['usn']):
+            rows.append(("notetype", notetype))
+    for note_id, mod, usn in col.db.all(f"select id, mod, usn from notes where {where}", *args):
+        rows.append(("note", (note_id, mod, usn)))
+    for row in col.db.all(f"select {CHANGED_CARD_COLUMNS} from cards where {where}", *args):
+        rows.append(("card", row))
+    graves_mark = pending_graves_mark(col)
+    if since_usn is not None:
+        for oid, kind, usn in col.db.all("select oid, type, usn from graves where usn > ?", since_usn):
+            rows.append(("deleted", (oid, kind, usn)))
+    if graves_mark != since_graves:
+        for oid, kind, usn in col.db.all("select oid, type, usn from graves where usn = -1"):
+            rows.append(("deleted", (oid, kind, usn)))
+
+    high_water = {
+        "usn": max([since_usn if since_usn is not None else -1] + [changed_usn(kind, row) for kind, row in rows]),
+        "mtime": next_mtime_mark(since_mtime, [changed_mod(kind, row) for kind, row in rows]),
+        "graves": graves_mark,
+    }
+    if since_usn is not None:
+        high_water["local_mtime"] = next_mtime_mark(
+            since_local_mtime, [changed_mod(kind, row) for kind, row in rows if changed_usn(kind, row) == -1])
+    return rows, high_water
+
+def next_mtime_mark(since, mods):
+    """The mtime to ask from next: after the newest change, unless its second isn't over yet."""
+    newest = max(mods, default=None)
+    if newest is None:
+        return since or 0
+    return max(since or 0, newest + 1 if newest < int(time.time()) else newest)
+
+def changed_usn(kind, row):
+    if kind in ("deck", "notetype"):
+        return row['usn']
+    return row[-1]
+
+def changed_mod(kind, row):
+    if kind in ("deck", "notetype"):
+        return row['mod']
+    if kind == "deleted":
+        return 0
+    return row[-2]
+
+###------------------------- CHANGES -------------------------###
+@changes.route('/api/changes', methods=['GET'])
+@collection_reader
+def get_changes():
+    """Cards, notes, decks and notetypes changed since a usn or mtime mark.
+
+    Send ``since_usn`` or ``since_mtime`` (seconds), then pass the returned
+    ``high_water`` value back to get the next set of changes: with
+    ``since_usn`` also ``since_local_mtime``, and with either
+    ``since_graves``.  With
+    ``Accept: application/x-ndjson`` each change is one line and the
+    high-water mark is the last line.
+    """
+    data = request.json or {}
+    username = data.get('username')
+    since_usn = data.get('since_usn')
+    since_mtime = data.get('since_mtime')
+    since_local_mtime = data.get('since_local_mtime')
+    since_graves = data.get('since_graves')
+    inclusions = data.get('inclusions', None)
+
+    if (since_usn is None) == (since_mtime is None):
+        return jsonify({"error": "Exactly one of since_usn or since_mtime is required"}), 400
+    for name, value in (("since_usn", since_usn), ("since_mtime", since_mtime),
+                        ("since_local_mtime", since_local_mtime)):
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            return jsonify({"error": f"{name} must be an integer"}), 400
+    if since_local_mtime is not None and since_usn is None:
+        return jsonify({"error": "since_local_mtime goes with since_usn"}), 400
+    if since_graves is not None and not isinstance(since_graves, str):
+        return jsonify({"error": "since_graves must be the graves value of a previous high_water"}), 400
+
+    col = acquire_collection(username)
+
+    try:
+        rows, high_water = collect_changes(col, since_usn, since_mtime, since_local_mtime, since_graves)
+
+        def entries(batch):
+            notes = fetch_notes(col, [row[0] for kind, row in batch if kind == "note"], inclusions)
+            for kind, row in batch:
+                if kind == "deck":
+                    yield {"kind": "deck", "id": row['id'], "name": row['name'], "mod": row['mod'], "usn": row['usn']}
+                elif kind == "notetype":
+                    yield {"kind": "notetype", "id": row['id'], "name": row['name'], "mod": row['mod'], "usn": row['usn']}
+                elif kind == "note":
+                    note_id, mod, usn = row
+                    note = notes.get(note_id)
+                    if note is None:
+                        continue  # deleted since the change list was read
+                    yield {"kind": "note", "id": note_id, "notetype_id": note.mid, "fields": note.field_dict(),
+                           "tags": note.tags, "mod": mod, "usn": usn}
+                elif kind == "card":
+                    card_id, note_id, deck_id, template_ord, card_type, queue, due, interval, mod, usn = row
+                    yield {"kind": "card", "id": card_id, "note_id": note_id, "deck_id": deck_id, "ord": template_ord,
+                           "type": card_type, "queue": queue, "due": due, "interval": interval, "mod": mod, "usn": usn}
+                else:
+                    oid, grave_type, usn = row
+                    yield {"kind": "deleted", "type": GRAVE_KINDS.get(grave_type, grave_type), "id": oid, "usn": usn}
+
+        if wants_ndjson():
+            return stream_ndjson(col, rows, entries, {"high_water": high_water})
+        items = list(entries(rows))
+        release_collection(col)
+        return jsonify({"changes": items, "high_water": high_water}), 200
+    except Exception as e:
+        release_collection(col)
+        return jsonify({"error": str(e)}), 500
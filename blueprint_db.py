@@ -15,7 +15,10 @@ from anki.consts import (
 )
 
 import os
-from anki_paths import collection_path as get_collection_path
+from collection_pool import acquire_collection, release_collection, pool as collection_pool
+from collection_executor import collection_reader, collection_writer, executor_stats
+from caches import cache_stats
+from field_index import field_index_stats
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -34,6 +37,7 @@ db = Blueprint('db', __name__)
 ###------------------------- DB -------------------------###
 # Add the following endpoint to the 'db' blueprint in blueprint_db.py
 @db.route('/api/db/sync', methods=['POST'])
+@collection_writer
 def sync_database():
     username = request.json['username']
     endpoint = request.json['endpoint']
@@ -43,8 +47,7 @@ def sync_database():
     upload = request.json.get('upload', False)
 
     try:
-        collection_path = get_collection_path(username)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
     except Exception as e:
         return jsonify({"error": "error opening collection: " + str(e)}), 500
 
@@ -98,18 +101,20 @@ def sync_database():
         })
     except Exception as e:
         return jsonify({'error': f"Error syncing database: {str(e)}"}), 500
+    finally:
+        release_collection(col)
 
 # Add the following endpoints to the 'db' blueprint in blueprint_db.py
 
 @db.route('/api/db/sync_status', methods=['POST'])
+@collection_reader
 def sync_status():
     username = request.json['username']
     endpoint = request.json['endpoint']
     hkey = request.json['hkey']
 
     try:
-        collection_path = get_collection_path(username)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
     except Exception as e:
         return jsonify({"error": "error opening collection: " + str(e)}), 500
 
@@ -119,14 +124,16 @@ def sync_status():
         return jsonify({'sync_status': f"{sync_status}"})
     except Exception as e:
         return jsonify({'error': "error getting sync status: " + str(e)}), 500
+    finally:
+        release_collection(col)
 
 @db.route('/api/db/media_sync_status', methods=['POST'])
+@collection_reader
 def media_sync_status():
     username = request.json['username']
 
     try:
-        collection_path = get_collection_path(username)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
     except Exception as e:
         return jsonify({"error": "error opening collection: " + str(e)}), 500
 
@@ -135,3 +142,15 @@ def media_sync_status():
         return jsonify({'media_sync_status': f"{media_sync_status}"})
     except Exception as e:
         return jsonify({'error': "error getting media sync status: " + str(e)}), 500
+    finally:
+        release_collection(col)
+
+@db.route('/api/db/pool-stats', methods=['GET'])
+def pool_stats():
+    """Report open pooled collections, per-user write queue depth and cache usage."""
+    return jsonify({
+        'pool': collection_pool.stats(),
+        'executors': executor_stats(),
+        'caches': cache_stats(),
+        'field_indexes': field_index_stats()
+    })
\ No newline at end of file
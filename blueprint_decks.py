@@ -22,11 +22,17 @@ from anki.consts import (
     QUEUE_TYPE_PREVIEW
 )
 
-from blueprint_cards import change_notetype
+from blueprint_cards import change_notetypes, change_notetypes_response
 
 
 import os
-from anki_paths import collection_path as get_collection_path
+import time
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_reader, collection_writer
+from card_fetch import fetch_cards_in_deck
+import filtered_decks
+from pagination import page_request
+from streaming import stream_ndjson, wants_ndjson
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -118,6 +124,7 @@ def enum_to_dict(enum: EnumDescriptor):
 
 ###------------------------- DECKS -------------------------###
 @decks.route('/api/decks/create/<deck_name>', methods=['POST'])
+@collection_writer
 def create_deck(deck_name):
     data = request.json
     username = data.get('username')
@@ -125,13 +132,13 @@ def create_deck(deck_name):
         return jsonify({"error": "Deck name is required"}), 400
     if not username:
         return jsonify({"error": "Username is required"}), 400
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     result = col.decks.add_normal_deck_with_name(deck_name)
-    col.close()
+    release_collection(col)
     return jsonify({"id": result.id, "name": deck_name}), 201
 
 @decks.route('/api/decks/<deck_id>/change-notetype', methods=['POST'])
+@collection_writer
 def change_deck_notetype(deck_id):
     data = request.json
     new_notetype_id = data.get('new_notetype_id')
@@ -141,23 +148,22 @@ def change_deck_notetype(deck_id):
     if not new_notetype_id:
         return jsonify({"error": "New notetype ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
+        started = time.perf_counter()
         deck_id = int(deck_id)
-        new_notetype_id = int(new_notetype_id)
-        card_ids = col.decks.cids(DeckId(deck_id))
-        for card_id in card_ids:
-            note_id = col.get_card(CardId(card_id)).nid
-            change_notetype(col, note_id, new_notetype_id, match_by_name)
-        col.close()
-        return jsonify({"message": "Notetypes changed successfully"}), 200
+        # Change each note once, however many of its cards are in the deck
+        cards = fetch_cards_in_deck(col, deck_id, children=False)
+        reports = change_notetypes(col, [card.nid for card in cards], new_notetype_id, match_by_name)
+        release_collection(col)
+        return change_notetypes_response("Notetypes changed successfully", reports, started)
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/<deck_id>/set-new-card-limit', methods=['POST'])
+@collection_writer
 def set_new_card_limit(deck_id):
     data = request.json
     new_card_limit = data.get('new_card_limit')
@@ -166,8 +172,7 @@ def set_new_card_limit(deck_id):
     if new_card_limit is None:
         return jsonify({"error": "new_card_limit is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         deck_id = int(deck_id)
@@ -181,34 +186,35 @@ def set_new_card_limit(deck_id):
 
         # Save the updated configuration back to the collection
         col.decks.update_config(deck_conf)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": f"New card limit for deck {deck_id} set to {new_card_limit}"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid deck ID or new card limit"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
     
 @decks.route('/api/decks/set-current/<deck_id>', methods=['POST'])
+@collection_writer
 def set_current_deck(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         deck_id = int(deck_id)
         result = col.decks.set_current(DeckId(deck_id))
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Current deck set to {deck_id}"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
 
 @decks.route('/api/decks/config/create', methods=['POST'])
+@collection_writer
 def create_config():
     data = request.json
     name = data.get('name')
@@ -222,8 +228,7 @@ def create_config():
     if not name or new_cards_per_day is None or review_cards_per_day is None or new_mix is None or interday_learning_mix is None or review_order is None or username is None:
         return jsonify({"error": "name, new_cards_per_day, review_cards_per_day, new_mix, interday_learning_mix, and review_order are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         config_id = create_deck_config(col=col, 
@@ -234,13 +239,14 @@ def create_config():
                                        interday_learning_mix=interday_learning_mix, 
                                        review_order=review_order
                                        )
-        col.close()
+        release_collection(col)
         return jsonify({"message": "Configuration created successfully", "config_id": config_id}), 201
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/<deck_id>/config/apply', methods=['POST'])
+@collection_writer
 def apply_config(deck_id):
     data = request.json
     config_id = data.get('config_id')
@@ -249,23 +255,23 @@ def apply_config(deck_id):
     if config_id is None:
         return jsonify({"error": "config_id is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         deck_id = int(deck_id)
         config_id = int(config_id)
         apply_config_to_deck(col, deck_id, config_id)
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Configuration {config_id} applied to deck {deck_id} successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid deck ID or config ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/<deck_id>/update_mix', methods=['POST'])
+@collection_writer
 def update_deck_mix(deck_id):
     data = request.json
     new_mix = data.get('new_mix')
@@ -273,8 +279,7 @@ def update_deck_mix(deck_id):
     review_order = data.get('review_order')
     username = data.get('username')
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         update_deck_review_mix(col=col, 
@@ -282,194 +287,245 @@ def update_deck_mix(deck_id):
                                new_mix=new_mix, 
                                interday_learning_mix=interday_learning_mix, 
                                review_order=review_order)
+        release_collection(col)
         return jsonify({"message": "Deck mix settings updated successfully"}), 200
     except Exception as e:
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
     app.run(debug=True)
 
 @decks.route('/api/decks/delete/<deck_id>', methods=['DELETE'])
+@collection_writer
 def delete_deck(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         deck_id = int(deck_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         col.decks.remove([DeckId(deck_id)])
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Deck {deck_id} deleted successfully"}), 200
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/delete-filtered/<deck_id>', methods=['DELETE'])
+@collection_writer
 def delete_filtered_deck(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         deck_id = int(deck_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
 
         # Get the filtered deck
         filtered_deck = col.decks.get(deck_id)
         if not filtered_deck or not filtered_deck['dyn']:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Deck is not a filtered deck"}), 400
 
-        # Get all card IDs in the filtered deck
-        card_ids = col.decks.cids(DeckId(deck_id), children=False)
-
-        # Move the cards back to their original decks
-        for card_id in card_ids:
-            card = col.get_card(CardId(card_id))
-            col.set_deck([card_id], card.odid)
-
-        # Delete the filtered deck
-        col.decks.remove([DeckId(deck_id)])
-        col.close()
+        # Removing the deck returns all its cards to their home decks in one operation
+        filtered_decks.delete(col, {"deck_id": deck_id})
+        release_collection(col)
 
         return jsonify({"message": f"Filtered deck {deck_id} emptied and deleted successfully"}), 200
 
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+@decks.route('/api/decks/filtered', methods=['POST'])
+@collection_writer
+def filtered_deck_actions():
+    """Build, rebuild, empty or delete several filtered decks in one request.
+
+    Each item of ``decks`` names an ``action`` from
+    :data:`filtered_decks.ACTIONS`.  Items run in order, and one that fails
+    doesn't stop the rest.
+    """
+    data = request.json
+    username = data.get('username')
+    items = data.get('decks')
+
+    if not username:
+        return jsonify({"error": "Username is required"}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "decks must be a non-empty list"}), 400
+
+    started = time.perf_counter()
+    col = acquire_collection(username)
+
+    try:
+        results = []
+        for item in items:
+            action = filtered_decks.ACTIONS.get(item.get('action')) if isinstance(item, dict) else None
+            if action is None:
+                results.append({"error": f"action must be one of: {', '.join(filtered_decks.ACTIONS)}"})
+                continue
+            item_started = time.perf_counter()
+            try:
+                result = {"action": item['action'], **action(col, item)}
+            except Exception as e:
+                result = {"action": item['action'], "error": str(e)}
+            result["ms"] = round((time.perf_counter() - item_started) * 1000, 3)
+            results.append(result)
+        release_collection(col)
+        return jsonify({
+            "results": results,
+            "failed": sum(1 for result in results if "error" in result),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }), 200
+    except Exception as e:
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/rename/<deck_id>/<new_name>', methods=['PUT'])
+@collection_writer
 def rename_deck(deck_id, new_name):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     
     try:
         deck_id = int(deck_id)
         result = col.decks.rename(deck_id, new_name)
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Deck {deck_id} renamed to {new_name}"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks', methods=['GET'])
+@collection_reader
 def get_decks():
     username = request.json.get('username')
     if not username:
         return jsonify({"error": "Username is required"}), 400
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     decks = col.decks.all_names_and_ids()
-    col.close()
+    release_collection(col)
     decks_list = [{"id": deck.id, "name": deck.name} for deck in decks]
     return jsonify(decks_list)
 
 @decks.route('/api/decks/<deck_id>', methods=['GET'])
+@collection_reader
 def get_deck(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
     col = None
     
     try:
         deck_id = int(deck_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         deck = col.decks.get(deck_id)
-        col.close()
+        release_collection(col)
         return jsonify({"id": deck['id'], "name": deck['name']})
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/<deck_id>/cards', methods=['GET'])
+@collection_reader
 def get_cards_in_deck(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
     col = None
 
+    try:
+        page = page_request(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
         deck_id = int(deck_id)
-        col = Collection(collection_path)
-        # Assuming `cids` is the correct method to get card IDs from a deck
-        card_ids = col.decks.cids(DeckId(deck_id), children=True)
-        cards = [col.get_card(CardId(card_id)) for card_id in card_ids]  # Use get_card instead of col.cards.get
-        card_details = [{'id': card.id, 'note_id': card.nid, 'deck_id': card.did} for card in cards]
-        col.close()
-        return jsonify(card_details)
+        col = acquire_collection(username)
+        # Read the card columns for the deck and its children in one query
+        cards, next_cursor = page.trim(
+            fetch_cards_in_deck(col, deck_id, after_id=page.after_id, limit=page.limit), key=lambda card: (card.id,))
+
+        def entries(batch):
+            for card in batch:
+                yield {'id': card.id, 'note_id': card.nid, 'deck_id': card.did}
+
+        if wants_ndjson():
+            return stream_ndjson(col, cards, entries, page.trailer(next_cursor))
+        card_details = list(entries(cards))
+        release_collection(col)
+        return jsonify(page.body(card_details, next_cursor))
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/get-current-id', methods=['GET'])
+@collection_reader
 def get_current_deck_id():
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         current_deck_id = col.decks.get_current_id()
-        col.close()
+        release_collection(col)
         return jsonify({"current_deck_id": current_deck_id}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/current', methods=['GET'])
+@collection_reader
 def get_current_deck():
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         current_deck = col.decks.current()
-        col.close()
+        release_collection(col)
         return jsonify({"current_deck": current_deck}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @decks.route('/api/decks/active', methods=['GET'])
+@collection_reader
 def get_active_decks():
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         active_decks = col.decks.active()
         active_decks_info = [{"deck_id": deck_id} for deck_id in active_decks]
-        col.close()
+        release_collection(col)
         return jsonify(active_decks_info), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
@@ -487,36 +543,37 @@ def get_deck_config_enums():
         "ReviewMix": enum_to_dict(config_class.ReviewMix.DESCRIPTOR),
         "LeechAction": enum_to_dict(config_class.LeechAction.DESCRIPTOR),
         "AnswerAction": enum_to_dict(config_class.AnswerAction.DESCRIPTOR),
-        "QuestionAction": enum_to_dict(config_class.QuestionAction.DESCRIPTOR)
+        "QuestionAction": enum_to_dict(config_class.QuestionAction.DESCRIPTOR),
+        "FilteredSearchOrder": filtered_decks.ORDERS
     }
 
     return jsonify(enums_dict), 200
 
 @decks.route('/api/decks/<deck_id>/config', methods=['GET'])
+@collection_reader
 def get_deck_config(deck_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
     col = None
 
     try:
         deck_id = int(deck_id)  # Ensure deck_id is an integer
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         deck_config = col.decks.config_dict_for_deck_id(DeckId(deck_id))
         
         if deck_config is None:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Deck configuration not found"}), 404
         
-        col.close()
+        release_collection(col)
         return jsonify({"config": deck_config}), 200
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid deck ID"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
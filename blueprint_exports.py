@@ -16,7 +16,9 @@ from anki.consts import (
 )
 
 import os
-from anki_paths import collection_path as get_collection_path, anki_base as get_anki_base
+from anki_paths import anki_base as get_anki_base
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_reader, collection_writer
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -37,6 +39,7 @@ exports = Blueprint('exports', __name__)
 
 
 @exports.route('/api/export-collection-package', methods=['POST'])
+@collection_writer
 def export_collection_package():
     data = request.json
     include_media = data.get('include_media', None)
@@ -56,13 +59,15 @@ def export_collection_package():
             legacy = False
 
     
-    collection_path = get_collection_path(username)
     out_path = os.path.join(get_anki_base(username), "collection.apkg")
-    col = Collection(path=collection_path)  # Adjust path as necessary
+    col = acquire_collection(username)
     try:
+        # Exporting closes the collection; the pool reopens it on next use.
         col.export_collection_package(out_path=out_path, include_media=include_media, legacy=legacy)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
+    finally:
+        release_collection(col)
     
     try:
         return send_file(out_path, as_attachment=True)
@@ -70,6 +75,7 @@ def export_collection_package():
         return jsonify({"success": False, "message": f"Failed to retrieve file: {str(e)}"})
 
 @exports.route('/api/export-anki-package', methods=['POST'])
+@collection_reader
 def export_anki_package():
     out_path = request.args.get('out_path')
     username = request.args.get('username')  
@@ -89,13 +95,13 @@ def export_anki_package():
     except Exception as e:
         return jsonify({"success": False, "message": f"failed to create export options: {str(e)}"})
     
-    collection_path = get_collection_path(username)
-    
-    col = Collection(path=collection_path)  # Adjust path as necessary
+    col = acquire_collection(username)
     try:
         col.export_anki_package(out_path=out_path, options=options, limit=export_limit)
     except Exception as e:
         return jsonify({"success": False, "message": f"failed to export anki package: {str(e)}, options: {options}, limit: {export_limit}"})
+    finally:
+        release_collection(col)
 
     try:
         return send_file(out_path, as_attachment=True)
@@ -103,6 +109,7 @@ def export_anki_package():
         return jsonify({"success": False, "message": f"Failed to retrieve file: {str(e)}"})
 
 @exports.route('/api/export-note-csv', methods=['POST'])
+@collection_reader
 def export_note_csv():
     out_path = request.args.get('out_path')
     with_html = request.args.get('with_html', False)
@@ -120,13 +127,13 @@ def export_note_csv():
     deck_id_limit = DeckIdLimit(deck_id=int(deck_id))
     export_limit: ExportLimit = deck_id_limit
     
-    collection_path = get_collection_path(username)
-    
-    col = Collection(path=collection_path)  # Adjust path as necessary
+    col = acquire_collection(username)
     try:
         col.export_note_csv(out_path=out_path, with_html=with_html, with_tags=with_tags, with_deck=with_deck, with_notetype=with_notetype, with_guid=with_guid, limit=export_limit)
     except Exception as e:
         return jsonify({"success": False, "message": f"failed to export note csv: {str(e)}, out_path: {out_path}, {type(out_path)}, with_html: {with_html, {type(with_html)}}, with_tags: {with_tags}, {type(with_tags)}, with_deck: {with_deck}, {type(with_deck)}, with_notetype: {with_notetype}, {type(with_notetype)}, with_guid: {with_guid}, {type(with_guid)}, limit: {export_limit}, {type(export_limit)}, deck_id: {deck_id}, {type(deck_id)}"})
+    finally:
+        release_collection(col)
 
     try:
         return send_file(out_path, as_attachment=True)
@@ -16,7 +16,9 @@ from anki.consts import (
     QUEUE_TYPE_PREVIEW
 )
 import os
-from anki_paths import collection_path as get_collection_path, media_path as get_media_path
+from anki_paths import media_path as get_media_path
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_writer
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -42,14 +44,12 @@ imports = Blueprint('imports', __name__)
 
 ###------------------------- IMPORT -------------------------###
 @imports.route('/api/import-package', methods=['POST'])
+@collection_writer
 def import_package():
     username = request.args.get('username')  # Assuming username is passed as a query parameter
     if not username:
         return jsonify({"error": "Username is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
-    
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
 
@@ -93,6 +93,7 @@ def import_package():
         return jsonify({"error": str(e)}), 500
 
     ## Perform the import
+    col = acquire_collection(username)
     try:
         import_log = col.import_anki_package(import_request)
         os.remove(temp_file_path)  # Clean up the temporary file
@@ -100,8 +101,11 @@ def import_package():
     except Exception as e:
         os.remove(temp_file_path)  # Ensure temporary file is cleaned up on failure
         return jsonify({"error": str(e)}), 500
+    finally:
+        release_collection(col)
 
 @imports.route('/api/import-csv', methods=['POST'])
+@collection_writer
 def import_csv():
     username = request.args.get('username')
     target_deck_name = request.args.get('target_deck')  # Assume this is also passed in
@@ -113,37 +117,36 @@ def import_csv():
     delimiter = request.args.get('delimiter', 'COMMA')
     delimiter_enum = CsvMetadata.Delimiter.Value(delimiter.upper())
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     if not notetype_name or not target_deck_name:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Notetype and deck are required"}), 400
 
     notetype = col.models.by_name(notetype_name)
     if not notetype:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype name"}), 400
 
     target_deck_id = col.decks.id_for_name(target_deck_name)
     if not target_deck_id:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid deck name"}), 400
 
     if 'file' not in request.files:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "No file part"}), 400
 
     file = request.files['file']
     if file.filename == '':
-        col.close()
+        release_collection(col)
         return jsonify({"error": "No selected file"}), 400
 
     temp_file_dir = os.path.expanduser(f"~/temp")
     os.makedirs(temp_file_dir, exist_ok=True)
 
     if not os.path.exists(temp_file_dir):
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Failed to create temp dir"}), 500
 
 
@@ -152,15 +155,15 @@ def import_csv():
         temp_file_path = os.path.join(temp_file_dir, file.filename)
         file.save(temp_file_path)
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
     # Verify file was written
     if not os.path.exists(temp_file_path):
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Failed to save the file"}), 500
     if os.path.getsize(temp_file_path) == 0:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Saved file is empty"}), 500
 
     try:
@@ -184,6 +187,7 @@ def import_csv():
         import_request.path = temp_file_path
         import_request.metadata.CopyFrom(metadata)
     except Exception as e:
+        release_collection(col)
         return jsonify({"error": f"{str(e)}"}), 500
 
     ## Perform the import
@@ -194,6 +198,7 @@ def import_csv():
         # Get the ID of the "Default" deck
         default_deck_id = col.decks.id_for_name("Default")
         if not default_deck_id:
+            release_collection(col)
             return jsonify({"error": "Default deck not found"}), 404
 
         # Retrieve all card IDs from the "Default" deck
@@ -201,12 +206,12 @@ def import_csv():
 
         # Move the cards to the target deck
         col.set_deck(default_deck_card_ids, target_deck_id)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "CSV imported and cards moved successfully"}), 200
     except Exception as e:
         os.remove(temp_file_path)  # Ensure temporary file is cleaned up on failure
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
@@ -0,0 +1,28 @@
+from flask import jsonify, Blueprint, send_from_directory
+from werkzeug.exceptions import NotFound
+
+import os
+from anki_paths import media_path as get_media_path
+
+media = Blueprint('media', __name__)
+
+# Seconds clients may reuse a media file before revalidating it
+MEDIA_MAX_AGE = int(os.environ.get('ANKI_API_MEDIA_MAX_AGE', 3600))
+
+###------------------------- MEDIA -------------------------###
+@media.route('/api/media/<username>/<path:filename>', methods=['GET'])
+def get_media_file(username, filename):
+    """Serve a file from the user's collection.media folder.
+
+    Responses carry ETag and Last-Modified headers and honour conditional and
+    Range requests, so audio can be seeked and unchanged files are answered
+    with 304.  With USE_X_SENDFILE enabled the front-end server sends the file.
+    """
+    media_dir = get_media_path(username)
+    if not os.path.isdir(media_dir):
+        return jsonify({"error": f"No media folder for user '{username}'"}), 404
+
+    try:
+        return send_from_directory(media_dir, filename, conditional=True, max_age=MEDIA_MAX_AGE)
+    except NotFound:
+        return jsonify({"error": f"Media file '{filename}' not found"}), 404
@@ -18,7 +18,10 @@ from anki.consts import (
 
 
 import os
-from anki_paths import collection_path as get_collection_path
+import time
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_reader, collection_writer
+from card_fetch import fetch_notes
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -34,37 +37,64 @@ state_map = {
 
 notetypes = Blueprint('notetypes_blueprint', __name__)
 
+# Largest number of notes /api/notetypes/update-notes accepts at once
+MAX_BATCH_UPDATES = int(os.environ.get("ANKI_API_MAX_BATCH_UPDATES", 50000))
+
+###----------------------- HELPERS -----------------------###
+def parse_note_update(update):
+    """Return ``(note_id, fields, tags)`` from one entry of a batch update.
+
+    *tags* is ``None`` when the entry leaves them alone.  Raises
+    :class:`ValueError` describing what is wrong with the entry.
+    """
+    if not isinstance(update, dict):
+        raise ValueError("each note must be an object")
+    fields = update.get('fields') or {}
+    tags = update.get('tags')
+    try:
+        note_id = int(update.get('note_id'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid note ID format")
+    if not isinstance(fields, dict) or not all(isinstance(value, str) for value in fields.values()):
+        raise ValueError("fields must map field names to strings")
+    if tags is not None and (not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags)):
+        raise ValueError("tags must be a list of strings")
+    if not fields and tags is None:
+        raise ValueError("At least fields or tags must be provided")
+    return note_id, fields, tags
+
 ###------------------------- NOTETYPES -------------------------###
 @notetypes.route('/api/notetypes/notes', methods=['GET'])
+@collection_reader
 def get_notetypes():
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         notetypes = col.models.all_names_and_ids()
-        col.close()
+        release_collection(col)
         return jsonify([{"id": nt.id, "name": nt.name} for nt in notetypes]), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/cards/<int:card_id>/notetype', methods=['GET'])
+@collection_reader
 def get_notetype_id_by_card_id(card_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     try:
         card = col.get_card(card_id)
         notetype_id = card.note_type()["id"]
-        col.close()
+        release_collection(col)
         return jsonify({"notetype_id": notetype_id}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/create-with-fields', methods=['POST'])
+@collection_writer
 def create_notetype_with_fields():
     data = request.json
     notetype_name = data.get('name')
@@ -81,8 +111,7 @@ def create_notetype_with_fields():
     if not base_notetype_id:
         return jsonify({"error": "Base notetype ID is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         # Fetch the base notetype to copy the template from
@@ -120,14 +149,15 @@ def create_notetype_with_fields():
         col.models.add(new_notetype)
 
         # Commit changes and close the collection
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "Notetype created successfully", "notetype_id": new_notetype['id']}), 201
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/set-sort-field', methods=['POST'])
+@collection_writer
 def set_sort_field(notetype_id):
     data = request.json
     field_name = data.get('field_name')
@@ -135,37 +165,37 @@ def set_sort_field(notetype_id):
     if not field_name or not username:
         return jsonify({"error": "Field name and username are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Find the field index
         field_index = next((idx for idx, fld in enumerate(notetype['flds']) if fld['name'] == field_name), None)
         if field_index is None:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Field not found"}), 404
 
         # Set the sort field
         notetype['sortf'] = field_index
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": f"Sort field set to '{field_name}'"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
 @notetypes.route('/api/notetypes/<notetype_id>/reorder-fields', methods=['POST'])
+@collection_writer
 def reorder_fields(notetype_id):
     data = request.json
     new_order = data.get('new_order')  # Dictionary with field names as keys and new order as values
@@ -174,19 +204,18 @@ def reorder_fields(notetype_id):
     if not new_order or not username:
         return jsonify({"error": "New order of fields is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Verify that the new order has the same number of fields
         if len(new_order) != len(notetype['flds']):
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Mismatch in number of fields"}), 400
 
         # Reorder fields according to new_order
@@ -199,27 +228,28 @@ def reorder_fields(notetype_id):
                 field['ord'] = new_ord
                 reordered_fields[new_ord] = field
             else:
-                col.close()
+                release_collection(col)
                 return jsonify({"error": f"Field '{field_name}' not found in notetype"}), 404
 
         # Ensure no None values in reordered_fields
         if None in reordered_fields:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Invalid field order provided"}), 400
 
         notetype['flds'] = reordered_fields
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "Fields reordered successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/add-template', methods=['POST'])
+@collection_writer
 def add_template_to_notetype(notetype_id):
     data = request.json
     template_name = data.get('template_name')
@@ -230,14 +260,13 @@ def add_template_to_notetype(notetype_id):
     if not template_name or not qfmt or not afmt or not username:
         return jsonify({"error": "template_name, qfmt, and afmt are required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Create a new template
@@ -248,17 +277,18 @@ def add_template_to_notetype(notetype_id):
 
         # Save the updated notetype
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "Template added successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/update-template', methods=['POST'])
+@collection_writer
 def update_template(notetype_id):
     data = request.json
     template_index = data.get('template_index', 0)
@@ -271,18 +301,17 @@ def update_template(notetype_id):
     if qfmt is None and afmt is None:
         return jsonify({"error": "At least qfmt or afmt must be provided"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         if template_index >= len(notetype['tmpls']):
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Template index out of range"}), 400
 
         if qfmt is not None:
@@ -291,17 +320,18 @@ def update_template(notetype_id):
             notetype['tmpls'][template_index]['afmt'] = afmt
 
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "Template updated successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/update-css', methods=['POST'])
+@collection_writer
 def update_notetype_css(notetype_id):
     data = request.json
     new_css = data.get('css')
@@ -310,14 +340,13 @@ def update_notetype_css(notetype_id):
     if not new_css:
         return jsonify({"error": "CSS content is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Update the CSS
@@ -325,17 +354,18 @@ def update_notetype_css(notetype_id):
 
         # Save the updated notetype
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
 
         return jsonify({"message": "CSS updated successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/fields', methods=['POST'])
+@collection_writer
 def add_field_to_notetype(notetype_id):
     data = request.json
     field_name = data.get('field_name')
@@ -344,14 +374,13 @@ def add_field_to_notetype(notetype_id):
     if not field_name or not username:
         return jsonify({"error": "Field name is required"}), 400
 
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
     new_field = FieldDict()
 
     try:
         notetype = col.models.get(NotetypeId(int(notetype_id)))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Create a new field dictionary
@@ -368,122 +397,122 @@ def add_field_to_notetype(notetype_id):
         # Add the new field
         col.models.add_field(notetype, new_field)
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Field '{field_name}' added to notetype {notetype_id}"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 
 @notetypes.route('/api/notetypes/<notetype_id>/css', methods=['GET'])
+@collection_reader
 def get_notetype_css(notetype_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         css = notetype.get('css', '')
-        col.close()
+        release_collection(col)
         return jsonify({"css": css}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/templates', methods=['GET'])
+@collection_reader
 def get_notetype_templates(notetype_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         templates = notetype.get('tmpls', [])
-        col.close()
+        release_collection(col)
         return jsonify({"templates": templates}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/fields', methods=['GET'])
+@collection_reader
 def get_notetype_fields(notetype_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         fields = notetype.get('flds', [])
-        col.close()
+        release_collection(col)
         return jsonify({"fields": fields}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/get-sort-field', methods=['GET'])
+@collection_reader
 def get_sort_field(notetype_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         sort_field_index = notetype['sortf']
         sort_field_name = notetype['flds'][sort_field_index]['name'] if sort_field_index < len(notetype['flds']) else None
 
-        col.close()
+        release_collection(col)
         return jsonify({"sort_field": sort_field_name}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/fields/<field_name>', methods=['DELETE'])
+@collection_writer
 def remove_field_from_notetype(notetype_id, field_name):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype = col.models.get(NotetypeId(int(notetype_id)))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Find the field to remove
@@ -494,44 +523,45 @@ def remove_field_from_notetype(notetype_id, field_name):
                 break
 
         if not field_to_remove:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Field not found"}), 404
 
         # Remove the field
         col.models.remove_field(notetype, field_to_remove)
         col.models.save(notetype)
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Field '{field_name}' removed from notetype {notetype_id}"}), 200
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/<notetype_id>/delete', methods=['DELETE'])
+@collection_writer
 def delete_notetype(notetype_id):
     data = request.json
     username = data.get('username')
-    collection_path = get_collection_path(username)
-    col = Collection(collection_path)
+    col = acquire_collection(username)
 
     try:
         notetype_id = int(notetype_id)  # Ensure the ID is an integer
         notetype = col.models.get(NotetypeId(notetype_id))
         if not notetype:
-            col.close()
+            release_collection(col)
             return jsonify({"error": "Notetype not found"}), 404
 
         # Perform the deletion
         col.models.remove(NotetypeId(notetype_id))
-        col.close()
+        release_collection(col)
         return jsonify({"message": f"Notetype {notetype_id} deleted successfully"}), 200
     except ValueError:
-        col.close()
+        release_collection(col)
         return jsonify({"error": "Invalid notetype ID"}), 400
     except Exception as e:
-        col.close()
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
 
 @notetypes.route('/api/notetypes/update-note/<note_id>', methods=['POST'])
+@collection_writer
 def update_note_fields(note_id):
     """
     Update the fields of a note.
@@ -543,29 +573,30 @@ def update_note_fields(note_id):
         username: The username of the profile
         fields: Dictionary of field names and their new values
         tags: Optional list of tags to set for the note
+        echo: Whether to return the saved fields and tags (default true)
     """
     data = request.json
     username = data.get('username')
     fields = data.get('fields')
     tags = data.get('tags')
+    echo = data.get('echo', True)
     
     if not username:
         return jsonify({"error": "Username is required"}), 400
     if not fields and tags is None:
         return jsonify({"error": "At least fields or tags must be provided"}), 400
     
-    collection_path = get_collection_path(username)
     col = None
     
     try:
         note_id = int(note_id)
-        col = Collection(collection_path)
+        col = acquire_collection(username)
         
         # Check if the note exists
         try:
             note = col.get_note(note_id)
         except Exception:
-            col.close()
+            release_collection(col)
             return jsonify({"error": f"Note with ID {note_id} not found"}), 404
         
         # Update fields
@@ -574,7 +605,7 @@ def update_note_fields(note_id):
                 if field_name in note:
                     note[field_name] = new_value
                 else:
-                    col.close()
+                    release_collection(col)
                     return jsonify({"error": f"Field '{field_name}' does not exist in this note"}), 400
         
         # Update tags if provided
@@ -584,11 +615,15 @@ def update_note_fields(note_id):
         # Save the note
         col.update_note(note)
         
+        if not echo:
+            release_collection(col)
+            return jsonify({"message": "Note updated successfully", "note_id": note_id}), 200
+
         # Get updated note for response
         updated_note = col.get_note(note_id)
         field_contents = {field_name: updated_note[field_name] for field_name in updated_note.keys()}
         
-        col.close()
+        release_collection(col)
         return jsonify({
             "message": "Note updated successfully",
             "note_id": note_id,
@@ -597,9 +632,109 @@ def update_note_fields(note_id):
         }), 200
     except ValueError:
         if col:
-            col.close()
+            release_collection(col)
         return jsonify({"error": "Invalid note ID format"}), 400
     except Exception as e:
         if col:
-            col.close()
+            release_collection(col)
+        return jsonify({"error": str(e)}), 500
+
+@notetypes.route('/api/notetypes/update-notes', methods=['POST'])
+@collection_writer
+def update_notes_fields():
+    """
+    Update the fields and/or tags of many notes at once.
+
+    Request body:
+        username: The username of the profile
+        notes: List of {note_id, fields, tags}; fields holds only the fields to change
+        echo: Whether to return each note's saved fields and tags (default false)
+
+    Notes whose fields and tags already have the requested values are not
+    written.  The rest are saved in one transaction.
+    """
+    data = request.json
+    username = data.get('username')
+    updates = data.get('notes')
+    echo = data.get('echo', False)
+
+    if not username or not isinstance(updates, list) or not updates:
+        return jsonify({"error": "username and a non-empty notes list are required"}), 400
+    if len(updates) > MAX_BATCH_UPDATES:
+        return jsonify({"error": f"At most {MAX_BATCH_UPDATES} notes can be updated per request"}), 400
+
+    started = time.perf_counter()
+    results = [None] * len(updates)
+    requested = {}
+    for position, update in enumerate(updates):
+        try:
+            note_id, fields, tags = parse_note_update(update)
+            if note_id in requested:
+                raise ValueError(f"Note {note_id} appears more than once")
+        except ValueError as e:
+            results[position] = {"index": position, "error": str(e)}
+            continue
+        requested[note_id] = (position, fields, tags)
+
+    col = acquire_collection(username)
+
+    try:
+        # Every requested note is compared in one pass; only those that change are loaded and written
+        current = fetch_notes(col, requested)
+        notes = []
+        for note_id, (position, fields, tags) in requested.items():
+            stored = current.get(note_id)
+            if stored is None:
+                results[position] = {"index": position, "note_id": note_id, "error": f"Note with ID {note_id} not found"}
+                continue
+            stored_fields = stored.field_dict()
+            missing = [field_name for field_name in fields if field_name not in stored_fields]
+            if missing:
+                results[position] = {"index": position, "note_id": note_id,
+                                     "error": f"Field '{missing[0]}' does not exist in this note"}
+                continue
+            fields = {field_name: value for field_name, value in fields.items() if stored_fields[field_name] != value}
+            if tags is not None and set(tags) == set(stored.tags):
+                tags = None
+            if not fields and tags is None:
+                results[position] = {"index": position, "note_id": note_id, "status": "unchanged"}
+                continue
+            note = col.get_note(note_id)
+            for field_name, value in fields.items():
+                note[field_name] = value
+            if tags is not None:
+                note.tags = tags
+            notes.append((note, position))
+        if notes:
+            try:
+                col.update_notes([note for note, _ in notes])
+            except Exception:
+                # One bad note fails the whole call; save them one by one to find it
+                for note, position in notes:
+                    try:
+                        col.update_note(note)
+                    except Exception as e:
+                        results[position] = {"index": position, "note_id": note.id, "error": str(e)}
+        for note, position in notes:
+            if results[position] is None:
+                results[position] = {"index": position, "note_id": note.id, "status": "updated"}
+
+        if echo:
+            saved = fetch_notes(col, [result["note_id"] for result in results if "status" in result])
+            for result in results:
+                if "status" in result:
+                    result["fields"] = saved[result["note_id"]].field_dict()
+                    result["tags"] = saved[result["note_id"]].tags
+
+        release_collection(col)
+        counts = {status: sum(1 for result in results if result.get("status") == status)
+                  for status in ("updated", "unchanged")}
+        return jsonify({
+            "results": results,
+            **counts,
+            "failed": sum(1 for result in results if "error" in result),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)
+        }), 200
+    except Exception as e:
+        release_collection(col)
         return jsonify({"error": str(e)}), 500
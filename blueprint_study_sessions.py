@@ -1,4 +1,4 @@
-from flask import jsonify, request, Blueprint
+from flask import jsonify, request, Blueprint, url_for
 from anki.collection import  Collection
 from anki.notes import NoteId
 
@@ -9,15 +9,13 @@ from anki import scheduler_pb2
 import os
 import re
 import base64
-from anki_paths import collection_path as get_collection_path, media_path as get_media_path
+from collection_pool import acquire_collection, release_collection
+from collection_executor import collection_writer
+from caches import media_cache
+from study_session_registry import DEFAULT_PREFETCH, MEDIA_MODES, registry as session_registry
 
 study_sessions = Blueprint('study_sessions', __name__)
 
-collection_path = None
-collection = None
-scheduler = None
-current_card = None
-media_path = None
 sound_pattern = re.compile(r'\[sound:(.*?)\]')
 img_pattern = re.compile(r'<img src="(.*?)"')
 
@@ -75,9 +73,45 @@ def extract_media_filenames(field_value):
 
     return media_files
 
-def process_media_files(fields_data, media_path):
+def media_url(username, filename):
+    """Return the /api/media URL that serves *filename* for *username*."""
+    return url_for('media.get_media_file', username=username, filename=filename)
+
+def encode_media_file(username, filename, media_file_path, stat):
+    """
+    Return (base64_data, mime_type) for a media file.
+    Encodings are cached by name, mtime and size, so a changed file is re-read.
+    """
+    key = (username, filename, stat.st_mtime_ns, stat.st_size)
+    cached = media_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with open(media_file_path, 'rb') as media_file:
+        base64_data = base64.b64encode(media_file.read()).decode('utf-8')
+
+    # Determine mime type based on file extension
+    ext = filename.lower().split('.')[-1]
+    mime_type = {
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'gif': 'image/gif',
+        'svg': 'image/svg+xml',
+        'webp': 'image/webp',
+        'mp3': 'audio/mpeg',
+        'wav': 'audio/wav',
+        'ogg': 'audio/ogg',
+    }.get(ext, 'application/octet-stream')
+
+    media_cache.put(key, (base64_data, mime_type), len(base64_data))
+    return base64_data, mime_type
+
+def process_media_files(fields_data, media_path, username=None, media_mode='url'):
     """
-    Process media files and replace references with data URLs in the fields.
+    Process media files referenced in the fields.
+    In 'url' mode image sources point at the media endpoint and media_files maps
+    each filename to its URL; in 'inline' mode both carry base64 data.
     Returns tuple of (updated_fields_data, media_files_dict)
     """
     media_files = {}
@@ -89,32 +123,27 @@ def process_media_files(fields_data, media_path):
 
         for filename in filenames:
             media_file_path = os.path.join(media_path, filename)
-            if os.path.exists(media_file_path):
-                with open(media_file_path, 'rb') as media_file:
-                    file_data = media_file.read()
-                    base64_data = base64.b64encode(file_data).decode('utf-8')
-                    media_files[filename] = base64_data
-
-                    # Determine mime type based on file extension
-                    ext = filename.lower().split('.')[-1]
-                    mime_type = {
-                        'png': 'image/png',
-                        'jpg': 'image/jpeg',
-                        'jpeg': 'image/jpeg',
-                        'gif': 'image/gif',
-                        'svg': 'image/svg+xml',
-                        'webp': 'image/webp',
-                        'mp3': 'audio/mpeg',
-                        'wav': 'audio/wav',
-                        'ogg': 'audio/ogg',
-                    }.get(ext, 'application/octet-stream')
-
-                    # Create data URL
-                    data_url = f"data:{mime_type};base64,{base64_data}"
-
-                    # Replace image src references with data URLs
-                    updated_value = updated_value.replace(f'src="{filename}"', f'src="{data_url}"')
-                    updated_value = updated_value.replace(f"src='{filename}'", f"src='{data_url}'")
+            try:
+                stat = os.stat(media_file_path)
+            except OSError:
+                continue
+
+            if media_mode != 'inline':
+                url = media_url(username, filename)
+                media_files[filename] = url
+                updated_value = updated_value.replace(f'src="{filename}"', f'src="{url}"')
+                updated_value = updated_value.replace(f"src='{filename}'", f"src='{url}'")
+                continue
+
+            base64_data, mime_type = encode_media_file(username, filename, media_file_path, stat)
+            media_files[filename] = base64_data
+
+            # Create data URL
+            data_url = f"data:{mime_type};base64,{base64_data}"
+
+            # Replace image src references with data URLs
+            updated_value = updated_value.replace(f'src="{filename}"', f'src="{data_url}"')
+            updated_value = updated_value.replace(f"src='{filename}'", f"src='{data_url}'")
 
         updated_fields[field_name] = updated_value
 
@@ -125,6 +154,7 @@ def process_media_files(fields_data, media_path):
 ### --------------------- STUDY SESSION ---------------------###
 
 @study_sessions.route('/api/study/counts', methods=['POST'])
+@collection_writer
 def study_counts():
     """Return counts of new, learning, and review cards for the given deck.
 
@@ -138,9 +168,6 @@ def study_counts():
       - review: int
       - total: int
     """
-    global collection, scheduler, collection_path
-    from anki.scheduler.v3 import Scheduler as V3Scheduler
-
     data = request.json
     username = data.get('username')
     deck_id = data.get('deck_id')
@@ -148,15 +175,16 @@ def study_counts():
     if not username or deck_id is None:
         return jsonify({"error": "username and deck_id are required"}), 400
 
-    # Use a temporary collection to avoid locking the main one
     temp_collection = None
+    previous_deck_id = None
     try:
-        # Always use a temporary collection for counts to avoid conflicts
-        temp_collection_path = get_collection_path(username)
-        temp_collection = Collection(temp_collection_path)
+        # Share the pooled handle; a second open of the same file would fail
+        temp_collection = acquire_collection(username)
         temp_scheduler = V3Scheduler(temp_collection)
 
-        # Select the requested deck context
+        # Select the requested deck context, restoring the previous one
+        # afterwards as the pooled handle may be serving a study session
+        previous_deck_id = temp_collection.decks.get_current_id()
         temp_collection.decks.select(deck_id)
 
         # Fetch counts: (new, learning, review)
@@ -171,86 +199,146 @@ def study_counts():
     except Exception as e:
         return jsonify({"error": f"Error fetching counts: {e}"}), 500
     finally:
-        # Always close the temporary collection to release locks
         if temp_collection is not None:
-            temp_collection.close()
+            try:
+                if previous_deck_id is not None:
+                    temp_collection.decks.select(previous_deck_id)
+            finally:
+                release_collection(temp_collection)
+
+
+@study_sessions.route('/api/study/sessions', methods=['POST'])
+@collection_writer
+def create_study_session():
+    """Open a new study session and return its token.
+
+    Pass the returned session_id to /api/study to run several study loops,
+    for the same or different users, side by side.  An optional ``prefetch``
+    sets how many queued cards the session fetches ahead.
+    """
+    data = request.json
+    username = data.get('username')
+    prefetch = data.get('prefetch', DEFAULT_PREFETCH)
+
+    if not username:
+        return jsonify({"error": "username is required"}), 400
+    if not isinstance(prefetch, int) or prefetch < 0:
+        return jsonify({"error": "prefetch must be a non-negative integer"}), 400
+
+    try:
+        session = session_registry.create(username, prefetch)
+    except Exception as e:
+        return jsonify({"error": f"Error opening study session: {e}"}), 500
+    return jsonify({"session_id": session.session_id}), 201
+
+
+@study_sessions.route('/api/study/sessions', methods=['GET'])
+def list_study_sessions():
+    """Report a user's live study sessions.
+
+    Session tokens are not listed: a token is the only handle on its session.
+    """
+    data = request.get_json(silent=True) or {}
+    username = data.get('username') or request.args.get('username')
+    if not username:
+        return jsonify({"error": "username is required"}), 400
+    return jsonify(session_registry.stats(username)), 200
 
 
 @study_sessions.route('/api/study', methods=['POST'])
+@collection_writer
 def study():
-    global collection, scheduler, current_card, collection_path, media_path
-
     data = request.json
     action = data.get('action')
     deck_id = data.get('deck_id')
     username = data.get('username')
-
-    # Ensure collection is open
-    if collection is None:
-        collection_path = get_collection_path(username)
-        media_path = get_media_path(username)
-        collection = Collection(collection_path)
-        scheduler = V3Scheduler(collection)
+    session_id = data.get('session_id')
+
+    if not session_id and not username:
+        return jsonify({"error": "username or session_id is required"}), 400
+    if data.get('media_mode') not in (None,) + MEDIA_MODES:
+        return jsonify({"error": f"media_mode must be one of {', '.join(MEDIA_MODES)}"}), 400
+    prefetch = data.get('prefetch')
+    if prefetch is not None and (not isinstance(prefetch, int) or prefetch < 0):
+        return jsonify({"error": "prefetch must be a non-negative integer"}), 400
+
+    # Clients that do not send a token share one session per user
+    if session_id:
+        session = session_registry.get(session_id)
+        if session is None:
+            return jsonify({"error": "Unknown or expired study session."}), 404
+        if username and session.username != username:
+            return jsonify({"error": "Study session belongs to another user."}), 403
+    elif action == 'close':
+        session = session_registry.default_for(username)
+    else:
+        session = session_registry.default_for(username, create=True)
+
+    if session is None:
+        return jsonify({"message": "Collection closed."}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
+
+    with session.lock:
+        session.touch()
+        return study_action(session, action, deck_id, prefetch, data.get('media_mode'))
+
+
+def study_action(session, action, deck_id, prefetch=None, media_mode=None):
+    collection = session.collection
+    media_path = session.media_path
+    if media_mode is not None:
+        session.media_mode = media_mode
 
     try:
         if action == 'start':
+            session.deck_id = deck_id
+            if prefetch is not None:
+                session.set_prefetch(prefetch)
+            session.reset_queue()
             collection.decks.select(deck_id)
-            queued_cards = scheduler.get_queued_cards(fetch_limit=1)
-            if not queued_cards.cards:
-                return jsonify({"status": "finished", "remaining": 0, "message": "No more cards to review."}), 200
+            next_card = session.next_card()
+            if next_card is None:
+                return jsonify({"status": "finished", "remaining": 0, "message": "No more cards to review.", "session_id": session.session_id}), 200
 
-            current_card = queued_cards.cards[0]
-            note = collection.get_note(NoteId(current_card.card.note_id))
-            notetype = collection.models.get(note.mid)
+            current_card, note, notetype, remaining = next_card
             template = notetype['tmpls'][0]  # Get the template for the card's ordinal
             front_template = template['qfmt']  # Get the front template HTML
 
-            current_card = collection.get_card(current_card.card.id)
-            current_card.start_timer()
-
             # Extract fields used in the front template
             fields_data = {field_name: note[field_name] for field_name in note.keys() if "{{" + field_name + "}}" in front_template}
 
             # Extract fields and media files using the helper function
-            fields_data, media_files = process_media_files(fields_data, media_path)
+            fields_data, media_files = process_media_files(fields_data, media_path, session.username, session.media_mode)
 
-            counts = scheduler.counts()
-            remaining = sum(counts)
-
-            return jsonify({"front": fields_data, "card_id": current_card.id, "note_id": int(note.id), "remaining": remaining, "media_files": media_files}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
+            return jsonify({"front": fields_data, "card_id": current_card.id, "note_id": int(note.id), "remaining": remaining, "media_files": media_files, "session_id": session.session_id}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
 
         elif action == 'flip':
+            current_card = session.current_card
             if current_card is None:
                 return jsonify({"error": "No card to flip."}), 400
 
-            note = collection.get_note(NoteId(current_card.nid))
-            notetype = collection.models.get(note.mid)
+            note = session.current_note
+            notetype = session.current_notetype
             template = notetype['tmpls'][0]  # Get the template for the card's ordinal
             back_template = template['afmt']  # Get the back template HTML
 
             # Extract fields used in the back template
             fields_data = {field_name: note[field_name] for field_name in note.keys() if "{{" + field_name + "}}" in back_template}
             try:
-                ease_enumerations = {1: "Again", 2: "Hard", 3: "Good", 4: "Easy" }
-                ease_dict = {}
-                for i in range(1, 5):
-                    ease_dict[str(i)] = scheduler.nextIvlStr(current_card, i)
+                # Labels come from the states fetched with the card
+                ease_dict = {str(i): label for i, label in enumerate(session.ease_labels(), start=1)}
             except Exception as e:
                 return jsonify({"error": f"Error getting ease options: {e}"}), 500
 
             # Extract fields and media files using the helper function
-            fields_data, media_files = process_media_files(fields_data, media_path)
+            fields_data, media_files = process_media_files(fields_data, media_path, session.username, session.media_mode)
             return jsonify({"back": fields_data, "note_id": int(current_card.nid), "ease_options": ease_dict, "media_files": media_files}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
 
         elif action in ['1', '2', '3', '4']:
-            if current_card is None:
+            if session.current_card is None:
                 return jsonify({"error": "No card to answer."}), 400
             ease = int(action)
-            # Fetch the current scheduling states for the card
-            card_id = current_card.id
-            states = scheduler.col._backend.get_scheduling_states(card_id)
-            if current_card.timer_started is None:
-                current_card.start_timer()
+            # Another session on the same collection may have changed the current deck
+            session.select_deck()
 
             # Determine the rating based on the action
             rating_map = {
@@ -263,40 +351,26 @@ def study():
             if rating is None:
                 return jsonify({"error": "Invalid action."}), 400
 
-            # Build the CardAnswer object
-            card_answer = scheduler.build_answer(card=current_card, states=states, rating=rating)
-            # Answer the card
-            scheduler.answer_card(card_answer)
+            # Answer with the scheduling states fetched alongside the card
+            time_taken = session.answer(rating)
 
-            # Fetch the next queued card
-            queued_cards = scheduler.get_queued_cards(fetch_limit=1)
-            if not queued_cards.cards:
+            # Take the next card, from the prefetched queue when possible
+            next_card = session.next_card()
+            if next_card is None:
                 return jsonify({"status": "finished", "remaining": 0, "message": "No more cards to review."}), 200
-            current_card = queued_cards.cards[0]
-            note = collection.get_note(NoteId(current_card.card.note_id))
-            notetype = collection.models.get(note.mid)
+            current_card, note, notetype, remaining = next_card
             template = notetype['tmpls'][0]  # Get the template for the card's ordinal
             front_template = template['qfmt']
 
-            current_card = collection.get_card(current_card.card.id)
-            current_card.start_timer()
-
             fields_data = {field_name: note[field_name] for field_name in note.keys() if "{{" + field_name + "}}" in front_template}
 
             # Extract media references
-            fields_data, media_files = process_media_files(fields_data, media_path)
-
-            counts = scheduler.counts()
-            remaining = sum(counts)
+            fields_data, media_files = process_media_files(fields_data, media_path, session.username, session.media_mode)
 
-            return jsonify({"front": fields_data, "card_id": current_card.id, "note_id": int(note.id), "remaining": remaining, "time_taken_last_card": current_card.time_taken(capped=False), "media_files": media_files}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
+            return jsonify({"front": fields_data, "card_id": current_card.id, "note_id": int(note.id), "remaining": remaining, "time_taken_last_card": time_taken, "media_files": media_files}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
 
         elif action == 'close':
-            if collection is not None:
-                collection.close()
-                collection = None
-                scheduler = None
-                current_card = None
+            session_registry.close(session.session_id)
             return jsonify({"message": "Collection closed."}), 200, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
 
         else:
@@ -306,6 +380,7 @@ def study():
         return jsonify({"error": f"An error occurred: {e}"}), 500, {'Content-Type': 'application/json; charset=utf-8', 'ensure_ascii': False}
 
 @study_sessions.route('/api/custom-study', methods=['POST'])
+@collection_writer
 def custom_study():
     data = request.json
     username = data.get('username')
@@ -315,11 +390,9 @@ def custom_study():
     if not username or deck_id is None:
         return jsonify({"error": "username and deck_id are required"}), 400
 
-    # Use a temporary collection to avoid locking conflicts with study sessions
     temp_collection = None
     try:
-        collection_path = get_collection_path(username)
-        temp_collection = Collection(collection_path)
+        temp_collection = acquire_collection(username)
         temp_scheduler = V3Scheduler(temp_collection)
 
         # Select the requested deck context
@@ -347,9 +420,8 @@ def custom_study():
     except Exception as e:
         return jsonify({"error": f"Error creating custom study session: {e}"}), 500
     finally:
-        # Always close the temporary collection to release locks
         if temp_collection is not None:
-            temp_collection.close()
+            release_collection(temp_collection)
 
     return jsonify({
         "message": "Custom study session created successfully.",
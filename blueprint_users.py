@@ -17,6 +17,10 @@ from anki.consts import (
 import os
 import shutil
 from anki_paths import collection_path as get_collection_path, anki_base as get_anki_base
+from collection_pool import acquire_collection, release_collection, pool as collection_pool
+from collection_executor import collection_writer
+from study_session_registry import registry as session_registry
+from field_index import drop_index
 
 # Map state names to their corresponding queue numbers
 state_map = {
@@ -34,6 +38,7 @@ users = Blueprint('users', __name__)
 
 ###------------------------- USERS -------------------------###
 @users.route('/api/users/create/<username>', methods=['POST'])
+@collection_writer
 def create_user(username):
     collection_path = get_collection_path(username)
     if not os.path.exists(collection_path):
@@ -45,10 +50,15 @@ def create_user(username):
         return jsonify({"error": "User already exists"}), 400
 
 @users.route('/api/users/delete/<username>', methods=['DELETE'])
+@collection_writer
 def delete_user(username):
     user_dir = get_anki_base(username)
     try:
         if os.path.exists(user_dir):
+            # Close open handles before their files disappear.
+            session_registry.close_for_user(username)
+            collection_pool.evict(username)
+            drop_index(username)
             shutil.rmtree(user_dir)
             return jsonify({"message": f"User {username} deleted successfully"}), 200
         else:
@@ -58,6 +68,7 @@ def delete_user(username):
 
 # Create an instance of the Syncer class
 @users.route('/api/users/sync-login', methods=['POST'])
+@collection_writer
 def sync_login():
     try:
         # Extract parameters from the request
@@ -75,11 +86,12 @@ def sync_login():
         if not os.path.exists(collection_path):
             return jsonify({"error": f"Profile {profile_name} does not exist"}), 404
             
-        col = Collection(collection_path)
+        col = acquire_collection(profile_name)
 
         # Step 1: Authenticate with the server
         auth = col.sync_login(username, password, endpoint)
         if not auth or not auth.hkey:
+            release_collection(col)
             return jsonify({"error": "Authentication failed"}), 401
 
         # Step 2: Check sync status first
@@ -109,7 +121,7 @@ def sync_login():
                 else:
                     media_sync_result = "Media sync not requested"
                     
-                col.close()
+                release_collection(col)
                 return jsonify({
                     'hkey': auth.hkey,
                     'endpoint': auth.endpoint,
@@ -119,7 +131,7 @@ def sync_login():
                 }), 200
             except Exception as e:
                 full_sync_result = f"Full sync error: {str(e)}"
-                col.close()
+                release_collection(col)
                 return jsonify({
                     'hkey': auth.hkey,
                     'endpoint': auth.endpoint,
@@ -132,6 +144,7 @@ def sync_login():
             sync_output = col.sync_collection(auth=auth, sync_media=False)  # Sync media separately
             server_usn = sync_output.server_media_usn if hasattr(sync_output, 'server_media_usn') else None
         except Exception as e:
+            release_collection(col)
             return jsonify({"error": f"Collection sync error: {str(e)}"}), 500
 
         # Step 4: Handle media sync if requested
@@ -156,8 +169,8 @@ def sync_login():
             except Exception as e:
                 full_sync_result = f"Full sync error: {str(e)}"
 
-        # Close the collection and return the results
-        col.close()
+        # Hand the collection back to the pool and return the results
+        release_collection(col)
         
         return jsonify({
             'hkey': auth.hkey,
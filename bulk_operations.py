@@ -0,0 +1,119 @@
+"""Card operations for ``POST /api/cards/bulk`` and the by-tag and by-deck routes.
+
+Each entry of :data:`OPERATIONS` turns the request's ``params`` into
+arguments for one backend call (raising :class:`ValueError` for bad params
+and :class:`LookupError` for a missing deck) and then applies that call to
+every card a search, tag or deck matched, as a single operation and undo
+step.  New operations only need an entry here.
+"""
+
+from typing import Callable, NamedTuple
+
+from anki.utils import ids2str
+
+
+class BulkOperation(NamedTuple):
+    # (col, params) -> keyword arguments for apply
+    prepare: Callable
+    # (col, card_ids, **kwargs) -> number of objects the backend changed, or None
+    apply: Callable
+
+
+def _no_params(col, params) -> dict:
+    return {}
+
+
+def _flag(params, name: str) -> bool:
+    value = params.get(name, False)
+    if not isinstance(value, bool):
+        raise ValueError(f"{name} must be true or false")
+    return value
+
+
+###---- SCHEDULING ----###
+def _suspend(col, card_ids) -> int:
+    return col.sched.suspend_cards(card_ids).count
+
+
+def _bury(col, card_ids) -> int:
+    return col.sched.bury_cards(card_ids, manual=True).count
+
+
+def _reset_params(col, params) -> dict:
+    return {"restore_position": _flag(params, "restore_position"), "reset_counts": _flag(params, "reset_counts")}
+
+
+def _reset(col, card_ids, restore_position, reset_counts):
+    col.sched.schedule_cards_as_new(card_ids, restore_position=restore_position, reset_counts=reset_counts)
+    return None
+
+
+def _reschedule_params(col, params) -> dict:
+    new_due_date = params.get('new_due_date')
+    start_days = params.get('start_days')
+    end_days = params.get('end_days')
+    if new_due_date:
+        return {"days": str(new_due_date)}
+    if start_days is None or end_days is None:
+        raise ValueError("reschedule needs new_due_date, or start_days and end_days")
+    return {"days": f'{start_days}-{end_days}'}
+
+
+def _reschedule(col, card_ids, days):
+    col.sched.set_due_date(card_ids, days)
+    return None
+
+
+def _reposition_params(col, params) -> dict:
+    new_position = params.get('new_position')
+    step = params.get('step', 1)
+    for name, value in (("new_position", new_position), ("step", step)):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError(f"reposition needs an integer {name}")
+    return {"new_position": new_position, "step": step, "randomize": _flag(params, "randomize"),
+            "increment_collection": _flag(params, "increment_collection")}
+
+
+def _reposition(col, card_ids, new_position, step, randomize, increment_collection) -> int:
+    return col.sched.reposition_new_cards(card_ids, new_position, step, randomize, increment_collection).count
+
+
+###---- CARDS AND NOTES ----###
+def _move_params(col, params) -> dict:
+    deck_id = params.get('deck_id')
+    deck_name = params.get('deck_name')
+    if deck_id is not None:
+        try:
+            deck_id = int(deck_id)
+        except (TypeError, ValueError):
+            raise ValueError("deck_id must be an integer")
+        if col.decks.get(deck_id, default=False) is None:
+            raise LookupError("Target deck not found")
+        return {"deck_id": deck_id}
+    if not deck_name:
+        raise ValueError("move needs deck_id or deck_name")
+    deck_id = col.decks.id_for_name(deck_name)
+    if not deck_id:
+        raise LookupError("Target deck not found")
+    return {"deck_id": deck_id}
+
+
+def _move(col, card_ids, deck_id) -> int:
+    return col.set_deck(card_ids, deck_id).count
+
+
+def _delete(col, card_ids) -> int:
+    # Like the other delete routes, remove the notes the cards belong to
+    note_ids = col.db.list(f"select distinct nid from cards where id in {ids2str(card_ids)}")
+    return col.remove_notes(note_ids).count
+
+
+OPERATIONS = {
+    "suspend": BulkOperation(_no_params, _suspend),
+    "bury": BulkOperation(_no_params, _bury),
+    "reset": BulkOperation(_reset_params, _reset),
+    "reschedule": BulkOperation(_reschedule_params, _reschedule),
+    "reposition": BulkOperation(_reposition_params, _reposition),
+    "move": BulkOperation(_move_params, _move),
+    "delete": BulkOperation(_no_params, _delete),
+}
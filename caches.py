@@ -0,0 +1,109 @@
+"""Bounded in-process caches shared by the blueprints.
+
+:class:`LRUCache` is a small thread-safe mapping limited by entry count and/or
+total size.  Caches created through :func:`named_cache` are listed by
+:func:`cache_stats`, which ``/api/db/pool-stats`` reports.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+# Byte budget for base64-encoded media kept for inline study responses.
+MEDIA_CACHE_BYTES = int(os.environ.get("ANKI_API_MEDIA_CACHE_BYTES", 64 * 1024 * 1024))
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by *max_entries* and/or *max_bytes*.
+
+    ``put`` takes the size of each value; entries larger than the whole byte
+    budget are not stored.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size: int = 0) -> None:
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            self._shrink()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None:
+                return default
+            self.bytes -= item[1]
+            return item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+    def _shrink(self) -> None:
+        while self._data and (
+            (self.max_entries is not None and len(self._data) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+
+_caches = {}
+
+
+def named_cache(name: str, **limits) -> LRUCache:
+    """Create an :class:`LRUCache` that is included in :func:`cache_stats`."""
+    cache = LRUCache(**limits)
+    _caches[name] = cache
+    return cache
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+# (username, filename, mtime_ns, size) -> (base64 data, mime type)
+media_cache = named_cache("media", max_bytes=MEDIA_CACHE_BYTES)
@@ -0,0 +1,192 @@
+"""Set-based loading of cards and notes for the list endpoints.
+
+Looking cards up with ``col.get_card`` and ``col.get_note`` costs two backend
+round trips per card.  The helpers here read the columns the routes need for a
+whole set of cards with one SQL query, plus one for their notes, and return
+light :class:`CardRow` / :class:`NoteRow` tuples instead of ``Card`` and
+``Note`` objects.  When a route only returns some fields, :func:`fetch_notes`
+reads just those columns of the stored field string.
+"""
+
+from typing import NamedTuple
+
+from anki.utils import ids2str
+
+# Ids per "in (...)" list, to keep each statement a reasonable size.
+ID_CHUNK_SIZE = 50000
+
+CARD_COLUMNS = "id, nid, did, odid, ord, type, queue, due, ivl, factor, reps, lapses"
+
+
+class CardRow(NamedTuple):
+    id: int
+    nid: int
+    did: int
+    odid: int
+    ord: int
+    type: int
+    queue: int
+    due: int
+    ivl: int
+    factor: int
+    reps: int
+    lapses: int
+
+
+class NoteRow(NamedTuple):
+    id: int
+    mid: int
+    tags: list
+    fields: list
+    field_names: list
+
+    def field_dict(self, inclusions=None) -> dict:
+        """Return ``{name: value}`` for all fields, or only those in *inclusions*."""
+        if inclusions is None:
+            return dict(zip(self.field_names, self.fields))
+        positions = {name: i for i, name in enumerate(self.field_names)}
+        return {name: self.fields[positions[name]] for name in inclusions if name in positions}
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def fetch_cards(col, where: str = None, *args, order: str = "nid, ord", limit: int = None) -> list:
+    """Return :class:`CardRow` for every card matching the SQL *where* clause."""
+    sql = f"select {CARD_COLUMNS} from cards"
+    if where:
+        sql += f" where {where}"
+    if order:
+        sql += f" order by {order}"
+    if limit is not None:
+        sql += f" limit {int(limit)}"
+    return [CardRow(*row) for row in col.db.all(sql, *args)]
+
+
+def card_filter(col, deck_id: int = None, queue: int = None, children: bool = True, after_id: int = None):
+    """Return ``(where, args)`` restricting cards to a deck and/or queue,
+    and to ids above *after_id*."""
+    clauses, args = [], []
+    if after_id is not None:
+        clauses.append("id > ?")
+        args.append(after_id)
+    if deck_id is not None:
+        deck_ids = col.decks.deck_and_child_ids(deck_id) if children else [deck_id]
+        clauses.append(f"did in {ids2str(deck_ids)}")
+    if queue is not None:
+        clauses.append("queue = ?")
+        args.append(queue)
+    return " and ".join(clauses), args
+
+
+def fetch_cards_of_notes(col, note_ids, deck_id: int = None, queue: int = None,
+                         after_id: int = None, limit: int = None) -> list:
+    """Return the cards of *note_ids*, grouped by note in the order given.
+
+    *deck_id* and *queue* narrow the result inside the same query.  With
+    *limit* the result is instead the first *limit* cards by id, starting
+    after *after_id*.
+    """
+    where, args = card_filter(col, deck_id, queue, after_id=after_id)
+    if limit is not None:
+        rows = []
+        for chunk in _chunks(note_ids):
+            clause = f"nid in {ids2str(chunk)}" + (f" and {where}" if where else "")
+            rows.extend(fetch_cards(col, clause, *args, order="id", limit=limit))
+        rows.sort(key=lambda row: row.id)
+        return rows[:limit]
+    by_note = {}
+    for chunk in _chunks(note_ids):
+        clause = f"nid in {ids2str(chunk)}" + (f" and {where}" if where else "")
+        for row in fetch_cards(col, clause, *args, order="ord"):
+            by_note.setdefault(row.nid, []).append(row)
+    return [row for note_id in note_ids for row in by_note.get(note_id, ())]
+
+
+def fetch_cards_in_deck(col, deck_id: int, queue: int = None, children: bool = True,
+                        after_id: int = None, limit: int = None) -> list:
+    """Return the cards in *deck_id*, and in its subdecks when *children* is set.
+
+    With *queue*, only cards in that queue are read.  With *limit*, the first
+    *limit* cards by id after *after_id* are returned.
+    """
+    where, args = card_filter(col, deck_id, queue, children, after_id)
+    return fetch_cards(col, where, *args, order="id" if limit is not None else None, limit=limit)
+
+
+def target_card_ids(col, tag: str = None, deck_id: int = None, queue: int = None) -> list:
+    """Return the ids of the cards of notes tagged *tag*, or of the cards in
+    *deck_id* and its subdecks, for a change applied to all of them at once.
+
+    With *queue*, only cards in that queue are returned.
+    """
+    if tag:
+        card_ids = col.find_cards(f"tag:{tag}")
+        if queue is None:
+            return list(card_ids)
+        return [card_id for chunk in _chunks(card_ids)
+                for card_id in col.db.list(f"select id from cards where id in {ids2str(chunk)} and queue = ?", queue)]
+    where, args = card_filter(col, deck_id, queue)
+    return col.db.list(f"select id from cards where {where}", *args)
+
+
+def _distinct_mids(col, note_ids) -> set:
+    mids = set()
+    for chunk in _chunks(note_ids):
+        mids.update(col.db.list(f"select distinct mid from notes where id in {ids2str(chunk)}"))
+    return mids
+
+
+def notes_by_notetype(col, note_ids) -> dict:
+    """Return ``{notetype_id: [note_id, ...]}`` for the existing notes among *note_ids*, in input order."""
+    mids = {}
+    for chunk in _chunks(note_ids):
+        mids.update(col.db.all(f"select id, mid from notes where id in {ids2str(chunk)}"))
+    groups = {}
+    for note_id in dict.fromkeys(note_ids):
+        if note_id in mids:
+            groups.setdefault(mids[note_id], []).append(note_id)
+    return groups
+
+
+def fetch_notes(col, note_ids, inclusions=None, fields: bool = True) -> dict:
+    """Return ``{note_id: NoteRow}`` for *note_ids*.
+
+    With *inclusions*, only the named fields are read: SQLite extracts each
+    one from the stored field string, so the rest never reach Python, and the
+    rows' ``fields``/``field_names`` hold just those fields.  With *fields*
+    false only the ids, notetypes and tags are read.
+    """
+    note_ids = set(note_ids)
+    notes = {}
+    if not fields:
+        for chunk in _chunks(note_ids):
+            for note_id, mid, tags in col.db.all(f"select id, mid, tags from notes where id in {ids2str(chunk)}"):
+                notes[note_id] = NoteRow(note_id, mid, tags.split(), [], [])
+        return notes
+
+    if inclusions is not None:
+        for mid in _distinct_mids(col, note_ids):
+            positions = {name: i for i, name in enumerate(col.models.field_names(col.models.get(mid)))}
+            names = [name for name in dict.fromkeys(inclusions) if name in positions]
+            columns = "".join(f", field_at_index(flds, {positions[name]})" for name in names)
+            for chunk in _chunks(note_ids):
+                for note_id, tags, *values in col.db.all(
+                    f"select id, tags{columns} from notes where mid = ? and id in {ids2str(chunk)}", mid
+                ):
+                    notes[note_id] = NoteRow(note_id, mid, tags.split(), values, names)
+        return notes
+
+    field_names = {}
+    for chunk in _chunks(note_ids):
+        for note_id, mid, tags, flds in col.db.all(
+            f"select id, mid, tags, flds from notes where id in {ids2str(chunk)}"
+        ):
+            if mid not in field_names:
+                field_names[mid] = col.models.field_names(col.models.get(mid))
+            notes[note_id] = NoteRow(note_id, mid, tags.split(), flds.split("\x1f"), field_names[mid])
+    return notes
+
@@ -0,0 +1,191 @@
+"""Single-writer / multi-reader scheduling for pooled collections.
+
+Each user's collection gets a :class:`CollectionExecutor` whose writer thread
+runs mutating requests one at a time, in the order they arrived.  Read-only
+requests keep running on their own request thread against the same pooled
+handle; the Rust backend serialises the individual calls, so reads never wait
+behind a queue of writes.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from functools import wraps
+
+from flask import copy_current_request_context, jsonify, request
+
+from study_session_registry import registry as session_registry
+
+# Maximum number of writes allowed to wait for one collection.
+DEFAULT_MAX_QUEUE = int(os.environ.get("ANKI_API_WRITE_QUEUE_SIZE", 64))
+# Seconds an idle writer thread lingers before exiting.
+WRITER_IDLE_TIMEOUT = 60.0
+
+
+class WriteQueueFull(Exception):
+    """Raised when a collection already has the maximum number of queued writes."""
+
+
+class CollectionExecutor:
+    """Runs the writes for one collection in order on a dedicated thread."""
+
+    def __init__(self, username: str, max_queue: int = DEFAULT_MAX_QUEUE):
+        self.username = username
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.active_readers = 0
+        self.completed = 0
+        self.rejected = 0
+        # Bumped after every write; lets caches notice changes made through raw SQL
+        self.generation = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue *fn* to run on the writer thread and return its future."""
+        future = Future()
+        with self._lock:
+            try:
+                self._queue.put_nowait((future, fn, args, kwargs))
+            except queue.Full:
+                self.rejected += 1
+                raise WriteQueueFull(
+                    f"{self.queue_depth()} writes already queued for {self.username}"
+                )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"collection-writer-{self.username}", daemon=True
+                )
+                self._thread.start()
+        return future
+
+    def run_write(self, fn, *args, **kwargs):
+        """Run *fn* on the writer thread and wait for its result."""
+        if threading.current_thread() is self._thread:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.generation += 1
+        return self.submit(fn, *args, **kwargs).result()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "max_queue": self.max_queue,
+            "active_readers": self.active_readers,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "generation": self.generation,
+            "writer_running": self._thread is not None,
+        }
+
+    def _run(self) -> None:
+        while True:
+            try:
+                future, fn, args, kwargs = self._queue.get(timeout=WRITER_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    self.generation += 1
+                    future.set_exception(e)
+                else:
+                    self.generation += 1
+                    future.set_result(result)
+            self.completed += 1
+            self._queue.task_done()
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def executor_for(username: str) -> CollectionExecutor:
+    """Return the executor for *username*'s collection, creating it on first use."""
+    with _executors_lock:
+        executor = _executors.get(username)
+        if executor is None:
+            executor = CollectionExecutor(username)
+            _executors[username] = executor
+        return executor
+
+
+def executor_stats() -> dict:
+    """Return per-user queue statistics."""
+    with _executors_lock:
+        executors = list(_executors.values())
+    return {executor.username: executor.stats() for executor in executors}
+
+
+def write_generation(username: str) -> int:
+    """Number of writes run against *username*'s collection since startup."""
+    return executor_for(username).generation
+
+
+def request_username():
+    """Return the profile a request targets, wherever the route expects it."""
+    if request.view_args and request.view_args.get("username"):
+        return request.view_args["username"]
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        # sync-login uses 'username' for the AnkiWeb account, not the profile
+        if data.get("profile_name"):
+            return data["profile_name"]
+        if data.get("username"):
+            return data["username"]
+        if data.get("session_id"):
+            # Study requests may name their profile only through the session token
+            session = session_registry.get(data["session_id"])
+            if session is not None:
+                return session.username
+    return request.args.get("username")
+
+
+def collection_writer(view):
+    """Run a mutating route on the writer thread of the target collection.
+
+    A request that names no profile is rejected, as its write could not be
+    ordered with the others on the same collection.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        username = request_username()
+        if not username:
+            return jsonify({"error": "username, or the session_id of a live study session, is required"}), 400
+        try:
+            return executor_for(username).run_write(
+                copy_current_request_context(view), *args, **kwargs
+            )
+        except WriteQueueFull as e:
+            return jsonify({"error": f"Too many pending writes: {e}"}), 503
+    return wrapper
+
+
+def collection_reader(view):
+    """Run a read-only route inline, alongside any queued writes."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        username = request_username()
+        if not username:
+            return view(*args, **kwargs)
+        executor = executor_for(username)
+        with executor._lock:
+            executor.active_readers += 1
+        try:
+            return view(*args, **kwargs)
+        finally:
+            with executor._lock:
+                executor.active_readers -= 1
+    # Lets the ETag hook tell collection reads from other GETs
+    wrapper.reads_collection = True
+    return wrapper
@@ -0,0 +1,223 @@
+"""Process-wide pool of open Anki collections, keyed by username.
+
+Opening a collection (SQLite file plus Rust backend) is far more expensive
+than most of the queries the API runs against it, and Anki only allows one
+open handle per collection file.  Every blueprint therefore borrows its
+handle from the shared :data:`pool` instead of opening and closing
+``collection.anki2`` on each request.
+"""
+
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from anki.collection import Collection
+
+from anki_paths import collection_path as get_collection_path
+
+# Maximum number of idle collections kept open at once.
+DEFAULT_MAX_SIZE = int(os.environ.get("ANKI_API_POOL_SIZE", 8))
+# Seconds an unused collection may stay open before it is closed.
+DEFAULT_TTL = float(os.environ.get("ANKI_API_POOL_TTL", 300))
+
+
+class _PoolEntry:
+    __slots__ = ("username", "col", "refs", "last_used", "lock", "closing")
+
+    def __init__(self, username: str):
+        self.username = username
+        self.col = None
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        # Set once the entry has left the pool; its handle closes on the last release
+        self.closing = False
+
+
+class CollectionPool:
+    """LRU pool of open :class:`Collection` handles.
+
+    ``acquire`` returns the shared handle for a user, opening it on first use,
+    and ``release`` hands it back.  Handles that are not in use are closed when
+    the pool grows past *max_size* (least recently used first) or when they have
+    been idle for longer than *ttl* seconds.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def acquire(self, username: str) -> Collection:
+        """Return the open collection for *username*, opening it if needed."""
+        while True:
+            with self._lock:
+                entry = self._entries.get(username)
+                if entry is None:
+                    entry = _PoolEntry(username)
+                    self._entries[username] = entry
+                entry.refs += 1
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(username)
+                self._start_reaper()
+
+            try:
+                with entry.lock:
+                    # Evicted while we waited for the lock: start over with a new entry
+                    if entry.closing:
+                        col = None
+                    elif entry.col is None:
+                        entry.col = Collection(get_collection_path(username))
+                        self.opens += 1
+                        col = entry.col
+                    elif entry.col.db is None:
+                        # Closed underneath us, e.g. by a collection package export.
+                        entry.col.reopen()
+                        self.opens += 1
+                        col = entry.col
+                    else:
+                        self.hits += 1
+                        col = entry.col
+            except Exception:
+                with self._lock:
+                    self._drop_ref(entry)
+                raise
+
+            with self._lock:
+                if col is None:
+                    self._drop_ref(entry)
+                    continue
+                self._owners[id(col)] = entry
+                self._evict_over_capacity()
+            return col
+
+    def release(self, col: Collection) -> None:
+        """Hand *col* back to the pool; it stays open for the next request."""
+        with self._lock:
+            entry = self._owners.get(id(col))
+            if entry is None or entry.refs == 0:
+                return
+            entry.last_used = time.monotonic()
+            self._drop_ref(entry)
+            self._evict_over_capacity()
+
+    def evict(self, username: str) -> bool:
+        """Forget the collection for *username* and close it.
+
+        Used before the profile directory is removed or replaced on disk.  A
+        handle that requests are still using is closed when the last of them
+        releases it; later acquires open a new one.
+        """
+        with self._lock:
+            entry = self._entries.pop(username, None)
+            if entry is None:
+                return False
+            entry.closing = True
+            if entry.refs == 0:
+                self._close_entry(entry)
+            return True
+
+    def close_idle(self) -> int:
+        """Close every unused collection that has been idle longer than the TTL."""
+        cutoff = time.monotonic() - self.ttl
+        closed = 0
+        with self._lock:
+            for username, entry in list(self._entries.items()):
+                if entry.refs == 0 and entry.last_used < cutoff:
+                    del self._entries[username]
+                    self._close_entry(entry)
+                    closed += 1
+        return closed
+
+    def close_all(self) -> None:
+        """Close every pooled collection."""
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem(last=False)
+                self._close_entry(entry)
+
+    def stats(self) -> dict:
+        """Return a snapshot of pool usage."""
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "open": len(self._entries),
+                "in_use": sum(1 for e in self._entries.values() if e.refs),
+                "opens": self.opens,
+                "hits": self.hits,
+                "evictions": self.evictions,
+                "users": list(self._entries.keys()),
+            }
+
+    # Callers must hold self._lock for the helpers below.
+
+    def _drop_ref(self, entry: _PoolEntry) -> None:
+        entry.refs -= 1
+        if entry.refs:
+            return
+        if entry.closing:
+            self._close_entry(entry)
+        elif entry.col is None and self._entries.get(entry.username) is entry:
+            # Nothing was opened, e.g. the open failed
+            del self._entries[entry.username]
+
+    def _evict_over_capacity(self) -> None:
+        excess = len(self._entries) - self.max_size
+        if excess <= 0:
+            return
+        for username, entry in list(self._entries.items()):
+            if excess <= 0:
+                break
+            if entry.refs == 0:
+                del self._entries[username]
+                self._close_entry(entry)
+                excess -= 1
+
+    def _close_entry(self, entry: _PoolEntry) -> None:
+        entry.closing = True
+        with entry.lock:
+            col = entry.col
+            entry.col = None
+            if col is None:
+                return
+            self._owners.pop(id(col), None)
+            self.evictions += 1
+            try:
+                col.close()
+            except Exception:
+                pass
+
+    def _start_reaper(self) -> None:
+        if self._reaper is not None or self.ttl <= 0:
+            return
+
+        def reap():
+            while True:
+                time.sleep(max(1.0, self.ttl / 2))
+                self.close_idle()
+
+        self._reaper = threading.Thread(target=reap, name="collection-pool-reaper", daemon=True)
+        self._reaper.start()
+
+
+pool = CollectionPool()
+atexit.register(pool.close_all)
+
+
+def acquire_collection(username: str) -> Collection:
+    """Borrow the pooled collection for *username*."""
+    return pool.acquire(username)
+
+
+def release_collection(col: Collection) -> None:
+    """Return a collection obtained from :func:`acquire_collection`."""
+    pool.release(col)
@@ -0,0 +1,64 @@
+"""ETag / If-None-Match handling for the read endpoints.
+
+Every ``GET`` served by a :func:`collection_executor.collection_reader` view
+is tagged with a hash of the collection's change stamp (see
+:func:`result_cache.change_stamp`) and the request parameters.  Other GETs
+are left alone, so they never open a collection here.  A client that sends the tag back in ``If-None-Match``
+gets ``304 Not Modified`` before the view runs, so an unchanged collection is
+never searched or serialised again.
+"""
+
+import hashlib
+import os
+import uuid
+
+from flask import current_app, g, request
+
+from anki_paths import collection_path
+from collection_executor import request_username
+from result_cache import change_stamp, request_params
+from streaming import wants_ndjson
+
+# Blueprints whose GET responses depend on more than the collection: the
+# change feed holds back the current second until the clock moves past it
+ETAG_EXEMPT_BLUEPRINTS = {"changes"}
+
+# Write generations restart at zero with the process; tags from an earlier
+# run must not match.
+_boot_id = uuid.uuid4().hex
+
+
+def request_etag(username: str) -> str:
+    """The entity tag for the current request against *username*'s collection."""
+    key = repr((_boot_id, username, request.endpoint, request_params(), wants_ndjson()) + change_stamp(username))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def check_etag():
+    """``before_request`` hook answering ``304`` when the client's tag is current."""
+    if request.method != "GET" or request.blueprint in ETAG_EXEMPT_BLUEPRINTS:
+        return None
+    if not getattr(current_app.view_functions.get(request.endpoint), "reads_collection", False):
+        return None
+    username = request_username()
+    if not username or not os.path.exists(collection_path(username)):
+        return None
+    try:
+        g.etag = request_etag(username)
+    except Exception:
+        # Leave errors opening the collection to the view
+        return None
+    if g.etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(g.etag)
+        return response
+    return None
+
+
+def add_etag(response):
+    """``after_request`` hook tagging successful ``GET`` responses."""
+    etag = g.get("etag")
+    if etag and response.status_code == 200 and "ETag" not in response.headers:
+        response.set_etag(etag)
+        response.headers.setdefault("Cache-Control", "no-cache")
+    return response
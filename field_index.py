@@ -0,0 +1,563 @@
+"""Optional in-memory word and trigram index over note fields.
+
+Field searches such as ``"Front:*cat*"`` or ``Front:re:...`` make the backend
+read and match every note in the collection.  With ``ANKI_API_FIELD_INDEX=1``
+each user gets a :class:`FieldIndex`, built on a background thread the first
+time it is needed, that maps every word of every field to the notes
+containing it, and every trigram (three-character run) of each notetype's
+fields to the notes containing it.  A field condition is turned into a
+candidate set of note ids from the index, and the real search then runs only
+over those notes (``nid:...``), so results are exactly what the backend would
+return.
+
+Whole words and short values use the word postings.  Infix text, wildcard
+patterns and regexes use the trigram postings: every literal run of three or
+more characters a match must contain is split into trigrams, and only notes
+holding all of them are candidates.  Trigram postings are sorted
+``array('I')`` lists of document numbers; a re-indexed note gets a new
+number appended to the lists and its old number is left behind as dead, so
+edits never rewrite a list.  Once dead numbers outnumber live ones the index
+is rebuilt.
+
+The index follows the collection through note modification times: when the
+collection's ``mod`` moves, notes modified since the last refresh are
+re-read.  The note count and the sums of note ids and mtimes are then
+compared with the index's own; if they differ (a deletion, or notes that
+a sync or import wrote with older mtimes), every note's mtime is checked.
+Conditions the index cannot narrow (regexes without a literal run, text
+without words) and candidate sets that are too large fall back to the
+plain backend search.
+"""
+
+import bisect
+import os
+import re
+import threading
+import time
+import unicodedata
+import warnings
+from array import array
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from anki.utils import ids2str
+
+from collection_pool import acquire_collection, release_collection
+
+FIELD_INDEX_ENABLED = os.environ.get("ANKI_API_FIELD_INDEX", "") == "1"
+TRIGRAMS_ENABLED = os.environ.get("ANKI_API_FIELD_INDEX_TRIGRAMS", "1") == "1"
+# Above this many candidates a restricted search costs about as much as a full one.
+MAX_CANDIDATES = int(os.environ.get("ANKI_API_FIELD_INDEX_MAX_CANDIDATES", 10000))
+# Note ids per "nid:" clause when re-running the search over candidates.
+VERIFY_CHUNK_SIZE = 1000
+
+WORD_RE = re.compile(r"\w+")
+# Characters that make a field search value a pattern rather than plain text
+SEARCH_WILDCARDS = set('*_\\"')
+REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+# Inline flag groups such as "(?-i)", which Python's parser only takes at the start
+REGEX_FLAGS_RE = re.compile(r"\(\?([a-zA-Z-]*)\)")
+# Escapes that mean the same to the backend's regex engine and to Python's parser
+REGEX_ESCAPE_RE = re.compile(r"\\(.)", re.DOTALL)
+SAFE_REGEX_ESCAPES = set(".\\^$*+?()[]{}|/-dDwWsSbBnt")
+# Nested classes, POSIX classes and class set operations parse differently in Python
+REGEX_CLASS_SYNTAX_RE = re.compile(r"\[[^\]]*\[|&&|~~|--")
+# Below this many dead document numbers the index is never rebuilt for space
+MIN_DEAD_DOCS = 1000
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", text).casefold()
+
+
+def words(text: str) -> set:
+    return set(WORD_RE.findall(normalize(text)))
+
+
+def trigrams(text: str) -> set:
+    """The trigrams of already normalised *text*."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def glob_literals(value: str):
+    """Literal runs of a search value, split at its ``*``/``_`` wildcards."""
+    if "\\" in value or '"' in value:
+        return None
+    return [[segment for segment in re.split(r"[*_]", value) if segment]]
+
+
+def regex_literals(pattern: str):
+    """Literal runs every match of *pattern* must contain, per top-level alternative.
+
+    Returns a list with one list of literals per ``|`` alternative, or
+    ``None`` if the pattern can't be analysed.  Anything other than plain
+    characters (classes, optional parts, nested alternatives) ends a run.
+    """
+    if '"' in pattern or REGEX_CLASS_SYNTAX_RE.search(pattern):
+        return None
+    for escaped in REGEX_ESCAPE_RE.findall(pattern):
+        if escaped not in SAFE_REGEX_ESCAPES:
+            return None
+    flags = "".join(REGEX_FLAGS_RE.findall(pattern))
+    if "x" in flags:
+        return None  # verbose mode ignores whitespace
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            parsed = sre_parse.parse(REGEX_FLAGS_RE.sub("", pattern))
+    except (re.error, RecursionError, OverflowError):
+        return None
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] is sre_constants.BRANCH:
+        return [_sequence_literals(branch) for branch in items[0][1][1]]
+    return [_sequence_literals(items)]
+
+
+def _sequence_literals(items) -> list:
+    literals = []
+    run = []
+
+    def flush():
+        if run:
+            literals.append("".join(run))
+            run.clear()
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_constants.LITERAL:
+                run.append(chr(av))
+            elif op is sre_constants.SUBPATTERN:
+                walk(av[-1])
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+                flush()
+                walk(av[2])
+                flush()
+            else:
+                flush()
+
+    walk(items)
+    flush()
+    return literals
+
+
+class _FieldPostings:
+    """Word -> note ids for one field name."""
+
+    def __init__(self):
+        self.postings = {}
+        self._vocabulary = None
+
+    def add(self, note_id: int, note_words) -> None:
+        for word in note_words:
+            notes = self.postings.get(word)
+            if notes is None:
+                self.postings[word] = {note_id}
+                self._vocabulary = None
+            else:
+                notes.add(note_id)
+
+    def remove(self, note_id: int, note_words) -> None:
+        for word in note_words:
+            notes = self.postings.get(word)
+            if notes is not None:
+                notes.discard(note_id)
+                if not notes:
+                    del self.postings[word]
+                    self._vocabulary = None
+
+    def vocabulary(self) -> list:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        return self._vocabulary
+
+    def notes_with_word(self, word: str, prefix: bool, suffix: bool) -> set:
+        """Notes containing *word*; with *prefix*/*suffix* it may be the start/end of a longer word."""
+        if not prefix and not suffix:
+            return set(self.postings.get(word, ()))
+        if prefix and not suffix:
+            vocabulary = self.vocabulary()
+            start = bisect.bisect_left(vocabulary, word)
+            matches = []
+            for candidate in vocabulary[start:]:
+                if not candidate.startswith(word):
+                    break
+                matches.append(candidate)
+        elif suffix and not prefix:
+            matches = [candidate for candidate in self.postings if candidate.endswith(word)]
+        else:
+            matches = [candidate for candidate in self.postings if word in candidate]
+        notes = set()
+        for candidate in matches:
+            notes |= self.postings[candidate]
+        return notes
+
+
+class _TrigramPostings:
+    """Trigram -> sorted document numbers for one field of one notetype."""
+
+    def __init__(self):
+        self.postings = {}
+
+    def add(self, doc: int, note_trigrams) -> None:
+        for gram in note_trigrams:
+            docs = self.postings.get(gram)
+            if docs is None:
+                self.postings[gram] = array("I", (doc,))
+            else:
+                docs.append(doc)
+
+    def docs_with_all(self, grams) -> set:
+        """Documents containing every trigram in *grams*."""
+        lists = []
+        for gram in grams:
+            docs = self.postings.get(gram)
+            if docs is None:
+                return set()
+            lists.append(docs)
+        lists.sort(key=len)
+        found = set(lists[0])
+        for docs in lists[1:]:
+            if len(found) * 16 < len(docs):
+                # Few survivors: binary-search the long list instead of reading it
+                found = {doc for doc in found if _in_sorted(docs, doc)}
+            else:
+                found.intersection_update(docs)
+            if not found:
+                break
+        return found
+
+    def nbytes(self) -> int:
+        return sum(docs.itemsize * len(docs) for docs in self.postings.values())
+
+
+def _in_sorted(docs, doc: int) -> bool:
+    i = bisect.bisect_left(docs, doc)
+    return i < len(docs) and docs[i] == doc
+
+
+class FieldIndex:
+    """Word and trigram index over the fields of one user's notes."""
+
+    def __init__(self, username: str):
+        self.username = username
+        self.fields = {}
+        # (notetype id, field ord) -> trigram postings
+        self.trigrams = {}
+        # document number -> note id; a note's current number is in self.notes
+        self.doc_notes = array("q")
+        # note id -> (mod, {field key: words}, document number) for incremental updates
+        self.notes = {}
+        # (low 32 bits of ids, high bits of ids, mods) summed over self.notes
+        self.note_sums = (0, 0, 0)
+        self.ready = False
+        self.building = False
+        self.error = None
+        self.col_mod = None
+        self.notetype_stamp = None
+        self.note_mod = 0
+        self.built_at = None
+        self.refreshes = 0
+        self.lookups = 0
+        self.fallbacks = 0
+        self._lock = threading.RLock()
+        self._field_keys = {}
+        # field key -> [(notetype id, field ord)] holding that field
+        self._field_slots = {}
+
+    ###---- BUILDING ----###
+    def start_build(self) -> None:
+        with self._lock:
+            if self.ready or self.building:
+                return
+            self.building = True
+        threading.Thread(target=self._build, name=f"field-index-{self.username}", daemon=True).start()
+
+    def _build(self) -> None:
+        started = time.monotonic()
+        try:
+            col = acquire_collection(self.username)
+            try:
+                with self._lock:
+                    self._refresh(col, full=True)
+            finally:
+                release_collection(col)
+            self.ready = True
+            self.built_at = time.monotonic() - started
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.building = False
+
+    def _keys_for(self, col, mid: int) -> list:
+        keys = self._field_keys.get(mid)
+        if keys is None:
+            keys = [normalize(name) for name in col.models.field_names(col.models.get(mid))]
+            self._field_keys[mid] = keys
+        return keys
+
+    def _index_note(self, col, note_id: int, mid: int, mod: int, flds: str) -> None:
+        self._unindex_note(note_id)
+        doc = len(self.doc_notes)
+        self.doc_notes.append(note_id)
+        note_fields = {}
+        for field_ord, (key, value) in enumerate(zip(self._keys_for(col, mid), flds.split("\x1f"))):
+            field_words = words(value)
+            self.fields.setdefault(key, _FieldPostings()).add(note_id, field_words)
+            note_fields[key] = field_words
+            if TRIGRAMS_ENABLED:
+                self.trigrams.setdefault((mid, field_ord), _TrigramPostings()).add(doc, trigrams(normalize(value)))
+        self.notes[note_id] = (mod, note_fields, doc)
+        self._add_sums(note_id, mod, 1)
+
+    def _unindex_note(self, note_id: int) -> None:
+        # The note's document number is left dead in the trigram postings
+        entry = self.notes.pop(note_id, None)
+        if entry is not None:
+            self._add_sums(note_id, entry[0], -1)
+            for key, field_words in entry[1].items():
+                self.fields[key].remove(note_id, field_words)
+
+    def _add_sums(self, note_id: int, mod: int, sign: int) -> None:
+        id_low, id_high, mods = self.note_sums
+        self.note_sums = (id_low + sign * (note_id & 0xFFFFFFFF), id_high + sign * (note_id >> 32), mods + sign * mod)
+
+    def dead_docs(self) -> int:
+        return len(self.doc_notes) - len(self.notes)
+
+    def _refresh(self, col, full: bool = False) -> bool:
+        """Bring the index up to date with *col* (caller holds the lock).
+
+        Returns false if the notetypes changed and a rebuild was started instead.
+        """
+        col_mod = col.mod
+        if not full and col_mod == self.col_mod:
+            return True
+        notetype_stamp = tuple(col.db.first("select count(), max(mtime_secs) from notetypes"))
+        if notetype_stamp != self.notetype_stamp and not full:
+            # Fields may have been renamed or reordered; start over
+            self.ready = False
+            self.start_build()
+            return False
+        if full:
+            self.fields, self.notes, self.note_mod = {}, {}, 0
+            self.note_sums = (0, 0, 0)
+            self.trigrams, self.doc_notes = {}, array("q")
+            self.notetype_stamp = notetype_stamp
+            self._field_keys = {}
+            self._field_slots = {}
+            for notetype in col.models.all():
+                keys = [normalize(field["name"]) for field in notetype["flds"]]
+                self._field_keys[notetype["id"]] = keys
+                for field_ord, key in enumerate(keys):
+                    self._field_slots.setdefault(key, []).append((notetype["id"], field_ord))
+        since = 0 if full else self.note_mod
+        for note_id, mid, mod, flds in col.db.all(
+            "select id, mid, mod, flds from notes where mod >= ?", since
+        ):
+            self._index_note(col, note_id, mid, mod, flds)
+            self.note_mod = max(self.note_mod, mod)
+        count, *sums = col.db.first(
+            "select count(), coalesce(sum(id & 4294967295), 0), coalesce(sum(id >> 32), 0), coalesce(sum(mod), 0)"
+            " from notes")
+        if count != len(self.notes) or tuple(sums) != self.note_sums:
+            # Deleted notes, or notes written with an older mtime (imports, syncs)
+            current = dict(col.db.all("select id, mod from notes"))
+            for note_id in [note_id for note_id in self.notes if note_id not in current]:
+                self._unindex_note(note_id)
+            stale = [note_id for note_id, mod in current.items()
+                     if note_id not in self.notes or self.notes[note_id][0] != mod]
+            for start in range(0, len(stale), VERIFY_CHUNK_SIZE):
+                for note_id, mid, mod, flds in col.db.all(
+                    f"select id, mid, mod, flds from notes where id in {ids2str(stale[start:start + VERIFY_CHUNK_SIZE])}"
+                ):
+                    self._index_note(col, note_id, mid, mod, flds)
+        self.col_mod = col_mod
+        self.refreshes += 1
+        if not full and self.dead_docs() > max(MIN_DEAD_DOCS, len(self.notes)):
+            # Still correct, but mostly dead weight; queries fall back while it rebuilds
+            self.ready = False
+            self.start_build()
+        return True
+
+    ###---- LOOKUPS ----###
+    def condition_candidates(self, field_name: str, value: str, mode: str):
+        """Candidate note ids for one field condition, or ``None`` if the index can't narrow it.
+
+        *mode* is ``"exact"`` (the whole field), ``"contains"`` (text anywhere
+        in the field), ``"substring"`` (a regex fragment anywhere in the
+        field) or ``"regex"``.  Exact and contained values are backend search
+        values, so ``*`` and ``_`` are wildcards.
+        """
+        if mode not in ("exact", "contains", "substring", "regex"):
+            return None
+        if not field_name or not value or SEARCH_WILDCARDS & set(field_name):
+            return None
+        if TRIGRAMS_ENABLED and (mode != "exact" or SEARCH_WILDCARDS & set(value)):
+            if mode in ("exact", "contains"):
+                alternatives = glob_literals(value)
+            else:
+                alternatives = regex_literals(value)
+            notes = self.trigram_candidates(field_name, alternatives) if alternatives else None
+            if notes is not None:
+                return notes
+        if mode == "regex":
+            return None
+        return self.word_candidates(field_name, value, mode)
+
+    def word_candidates(self, field_name: str, value: str, mode: str):
+        """Candidates from the word postings, for values without patterns."""
+        if mode in ("exact", "contains") and SEARCH_WILDCARDS & set(value):
+            return None
+        if mode == "substring" and REGEX_SPECIAL & set(value):
+            return None
+        text = normalize(value)
+        spans = list(WORD_RE.finditer(text))
+        if not spans:
+            return None
+        postings = self.fields.get(normalize(field_name))
+        if postings is None:
+            return set()
+        candidates = None
+        for span in spans:
+            # Words touching either end of a contained text may continue in the field
+            open_start = mode != "exact" and span.start() == 0
+            open_end = mode != "exact" and span.end() == len(text)
+            notes = postings.notes_with_word(span.group(), prefix=open_end, suffix=open_start)
+            candidates = notes if candidates is None else candidates & notes
+            if not candidates:
+                break
+        return candidates
+
+    def trigram_candidates(self, field_name: str, alternatives):
+        """Notes whose *field_name* holds every literal of at least one alternative.
+
+        Returns ``None`` if some alternative has no literal of three or more
+        characters, since any note could then match it.
+        """
+        gram_sets = []
+        for literals in alternatives:
+            grams = set()
+            for literal in literals:
+                grams |= trigrams(normalize(literal))
+            if not grams:
+                return None
+            gram_sets.append(grams)
+        notes = set()
+        for slot in self._field_slots.get(normalize(field_name), ()):
+            postings = self.trigrams.get(slot)
+            if postings is None:
+                continue
+            for grams in gram_sets:
+                for doc in postings.docs_with_all(grams):
+                    note_id = self.doc_notes[doc]
+                    entry = self.notes.get(note_id)
+                    if entry is not None and entry[2] == doc:
+                        notes.add(note_id)
+        return notes
+
+    def candidates(self, col, conditions, join: str = "AND"):
+        """Candidate note ids for *conditions* (``(field, value, mode)``), or ``None``."""
+        with self._lock:
+            self.lookups += 1
+            if not self._refresh(col):
+                self.fallbacks += 1
+                return None
+            combined = None
+            for field_name, value, mode in conditions:
+                notes = self.condition_candidates(field_name, value, mode)
+                if notes is None:
+                    if join == "OR":
+                        combined = None
+                        break
+                    continue
+                if combined is None:
+                    combined = notes
+                elif join == "OR":
+                    combined = combined | notes
+                else:
+                    combined = combined & notes
+            if combined is None or len(combined) > MAX_CANDIDATES:
+                self.fallbacks += 1
+                return None
+            return combined
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "building": self.building,
+            "error": self.error,
+            "notes": len(self.notes),
+            "fields": {key: len(postings.postings) for key, postings in self.fields.items()},
+            "trigram_fields": len(self.trigrams),
+            "trigram_bytes": sum(postings.nbytes() for postings in self.trigrams.values()),
+            "dead_docs": self.dead_docs(),
+            "build_seconds": self.built_at,
+            "refreshes": self.refreshes,
+            "lookups": self.lookups,
+            "fallbacks": self.fallbacks,
+        }
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for(username: str):
+    """Return *username*'s ready index, starting a build if there is none yet."""
+    if not FIELD_INDEX_ENABLED or not username:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(username)
+        if index is None:
+            index = FieldIndex(username)
+            _indexes[username] = index
+    if not index.ready:
+        index.start_build()
+        return None
+    return index
+
+
+def drop_index(username: str) -> None:
+    with _indexes_lock:
+        _indexes.pop(username, None)
+
+
+def field_index_stats() -> dict:
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    return {index.username: index.stats() for index in indexes}
+
+
+def find_notes_among(col, search_query: str, candidates) -> list:
+    """Run *search_query* over *candidates* only.
+
+    Ids come back grouped by notetype, the order a field search over the
+    whole collection returns them in.
+    """
+    candidates = sorted(candidates)
+    note_ids = []
+    for start in range(0, len(candidates), VERIFY_CHUNK_SIZE):
+        chunk = ",".join(str(note_id) for note_id in candidates[start:start + VERIFY_CHUNK_SIZE])
+        note_ids.extend(col.find_notes(f"nid:{chunk} ({search_query})"))
+    if not note_ids:
+        return []
+    return col.db.list(f"select id from notes where id in {ids2str(note_ids)} order by mid, id")
+
+
+def find_notes(col, username: str, search_query: str, conditions, join: str = "AND") -> list:
+    """``col.find_notes(search_query)``, narrowed by the field index when it can be.
+
+    *conditions* are the ``(field, value, mode)`` field conditions that
+    *search_query* was built from, combined with *join*.
+    """
+    index = index_for(username)
+    candidates = index.candidates(col, conditions, join) if index else None
+    if candidates is None:
+        return col.find_notes(search_query)
+    if not candidates:
+        return []
+    return find_notes_among(col, search_query, candidates)
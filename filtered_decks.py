@@ -0,0 +1,115 @@
+"""Filtered deck actions for ``POST /api/decks/filtered``.
+
+Each entry of :data:`ACTIONS` takes one item of the request's ``decks`` list
+and carries it out with the backend's own filtered-deck operation, which
+moves all of a deck's cards in one go.  Actions raise :class:`ValueError`
+for a bad item and :class:`LookupError` for a missing deck, and return a
+dict with the deck id, its name and the number of cards involved.  New
+actions only need an entry here.
+"""
+
+from anki.decks import DeckId
+from anki.decks_pb2 import Deck
+
+# Order name -> value, as listed under FilteredSearchOrder in /api/decks/config/enums
+ORDERS = {name: value.number for name, value in Deck.Filtered.SearchTerm.Order.DESCRIPTOR.values_by_name.items()}
+# Anki builds a filtered deck from at most two searches
+MAX_SEARCH_TERMS = 2
+DEFAULT_LIMIT = 100
+
+
+def filtered_deck_id(col, item) -> int:
+    """The id of the existing filtered deck *item* names with ``deck_id``."""
+    deck_id = item.get('deck_id')
+    if deck_id is None:
+        raise ValueError("deck_id is required")
+    try:
+        deck_id = int(deck_id)
+    except (TypeError, ValueError):
+        raise ValueError("deck_id must be an integer")
+    deck = col.decks.get(DeckId(deck_id), default=False)
+    if deck is None:
+        raise LookupError(f"Deck {deck_id} not found")
+    if not deck['dyn']:
+        raise ValueError("Deck is not a filtered deck")
+    return deck_id
+
+
+def _card_count(col, deck_id: int) -> int:
+    return col.db.scalar("select count() from cards where did = ?", deck_id)
+
+
+def _search_terms(item) -> list:
+    terms = item.get('search_terms')
+    if terms is None:
+        terms = [{key: item[key] for key in ('search', 'limit', 'order') if key in item}]
+    if not isinstance(terms, list) or not 1 <= len(terms) <= MAX_SEARCH_TERMS:
+        raise ValueError(f"search_terms must be a list of 1 to {MAX_SEARCH_TERMS} searches")
+    parsed = []
+    for term in terms:
+        if not isinstance(term, dict) or not isinstance(term.get('search'), str) or not term['search']:
+            raise ValueError("Each search term needs a search")
+        limit = term.get('limit', DEFAULT_LIMIT)
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            raise ValueError("limit must be a positive integer")
+        order = term.get('order', 'RANDOM')
+        if isinstance(order, str) and order.upper() in ORDERS:
+            order = ORDERS[order.upper()]
+        elif order not in ORDERS.values() or isinstance(order, bool):
+            raise ValueError(f"order must be one of: {', '.join(ORDERS)}")
+        parsed.append(Deck.Filtered.SearchTerm(search=term['search'], limit=limit, order=order))
+    return parsed
+
+
+###---- ACTIONS ----###
+def build(col, item) -> dict:
+    """Create a filtered deck, or update the one named by ``deck_id``, and fill it."""
+    deck_id = filtered_deck_id(col, item) if item.get('deck_id') is not None else 0
+    terms = _search_terms(item)
+    reschedule = item.get('reschedule', True)
+    if not isinstance(reschedule, bool):
+        raise ValueError("reschedule must be true or false")
+
+    deck = col.sched.get_or_create_filtered_deck(DeckId(deck_id))
+    if item.get('name'):
+        deck.name = str(item['name'])
+    elif not deck_id:
+        raise ValueError("name is required to create a filtered deck")
+    del deck.config.search_terms[:]
+    deck.config.search_terms.extend(terms)
+    deck.config.reschedule = reschedule
+    # An empty deck is reported with no cards rather than as an error
+    deck.allow_empty = True
+    deck_id = col.sched.add_or_update_filtered_deck(deck).id
+    return {"deck_id": deck_id, "name": deck.name, "cards": _card_count(col, deck_id)}
+
+
+def rebuild(col, item) -> dict:
+    deck_id = filtered_deck_id(col, item)
+    cards = col.sched.rebuild_filtered_deck(DeckId(deck_id)).count
+    return {"deck_id": deck_id, "name": col.decks.name(DeckId(deck_id)), "cards": cards}
+
+
+def empty(col, item) -> dict:
+    """Return the deck's cards to their home decks, keeping the deck."""
+    deck_id = filtered_deck_id(col, item)
+    cards = _card_count(col, deck_id)
+    col.sched.empty_filtered_deck(DeckId(deck_id))
+    return {"deck_id": deck_id, "name": col.decks.name(DeckId(deck_id)), "cards": cards}
+
+
+def delete(col, item) -> dict:
+    """Return the deck's cards to their home decks and remove the deck."""
+    deck_id = filtered_deck_id(col, item)
+    cards = _card_count(col, deck_id)
+    name = col.decks.name(DeckId(deck_id))
+    col.decks.remove([DeckId(deck_id)])
+    return {"deck_id": deck_id, "name": name, "cards": cards}
+
+
+ACTIONS = {
+    "build": build,
+    "rebuild": rebuild,
+    "empty": empty,
+    "delete": delete,
+}
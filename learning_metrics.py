@@ -0,0 +1,191 @@
+"""Filtering and sorting of a deck's cards by their review statistics.
+
+The by-ease, by-learning-metrics and reset-difficult routes all select cards
+by reviews, interval, ease factor, lapses and the reviews-to-interval ratio.
+:func:`select_cards` reads those columns for a deck in one query and applies
+the bounds as vectorised NumPy masks.  Without NumPy the same filters run as a
+plain Python loop over the rows.  A sort is done by SQLite, which reads the
+rows in sort order from the cursor on, in chunks, until the page is full.
+"""
+
+import math
+from typing import NamedTuple
+
+from anki.utils import ids2str
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Metrics that can be bounded or sorted on; factor is in permille (2500 = 250%).
+METRICS = ("reviews", "interval", "factor", "lapses", "ratio")
+# SQL for each metric; a card with no interval has an infinite ratio.
+SORT_KEYS = {
+    "reviews": "reps",
+    "interval": "ivl",
+    "factor": "factor",
+    "lapses": "lapses",
+    "ratio": "(case when ivl > 0 then cast(reps as real) / ivl else 1e999 end)",
+}
+# Rows read per query when scanning in sort order.
+SORTED_CHUNK_SIZE = 1000
+
+
+class MetricRow(NamedTuple):
+    id: int
+    nid: int
+    did: int
+    queue: int
+    reviews: int
+    interval: int
+    factor: int
+    lapses: int
+    ratio: float
+
+
+def _load_rows(col, deck_id: int, exclude_queues, after_id: int = None, by_id: bool = False,
+               sort_by: str = None, descending: bool = False, after_value=None, limit: int = None) -> list:
+    deck_ids = col.decks.deck_and_child_ids(deck_id)
+    sql = f"select id, nid, did, queue, reps, ivl, factor, lapses from cards where did in {ids2str(deck_ids)}"
+    args = []
+    if exclude_queues:
+        sql += f" and queue not in {ids2str(exclude_queues)}"
+    if sort_by:
+        key = SORT_KEYS[sort_by]
+        if after_value is not None:
+            value = _sql_number(after_value)
+            sql += f" and ({key} {'<' if descending else '>'} {value} or ({key} = {value} and id > ?))"
+            args.append(after_id)
+        sql += f" order by {key}{' desc' if descending else ''}, id limit {int(limit)}"
+        return col.db.all(sql, *args)
+    if after_id is not None:
+        sql += " and id > ?"
+        args.append(after_id)
+    if by_id:
+        sql += " order by id"
+    return col.db.all(sql, *args)
+
+
+def _sql_number(value) -> str:
+    """*value* as an SQL literal.  Floats lose precision as query parameters,
+    which breaks the equality test of a keyset, and infinity becomes NULL."""
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "1e999" if value > 0 else "-1e999"
+    return repr(value)
+
+
+def cursor_key(row: MetricRow, sort_by: str = None) -> tuple:
+    """Position of *row* in a paged result, for :func:`select_cards` ``after``."""
+    return (getattr(row, sort_by), row.id) if sort_by else (row.id,)
+
+
+def valid_cursor(after: list, sort_by: str = None) -> bool:
+    """True if *after* is a :func:`cursor_key` for a result sorted by *sort_by*."""
+    if not sort_by:
+        return len(after) == 1
+    if len(after) != 2:
+        return False
+    value = after[0]
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and not math.isnan(value)
+
+
+def select_cards(col, deck_id: int, bounds: dict = None, exclude_queues=(),
+                 sort_by: str = None, descending: bool = False, limit: int = None,
+                 after: list = None, by_id: bool = False) -> list:
+    """Return :class:`MetricRow` for the cards in *deck_id* (and its children)
+    whose metrics fall inside *bounds*.
+
+    *bounds* maps a name from :data:`METRICS` to an inclusive ``(min, max)``
+    pair where either end may be ``None``.  The ratio of a card with no
+    interval is infinite.  Rows keep the deck's natural order (id order with
+    *by_id*) unless *sort_by* names a metric, in which case ties are in id
+    order; *limit* is applied last.
+
+    For keyset paging pass *by_id* and, after the first page, the
+    :func:`cursor_key` of the last row seen as *after*.  Sorted pages are
+    read in sort order from the cursor on, so a page costs about the same
+    however deep it is.
+    """
+    bounds = {name: bound for name, bound in (bounds or {}).items() if bound != (None, None)}
+    for name in list(bounds) + ([sort_by] if sort_by else []):
+        if name not in METRICS:
+            raise ValueError(f"Unknown metric '{name}'")
+    if after and not valid_cursor(after, sort_by):
+        raise ValueError("Invalid cursor")
+    select = _select_numpy if np is not None else _select_python
+
+    if sort_by:
+        return _select_sorted(col, deck_id, bounds, exclude_queues, sort_by, descending, limit,
+                              after, select)
+    rows = _load_rows(col, deck_id, exclude_queues, after[-1] if after else None, by_id)
+    if not rows:
+        return []
+    return select(rows, bounds, limit)
+
+
+def _select_sorted(col, deck_id, bounds, exclude_queues, sort_by, descending, limit, after, select) -> list:
+    after_value, after_id = after if after else (None, None)
+    chunk_size = max(limit or 0, SORTED_CHUNK_SIZE)
+    selected = []
+    while limit is None or len(selected) < limit:
+        rows = _load_rows(col, deck_id, exclude_queues, after_id, sort_by=sort_by, descending=descending,
+                          after_value=after_value, limit=chunk_size)
+        if rows:
+            selected.extend(select(rows, bounds))
+        if len(rows) < chunk_size:
+            break
+        last = rows[-1]
+        after_value, after_id = getattr(_metric_row(last), sort_by), last[0]
+    return selected[:limit] if limit is not None else selected
+
+
+def _metric_row(row) -> MetricRow:
+    reviews, interval = row[4], row[5]
+    return MetricRow(*row, reviews / interval if interval > 0 else float("inf"))
+
+
+def _select_numpy(rows, bounds, limit=None) -> list:
+    table = np.array(rows, dtype=np.int64)
+    interval = table[:, 5]
+    ratio = np.full(len(table), np.inf)
+    np.divide(table[:, 4], interval, out=ratio, where=interval > 0)
+    columns = {
+        "reviews": table[:, 4],
+        "interval": interval,
+        "factor": table[:, 6],
+        "lapses": table[:, 7],
+        "ratio": ratio,
+    }
+
+    mask = np.ones(len(table), dtype=bool)
+    for name, (low, high) in bounds.items():
+        if low is not None:
+            mask &= columns[name] >= low
+        if high is not None:
+            mask &= columns[name] <= high
+    selected = np.flatnonzero(mask)
+    if limit is not None:
+        selected = selected[:limit]
+
+    return [
+        MetricRow(*values, ratio)
+        for values, ratio in zip(table[selected].tolist(), ratio[selected].tolist())
+    ]
+
+
+def _select_python(rows, bounds, limit=None) -> list:
+    selected = []
+    for row in rows:
+        card = _metric_row(row)
+        for name, (low, high) in bounds.items():
+            value = getattr(card, name)
+            if (low is not None and value < low) or (high is not None and value > high):
+                break
+        else:
+            selected.append(card)
+            if limit is not None and len(selected) == limit:
+                break
+    return selected
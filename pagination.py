@@ -0,0 +1,98 @@
+"""Keyset pagination for the list endpoints.
+
+A request that sends ``page_size`` (and, after the first page, the
+``cursor`` returned by the previous one) gets a page of results ordered by
+card id, fetched with ``id > last_id`` rather than an offset, so every page
+costs the same however deep the client goes.  Cursors are opaque, URL-safe
+strings; requests without ``page_size`` get the unpaginated list as before.
+"""
+
+import base64
+import json
+import os
+
+# Largest page a client may ask for.
+MAX_PAGE_SIZE = int(os.environ.get("ANKI_API_MAX_PAGE_SIZE", 5000))
+
+
+def encode_cursor(key) -> str:
+    """Return an opaque cursor for the sort key of the last item on a page."""
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or not key or not isinstance(key[-1], int):
+        raise ValueError("Invalid cursor")
+    return key
+
+
+class PageRequest:
+    """The paging parameters of one request.
+
+    ``limit`` is ``None`` when the client did not ask for paging; otherwise it
+    is one more than the page size, so :meth:`respond` can tell whether
+    another page follows.
+    """
+
+    def __init__(self, page_size: int = None, after: list = None):
+        self.page_size = page_size
+        self.after = after
+
+    @property
+    def enabled(self) -> bool:
+        return self.page_size is not None
+
+    @property
+    def limit(self):
+        return self.page_size + 1 if self.enabled else None
+
+    @property
+    def after_id(self):
+        """Id of the last item on the previous page, if any."""
+        return self.after[-1] if self.after else None
+
+    def trim(self, items: list, key=lambda item: (item["id"],)):
+        """Cut *items* to the page size; return ``(items, next_cursor)``."""
+        if not self.enabled or len(items) <= self.page_size:
+            return items, None
+        items = items[:self.page_size]
+        return items, encode_cursor(key(items[-1]))
+
+    def body(self, items: list, next_cursor: str = None):
+        """The response body: the bare list, or a page with its next cursor."""
+        if not self.enabled:
+            return items
+        return {"cards": items, "next_cursor": next_cursor, "page_size": self.page_size}
+
+    def trailer(self, next_cursor: str = None):
+        """The last line of a streamed page, or ``None`` when not paging."""
+        if not self.enabled:
+            return None
+        return {"next_cursor": next_cursor, "page_size": self.page_size}
+
+    def respond(self, items: list, key=lambda item: (item["id"],)):
+        """Trim *items* to the page and return the response body."""
+        return self.body(*self.trim(items, key))
+
+
+def page_request(data) -> PageRequest:
+    """Read ``page_size`` and ``cursor`` from a request body.
+
+    Raises ``ValueError`` with a client-facing message for bad values.
+    """
+    data = data or {}
+    page_size = data.get("page_size")
+    cursor = data.get("cursor")
+    if page_size is None:
+        if cursor:
+            raise ValueError("cursor requires page_size")
+        return PageRequest()
+    if not isinstance(page_size, int) or isinstance(page_size, bool) or not 0 < page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be an integer between 1 and {MAX_PAGE_SIZE}")
+    return PageRequest(page_size, decode_cursor(cursor) if cursor else None)
@@ -0,0 +1,90 @@
+"""Cached responses for the search endpoints.
+
+Dashboards repeat the same searches while the collection rarely changes.
+:func:`cached_result` keys each JSON response on the user, the endpoint, the
+normalised request parameters and the collection's change stamp (its ``mod``
+time plus the number of writes this server has run against it), so a repeat
+request is answered from memory after one ``mod`` read, and any change to the
+collection makes the old entries unreachable.  Entries are evicted LRU once
+the cache's entry or byte budget is reached.
+"""
+
+import json
+import os
+from functools import wraps
+
+from flask import current_app, g, request
+
+from anki_paths import collection_path
+from caches import named_cache
+from collection_executor import request_username, write_generation
+from collection_pool import acquire_collection, release_collection
+from streaming import wants_ndjson
+
+RESULT_CACHE_ENTRIES = int(os.environ.get("ANKI_API_RESULT_CACHE_ENTRIES", 512))
+RESULT_CACHE_BYTES = int(os.environ.get("ANKI_API_RESULT_CACHE_BYTES", 32 * 1024 * 1024))
+
+# (username, endpoint, params, mod, generation) -> (body, status)
+result_cache = named_cache("results", max_entries=RESULT_CACHE_ENTRIES, max_bytes=RESULT_CACHE_BYTES)
+
+
+def change_stamp(username: str) -> tuple:
+    """Return ``(mod, generation)`` for *username*'s collection.
+
+    The stamp is read once per request and reused by later callers.
+    """
+    stamps = g.setdefault("change_stamps", {})
+    if username not in stamps:
+        # Read the generation first: a write finishing in between then only
+        # produces a key no later request will use
+        generation = write_generation(username)
+        col = acquire_collection(username)
+        try:
+            stamps[username] = (col.mod, generation)
+        finally:
+            release_collection(col)
+    return stamps[username]
+
+
+def request_params() -> str:
+    """The request's parameters, minus the username, in a canonical form."""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = {key: value for key, value in data.items() if key != "username"}
+    return json.dumps(
+        [request.view_args or {}, sorted(request.args.items(multi=True)), data],
+        sort_keys=True, separators=(",", ":"), default=str,
+    )
+
+
+def cached_result(view):
+    """Serve repeated requests for an unchanged collection from the result cache.
+
+    Only complete ``200`` JSON responses are stored; streamed (NDJSON)
+    requests and requests for a user without a collection always run the view.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        username = request_username()
+        if not username or wants_ndjson() or not os.path.exists(collection_path(username)):
+            return view(*args, **kwargs)
+        try:
+            key = (username, request.endpoint, request_params()) + change_stamp(username)
+        except Exception:
+            # Let the view report a missing or broken collection as usual
+            return view(*args, **kwargs)
+
+        cached = result_cache.get(key)
+        if cached is not None:
+            body, status = cached
+            response = current_app.response_class(body, status=status, mimetype="application/json")
+            response.headers["X-Result-Cache"] = "hit"
+            return response
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and response.mimetype == "application/json" and not response.is_streamed:
+            body = response.get_data()
+            result_cache.put(key, (body, response.status_code), len(body))
+            response.headers["X-Result-Cache"] = "miss"
+        return response
+    return wrapper
@@ -0,0 +1,223 @@
+"""Cost-based evaluation of the field conditions of an advanced search.
+
+A search like ``"Front:cat" AND "Back:re:..."`` handed to the backend as one
+string is matched note by note across the whole collection, so an expensive
+regex runs everywhere even when a cheap exact match would have left a handful
+of notes.  :func:`run_search` instead estimates, for every condition, how many
+notes it matches (from the field index when it is ready, otherwise from how
+many notes have the field and a default share per operation) and what
+matching one note costs.  With ``AND`` the conditions then run one at a time,
+most selective first, each over the notes that survived the ones before it.
+
+``OR`` can't be split that way, so an ``OR`` search runs as one search,
+narrowed by the index and the deck where possible.  Either way the stages
+that ran, with their estimates, sizes and timings, are returned alongside
+the note ids.
+"""
+
+import time
+from typing import NamedTuple
+
+from anki.utils import ids2str
+
+import field_index
+
+# Relative cost of matching one note, by operation
+OPERATION_COSTS = {"is": 1.0, "contains": 1.5, "regex": 4.0}
+# Share of the notes having the field assumed to match when the index can't tell
+DEFAULT_SELECTIVITY = {"is": 0.01, "contains": 0.1, "regex": 0.25}
+# Operation -> field index mode
+INDEX_MODES = {"is": "exact", "contains": "contains", "regex": "regex"}
+
+
+class FieldCondition(NamedTuple):
+    position: int  # index in the request's field_conditions
+    field_name: str
+    operation: str
+    value: str
+    query: str  # backend search for this condition alone
+
+    @property
+    def index_condition(self) -> tuple:
+        return (self.field_name, self.value, INDEX_MODES[self.operation])
+
+
+class Estimate(NamedTuple):
+    notes: int
+    cost: float
+    source: str  # "index" or "statistics"
+    candidates: set  # superset of the matches from the index, or None
+
+
+def parse_conditions(field_conditions) -> list:
+    """:class:`FieldCondition` for each usable entry of a request's ``field_conditions``.
+
+    Raises :class:`ValueError` unless *field_conditions* is a list of objects
+    with a known operation.  Entries without a field name or value are
+    skipped.
+    """
+    if not isinstance(field_conditions, list):
+        raise ValueError("field_conditions must be a list")
+    conditions = []
+    for position, condition in enumerate(field_conditions):
+        if not isinstance(condition, dict):
+            raise ValueError(f"field_conditions[{position}] must be an object")
+        field_name = condition.get('field_name')
+        operation = condition.get('operation', 'is')  # 'is', 'contains', 'regex'
+        value = condition.get('value')
+        case_sensitive = condition.get('case_sensitive', False)
+
+        if operation not in OPERATION_COSTS:
+            raise ValueError(f"field_conditions[{position}].operation must be one of: {', '.join(OPERATION_COSTS)}")
+        if not field_name or not value:
+            continue
+        if not isinstance(field_name, str) or not isinstance(value, str):
+            raise ValueError(f"field_conditions[{position}] field_name and value must be strings")
+
+        if operation == 'is':
+            query = f"\"{field_name}:{value}\""
+        elif operation == 'contains':
+            query = f"\"{field_name}:*{value}*\""
+        else:
+            re_modifier = "(?-i)" if case_sensitive else ""
+            query = f"\"{field_name}:re:{re_modifier}{value}\""
+        conditions.append(FieldCondition(position, field_name, operation, value, query))
+    return conditions
+
+
+def combined_query(conditions, join: str = "AND", deck_ids=None) -> str:
+    """The single backend search equivalent to *conditions* (and the deck)."""
+    search_query = f" {join} ".join(condition.query for condition in conditions)
+    if deck_ids:
+        search_query = f"{deck_search(deck_ids)} ({search_query})"
+    return search_query
+
+
+def deck_search(deck_ids) -> str:
+    """Backend search for cards in *deck_ids*; ``deck:`` would take a deck name."""
+    return f"did:{','.join(str(deck_id) for deck_id in deck_ids)}"
+
+
+###---- ESTIMATES ----###
+def field_note_counts(col) -> dict:
+    """Number of notes having each (normalised) field name."""
+    notes_by_mid = dict(col.db.all("select mid, count() from notes group by mid"))
+    counts = {}
+    for notetype in col.models.all():
+        for field in notetype["flds"]:
+            key = field_index.normalize(field["name"])
+            counts[key] = counts.get(key, 0) + notes_by_mid.get(notetype["id"], 0)
+    return counts
+
+
+def estimate(col, index, condition: FieldCondition, note_counts: dict) -> Estimate:
+    cost = OPERATION_COSTS[condition.operation]
+    if index is not None:
+        candidates = index.candidates(col, [condition.index_condition])
+        if candidates is not None:
+            return Estimate(len(candidates), cost, "index", candidates)
+    with_field = note_counts.get(field_index.normalize(condition.field_name), 0)
+    return Estimate(round(with_field * DEFAULT_SELECTIVITY[condition.operation]), cost, "statistics", None)
+
+
+###---- EXECUTION ----###
+def _intersect(notes, other):
+    if notes is None:
+        return other
+    if other is None:
+        return notes
+    return notes & other
+
+
+def _search(col, search_query: str, scope) -> tuple:
+    """Run *search_query* over *scope* (``None`` for every note); return ``(note_ids, method)``.
+
+    Large scopes are cheaper to search in one pass and filter afterwards.
+    """
+    if scope is not None and len(scope) <= field_index.MAX_CANDIDATES:
+        return field_index.find_notes_among(col, search_query, scope), "restricted"
+    note_ids = col.find_notes(search_query)
+    if scope is not None:
+        note_ids = [note_id for note_id in note_ids if note_id in scope]
+    return note_ids, "scan"
+
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def run_search(col, username: str, conditions, join: str = "AND", deck_id: int = None) -> tuple:
+    """Return ``(note_ids, plan)`` for *conditions* joined by *join*.
+
+    Note ids come back in ascending order, whichever stages ran: a stage
+    narrowed by the field index returns its matches grouped by notetype,
+    one run by the backend does not.  With *deck_id*, only notes with a card
+    in that deck or its children are returned.  *plan* lists the stages that
+    ran.  A malformed search raises the backend's ``SearchError`` or
+    ``InvalidInput``.
+    """
+    started = time.perf_counter()
+    stages = []
+    scope = None
+
+    deck_ids = None
+    if deck_id is not None:
+        stage_started = time.perf_counter()
+        deck_ids = col.decks.deck_and_child_ids(deck_id)
+        scope = set(col.db.list(f"select distinct nid from cards where did in {ids2str(deck_ids)}"))
+        stages.append({"stage": "deck", "deck_id": deck_id, "output": len(scope), "ms": _elapsed_ms(stage_started)})
+
+    index = field_index.index_for(username) if conditions else None
+
+    if join == "OR" or not conditions:
+        stage_started = time.perf_counter()
+        candidates = index.candidates(col, [condition.index_condition for condition in conditions], join) \
+            if index is not None else None
+        search_scope = _intersect(scope, candidates)
+        if search_scope is not None and not search_scope:
+            note_ids, method = [], "index"
+        else:
+            note_ids, method = _search(col, combined_query(conditions, join), search_scope)
+        stages.append({"stage": "search", "query": combined_query(conditions, join), "method": method,
+                       "index_candidates": None if candidates is None else len(candidates),
+                       "input": None if search_scope is None else len(search_scope),
+                       "output": len(note_ids), "ms": _elapsed_ms(stage_started)})
+        return sorted(note_ids), _plan(conditions, join, deck_ids, stages, started)
+
+    stage_started = time.perf_counter()
+    note_counts = field_note_counts(col)
+    estimates = [estimate(col, index, condition, note_counts) for condition in conditions]
+    order = sorted(range(len(conditions)), key=lambda i: (estimates[i].notes, estimates[i].cost))
+    index_scope = None
+    for candidates in (e.candidates for e in estimates if e.candidates is not None):
+        index_scope = _intersect(index_scope, candidates)
+    scope = _intersect(scope, index_scope)
+    stages.append({"stage": "plan", "order": [conditions[i].position for i in order],
+                   "index_candidates": None if index_scope is None else len(index_scope),
+                   "ms": _elapsed_ms(stage_started)})
+
+    note_ids = []
+    for i in order:
+        condition, condition_estimate = conditions[i], estimates[i]
+        stage = {"stage": "condition", "condition": condition.position, "field_name": condition.field_name,
+                 "operation": condition.operation, "query": condition.query,
+                 "estimated_notes": condition_estimate.notes, "estimate_source": condition_estimate.source}
+        if scope is not None and not scope:
+            # An earlier stage left nothing to match
+            stage["skipped"] = True
+            note_ids = []
+            stages.append(stage)
+            continue
+        stage_started = time.perf_counter()
+        stage["input"] = None if scope is None else len(scope)
+        note_ids, stage["method"] = _search(col, condition.query, scope)
+        scope = set(note_ids)
+        stage["output"] = len(note_ids)
+        stage["ms"] = _elapsed_ms(stage_started)
+        stages.append(stage)
+    return sorted(note_ids), _plan(conditions, join, deck_ids, stages, started)
+
+
+def _plan(conditions, join: str, deck_ids, stages: list, started: float) -> dict:
+    return {"query": combined_query(conditions, join, deck_ids), "join": join,
+            "stages": stages, "total_ms": _elapsed_ms(started)}
@@ -0,0 +1,48 @@
+"""Newline-delimited JSON responses for the list endpoints.
+
+Clients that send ``Accept: application/x-ndjson`` get one JSON object per
+line, written as the rows are produced instead of after the whole list has
+been built.  The pooled collection stays checked out until the response has
+been sent in full (or the client goes away) and is then released.
+"""
+
+import json
+
+from flask import Response, request, stream_with_context
+
+from collection_pool import release_collection
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Cards turned into response lines per notes query.
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson() -> bool:
+    """True if the client prefers NDJSON over a JSON array."""
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(col, rows: list, entries, trailer: dict = None,
+                  batch_size: int = STREAM_BATCH_SIZE) -> Response:
+    """Stream ``entries(batch)`` for successive batches of *rows*, one object per line.
+
+    *entries* turns a batch of rows into response dicts, loading whatever
+    notes it needs for that batch only.  *trailer*, if given, is sent as the
+    last line.  *col* is released once the response is closed; the caller
+    must not release it.
+    """
+    def generate():
+        try:
+            for start in range(0, len(rows), batch_size):
+                for entry in entries(rows[start:start + batch_size]):
+                    yield json.dumps(entry) + "\n"
+            if trailer:
+                yield json.dumps(trailer) + "\n"
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    response.call_on_close(lambda: release_collection(col))
+    return response
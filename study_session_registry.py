@@ -0,0 +1,285 @@
+"""Registry of concurrent study sessions, keyed by session token.
+
+Each :class:`StudySession` owns its scheduler, current card and timers, so one
+server process can drive many learners' study loops at the same time.  The
+collection handle itself comes from the shared pool and is returned when the
+session is closed or expires.
+"""
+
+import os
+import secrets
+import threading
+import time
+from collections import deque
+
+from anki.cards import Card
+from anki.notes import NoteId
+from anki.scheduler.v3 import Scheduler as V3Scheduler
+
+from anki_paths import media_path as get_media_path
+from collection_pool import acquire_collection, release_collection
+
+# Seconds a study session may sit unused before it is closed.
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get("ANKI_API_STUDY_SESSION_TTL", 1800))
+# Cards fetched ahead per queue refill; 0 fetches one card per answer as before.
+DEFAULT_PREFETCH = int(os.environ.get("ANKI_API_STUDY_PREFETCH", 0))
+# How study responses deliver media: 'url' links to /api/media, 'inline' embeds base64.
+DEFAULT_MEDIA_MODE = os.environ.get("ANKI_API_MEDIA_MODE", "url")
+MEDIA_MODES = ("url", "inline")
+# Upper bound on the prefetch size a client may ask for.
+MAX_PREFETCH = 50
+# Seconds a prefetched queue is trusted before it is fetched again, so cards
+# that fall due in the meantime (e.g. learning steps) are not held back.
+PREFETCH_MAX_AGE = 60.0
+
+
+def _returns_today(new_state) -> bool:
+    """True if an answer puts the card back into today's queue."""
+    if new_state.WhichOneof("kind") == "filtered":
+        if new_state.filtered.WhichOneof("kind") == "preview":
+            return True
+        normal = new_state.filtered.rescheduling.original_state
+    else:
+        normal = new_state.normal
+    return normal.WhichOneof("kind") in ("learning", "relearning")
+
+
+class StudySession:
+    """One learner's study loop over a deck.
+
+    Cards are taken from a local queue holding the next *prefetch* queued cards
+    with their notes and notetypes, so answering a card usually needs no
+    lookups before the next one is shown.  The queue is dropped and fetched
+    again whenever an answer or another request may have reordered it.
+    """
+
+    def __init__(self, session_id: str, username: str, prefetch: int = DEFAULT_PREFETCH):
+        self.session_id = session_id
+        self.username = username
+        self.collection = acquire_collection(username)
+        self.scheduler = V3Scheduler(self.collection)
+        self.media_path = get_media_path(username)
+        self.deck_id = None
+        self.current_card = None
+        self.current_queued = None
+        self.current_note = None
+        self.current_notetype = None
+        self.prefetch = min(max(0, prefetch), MAX_PREFETCH)
+        self.media_mode = DEFAULT_MEDIA_MODE
+        self._queue = deque()
+        self._counts = [0, 0, 0]
+        self._fetched_at = 0.0
+        self._mod = None
+        self.queue_fetches = 0
+        self.lock = threading.RLock()
+        self.started_at = time.time()
+        self.last_used = time.monotonic()
+        self.cards_answered = 0
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+    def select_deck(self) -> None:
+        """Make this session's deck current; other sessions may share the handle."""
+        if self.deck_id is not None and self.collection.decks.get_current_id() != self.deck_id:
+            self.collection.decks.select(self.deck_id)
+
+    def set_prefetch(self, prefetch: int) -> None:
+        self.prefetch = min(max(0, int(prefetch)), MAX_PREFETCH)
+        self.reset_queue()
+
+    def reset_queue(self) -> None:
+        """Forget the prefetched cards; the next card is fetched afresh."""
+        self._queue.clear()
+
+    def next_card(self):
+        """Advance to the next card due in the session's deck.
+
+        Returns ``(card, note, notetype, remaining)``, or ``None`` once the
+        deck has nothing left to study today.
+        """
+        self.current_card = self.current_queued = None
+        self.current_note = self.current_notetype = None
+        if self._queue and self.collection.mod != self._mod:
+            # Something outside this session changed the collection
+            self._queue.clear()
+        if not self._queue:
+            self._fill_queue()
+        if not self._queue:
+            return None
+        queued, note, notetype = self._queue.popleft()
+        card = Card(self.collection, backend_card=queued.card)
+        card.start_timer()
+        self.current_card = card
+        self.current_queued = queued
+        self.current_note = note
+        self.current_notetype = notetype
+        return card, note, notetype, sum(self._counts)
+
+    def answer(self, rating) -> int:
+        """Answer the current card and return the time taken in milliseconds."""
+        card = self.current_card
+        queued = self.current_queued
+        if card.timer_started is None:
+            card.start_timer()
+        # Checked before our own write moves the stamp on
+        changed_elsewhere = self.collection.mod != self._mod
+        answer = self.scheduler.build_answer(card=card, states=queued.states, rating=rating)
+        time_taken = card.time_taken(capped=False)
+        self.scheduler.answer_card(answer)
+        self.cards_answered += 1
+        self.current_card = self.current_queued = None
+
+        if changed_elsewhere or self._queue_changed(queued, answer):
+            self._queue.clear()
+        else:
+            self._counts[queued.queue] = max(0, self._counts[queued.queue] - 1)
+            self._mod = self.collection.mod
+        return time_taken
+
+    def ease_labels(self) -> list:
+        """Interval labels for the four answer buttons of the current card."""
+        return list(self.scheduler.describe_next_states(self.current_queued.states))
+
+    def _fill_queue(self) -> None:
+        self.select_deck()
+        queued_cards = self.scheduler.get_queued_cards(fetch_limit=max(1, self.prefetch))
+        self.queue_fetches += 1
+        self._counts = [
+            queued_cards.new_count,
+            queued_cards.learning_count,
+            queued_cards.review_count,
+        ]
+        notetypes = {}
+        for queued in queued_cards.cards:
+            note = self.collection.get_note(NoteId(queued.card.note_id))
+            if note.mid not in notetypes:
+                notetypes[note.mid] = self.collection.models.get(note.mid)
+            self._queue.append((queued, note, notetypes[note.mid]))
+        self._fetched_at = time.monotonic()
+        self._mod = self.collection.mod
+
+    def _queue_changed(self, queued, answer) -> bool:
+        if not self._queue:
+            return False
+        if time.monotonic() - self._fetched_at > PREFETCH_MAX_AGE:
+            return True
+        # A learning card coming back may jump ahead of the prefetched cards
+        if _returns_today(answer.new_state):
+            return True
+        # Answering may bury siblings that are already in the queue
+        note_id = queued.card.note_id
+        return any(entry[0].card.note_id == note_id for entry in self._queue)
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_used
+
+    def close(self) -> None:
+        if self.collection is not None:
+            release_collection(self.collection)
+            self.collection = None
+            self.scheduler = None
+            self.current_card = None
+            self.current_queued = None
+            self.current_note = None
+            self.current_notetype = None
+            self._queue.clear()
+
+    def info(self) -> dict:
+        """Describe the session for listings; the token itself is left out."""
+        return {
+            "username": self.username,
+            "deck_id": self.deck_id,
+            "current_card_id": self.current_card.id if self.current_card else None,
+            "cards_answered": self.cards_answered,
+            "prefetch": self.prefetch,
+            "media_mode": self.media_mode,
+            "prefetched": len(self._queue),
+            "queue_fetches": self.queue_fetches,
+            "started_at": self.started_at,
+            "idle_seconds": round(self.idle_seconds(), 1),
+        }
+
+
+class StudySessionRegistry:
+    """Thread-safe map of session token to :class:`StudySession`."""
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._defaults = {}
+        self._lock = threading.Lock()
+
+    def create(self, username: str, prefetch: int = DEFAULT_PREFETCH) -> StudySession:
+        """Open a new session for *username* under a fresh token."""
+        self.expire_idle()
+        session = StudySession(secrets.token_urlsafe(16), username, prefetch)
+        with self._lock:
+            self._sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id: str):
+        """Return the live session for *session_id*, or ``None``."""
+        self.expire_idle()
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def default_for(self, username: str, create: bool = False):
+        """Return the session used by clients that do not send a token."""
+        with self._lock:
+            session_id = self._defaults.get(username)
+        session = self.get(session_id) if session_id else None
+        if session is None and create:
+            session = self.create(username)
+            with self._lock:
+                self._defaults[username] = session.session_id
+        return session
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None and self._defaults.get(session.username) == session_id:
+                del self._defaults[session.username]
+        if session is None:
+            return False
+        with session.lock:
+            session.close()
+        return True
+
+    def close_for_user(self, username: str) -> int:
+        """Close every session on *username*'s collection."""
+        with self._lock:
+            session_ids = [
+                session_id for session_id, session in self._sessions.items()
+                if session.username == username
+            ]
+        for session_id in session_ids:
+            self.close(session_id)
+        return len(session_ids)
+
+    def expire_idle(self) -> int:
+        """Close sessions idle for longer than the timeout."""
+        if self.idle_timeout <= 0:
+            return 0
+        with self._lock:
+            expired = [
+                session_id for session_id, session in self._sessions.items()
+                if session.idle_seconds() > self.idle_timeout
+            ]
+        for session_id in expired:
+            self.close(session_id)
+        return len(expired)
+
+    def stats(self, username: str) -> dict:
+        """Describe *username*'s live sessions, without their tokens."""
+        self.expire_idle()
+        with self._lock:
+            sessions = [session for session in self._sessions.values() if session.username == username]
+        return {
+            "idle_timeout": self.idle_timeout,
+            "count": len(sessions),
+            "sessions": [session.info() for session in sessions],
+        }
+
+
+registry = StudySessionRegistry()
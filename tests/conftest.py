@@ -0,0 +1,96 @@
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki.collection import AddNoteRequest, Collection  # noqa: E402
+from anki.decks import DeckId  # noqa: E402
+
+import collection_pool  # noqa: E402
+from result_cache import result_cache  # noqa: E402
+
+
+@pytest.fixture
+def col(tmp_path):
+    """A new, empty collection."""
+    collection = Collection(str(tmp_path / "collection.anki2"))
+    yield collection
+    collection.close()
+
+
+def add_basic_notes(col, fronts, deck_name="Default", tags=()) -> list:
+    """Add a Basic note for each of *fronts* to *deck_name*; return their ids."""
+    deck_id = col.decks.id(deck_name)
+    notetype = col.models.by_name("Basic")
+    requests = []
+    for front in fronts:
+        note = col.new_note(notetype)
+        note["Front"] = front
+        note["Back"] = f"back of {front}"
+        note.tags = list(tags)
+        requests.append(AddNoteRequest(note=note, deck_id=DeckId(deck_id)))
+    col.add_notes(requests)
+    return [request.note.id for request in requests]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """A test client whose profiles live under a temporary home directory."""
+    monkeypatch.setenv("HOME", str(tmp_path))
+    from anki_api_server import app
+    return app.test_client()
+
+
+@pytest.fixture
+def username(client):
+    """A new profile with an empty collection."""
+    name = f"user-{uuid.uuid4().hex[:8]}"
+    assert client.post(f"/api/users/create/{name}").status_code == 201
+    yield name
+    collection_pool.pool.evict(name)
+    result_cache.clear()
+
+
+@contextmanager
+def borrowed(username):
+    """Borrow *username*'s pooled collection for a test's setup or checks."""
+    col = collection_pool.acquire_collection(username)
+    try:
+        yield col
+    finally:
+        collection_pool.release_collection(col)
+
+
+def pool_refs(username) -> int:
+    """How many times *username*'s pooled collection is currently borrowed."""
+    entry = collection_pool.pool._entries.get(username)
+    return entry.refs if entry else 0
+
+
+@pytest.fixture
+def add_notes(username):
+    """Add Basic notes to the test profile, as :func:`add_basic_notes` does."""
+    def add(fronts, deck_name="Default", tags=()):
+        with borrowed(username) as col:
+            return add_basic_notes(col, fronts, deck_name, tags)
+    return add
+
+
+@pytest.fixture
+def deck_named(username):
+    """Return the id of the test profile's deck *name*, creating it if needed."""
+    def deck(name):
+        with borrowed(username) as col:
+            return col.decks.id(name)
+    return deck
+
+
+def card_ids(response) -> list:
+    """Sorted ids of the cards a list route returned, paged or not."""
+    assert response.status_code == 200, response.json
+    cards = response.json if isinstance(response.json, list) else response.json["cards"]
+    return sorted(card["id"] for card in cards)
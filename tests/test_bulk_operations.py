@@ -0,0 +1,139 @@
+import pytest
+
+from conftest import borrowed
+
+
+@pytest.fixture
+def notes(add_notes, deck_named):
+    """Three tagged notes in a subdeck of Bulk, two untagged in Bulk, two elsewhere."""
+    tagged = add_notes(["t1", "t2", "t3"], deck_name="Bulk::Sub", tags=["bulk"])
+    untagged = add_notes(["u1", "u2"], deck_name="Bulk")
+    other = add_notes(["o1", "o2"], deck_name="Other")
+    return {"tagged": tagged, "untagged": untagged, "other": other, "deck_id": deck_named("Bulk")}
+
+
+def queues(username, note_ids) -> list:
+    with borrowed(username) as col:
+        return [col.db.scalar("select queue from cards where nid = ?", note_id) for note_id in note_ids]
+
+
+def target(notes, by):
+    """Request body and the notes it should reach, by tag or by deck."""
+    if by == "tag":
+        return {"tag": "bulk"}, notes["tagged"]
+    return {"deck_id": notes["deck_id"]}, notes["tagged"] + notes["untagged"]
+
+
+@pytest.mark.parametrize("by", ["tag", "deck"])
+@pytest.mark.parametrize("action, queue", [("suspend", -1), ("bury", -3)])
+def test_suspend_and_bury(client, username, notes, by, action, queue):
+    body, reached = target(notes, by)
+    response = client.post(f"/api/cards/{action}/by-{by}", json={"username": username, **body})
+    assert response.status_code == 200
+    assert response.json["count"] == len(reached)
+    assert queues(username, reached) == [queue] * len(reached)
+    assert queues(username, notes["other"]) == [0, 0]
+
+
+@pytest.mark.parametrize("by", ["tag", "deck"])
+def test_reset(client, username, notes, by):
+    body, reached = target(notes, by)
+    with borrowed(username) as col:
+        col.sched.set_due_date(col.db.list("select id from cards"), "3")
+    response = client.post(f"/api/cards/reset/by-{by}", json={"username": username, **body})
+    assert response.status_code == 200
+    assert response.json["count"] == len(reached)
+    assert queues(username, reached) == [0] * len(reached)
+    assert queues(username, notes["other"]) == [2, 2]
+
+
+@pytest.mark.parametrize("by", ["tag", "deck"])
+def test_reschedule_only_if_due(client, username, notes, by):
+    body, reached = target(notes, by)
+    due_note = reached[0]
+    with borrowed(username) as col:
+        col.sched.set_due_date(col.db.list("select id from cards where nid = ?", due_note), "5")
+    response = client.post(f"/api/cards/reschedule/by-{by}",
+                           json={"username": username, **body, "new_due_date": "0", "only_if_due": True})
+    assert response.status_code == 200
+    # Only the card in the review queue is moved; new cards are left alone
+    assert response.json["count"] == 1
+    with borrowed(username) as col:
+        assert col.db.scalar("select due from cards where nid = ?", due_note) == col.sched.today
+    assert queues(username, reached[1:]) == [0] * (len(reached) - 1)
+
+
+@pytest.mark.parametrize("by", ["tag", "deck"])
+def test_reposition(client, username, notes, by):
+    body, reached = target(notes, by)
+    response = client.post(f"/api/cards/reposition/by-{by}",
+                           json={"username": username, **body, "new_position": 100})
+    assert response.status_code == 200
+    assert response.json["count"] == len(reached)
+    with borrowed(username) as col:
+        positions = [col.db.scalar("select due from cards where nid = ?", note_id) for note_id in reached]
+    assert sorted(positions) == list(range(100, 100 + len(reached)))
+
+
+def test_delete_by_tag(client, username, notes):
+    response = client.delete("/api/cards/delete/by-tag", json={"username": username, "tag": "bulk"})
+    assert response.status_code == 200
+    with borrowed(username) as col:
+        assert sorted(col.find_notes("")) == sorted(notes["untagged"] + notes["other"])
+        assert col.card_count() == 4
+    response = client.delete("/api/cards/delete/by-tag", json={"username": username, "tag": "bulk"})
+    assert response.status_code == 404
+
+
+def test_delete_by_deck(client, username, notes):
+    response = client.delete("/api/cards/delete/by-deck", json={"username": username, "deck": "Bulk"})
+    assert response.status_code == 200
+    with borrowed(username) as col:
+        assert sorted(col.find_notes("")) == sorted(notes["other"])
+
+
+def test_bulk_operation_dry_run_and_apply(client, username, notes):
+    body = {"username": username, "search": "tag:bulk", "operation": "suspend"}
+    dry = client.post("/api/cards/bulk", json={**body, "dry_run": True}).json
+    assert dry["count"] == 3 and "changed" not in dry
+    assert queues(username, notes["tagged"]) == [0, 0, 0]
+    applied = client.post("/api/cards/bulk", json=body).json
+    assert applied["changed"] == 3
+    assert queues(username, notes["tagged"]) == [-1, -1, -1]
+    assert queues(username, notes["untagged"] + notes["other"]) == [0, 0, 0, 0]
+
+
+def test_bulk_operation_matches_the_by_tag_route(client, username, notes):
+    params = {"new_position": 50, "step": 2}
+    client.post("/api/cards/bulk", json={"username": username, "search": "tag:bulk",
+                                         "operation": "reposition", "params": params})
+    with borrowed(username) as col:
+        from_bulk = col.db.all("select id, due from cards order by id")
+        assert col.db.list("select due from cards where due >= 50 order by due") == [50, 52, 54]
+    client.post("/api/cards/reposition/by-tag", json={"username": username, "tag": "bulk", **params})
+    with borrowed(username) as col:
+        assert col.db.all("select id, due from cards order by id") == from_bulk
+
+
+@pytest.mark.parametrize("body, status", [
+    ({"search": "tag:x", "operation": "explode"}, 400),
+    ({"search": "tag:x", "operation": "reposition", "params": {"new_position": "first"}}, 400),
+    ({"search": "tag:x", "operation": "move", "params": {"deck_id": 424242}}, 404),
+    ({"search": "tag:(", "operation": "suspend"}, 400),
+    ({"search": "tag:x", "operation": "suspend", "params": ["x"]}, 400),
+])
+def test_bulk_operation_rejects_bad_requests(client, username, body, status):
+    response = client.post("/api/cards/bulk", json={"username": username, **body})
+    assert response.status_code == status
+    assert "error" in response.json
+
+
+@pytest.mark.parametrize("url, body", [
+    ("/api/cards/reposition/by-tag", {"tag": "bulk", "new_position": "first"}),
+    ("/api/cards/reposition/by-deck", {"deck_id": "Bulk", "new_position": 1}),
+    ("/api/cards/reset/by-tag", {"tag": "bulk", "restore_position": "yes"}),
+])
+def test_by_tag_and_by_deck_routes_check_their_params(client, username, notes, url, body):
+    response = client.post(url, json={"username": username, **body})
+    assert response.status_code == 400
+    assert queues(username, notes["tagged"]) == [0, 0, 0]
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+import blueprint_study_sessions
+from caches import LRUCache, media_cache
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_stays_within_its_byte_budget():
+    cache = LRUCache(max_bytes=10)
+    cache.put("a", "x", size=4)
+    cache.put("b", "y", size=4)
+    cache.put("a", "z", size=5)
+    assert cache.bytes == 9 and len(cache) == 2
+    cache.put("c", "w", size=3)
+    assert cache.bytes <= 10
+    assert cache.get("b") is None
+    cache.put("huge", "v", size=11)
+    assert cache.get("huge") is None
+    assert cache.bytes <= 10
+
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache(max_entries=4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("b")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+@pytest.fixture
+def sound(tmp_path):
+    media_cache.clear()
+    path = tmp_path / "clip.mp3"
+    path.write_bytes(b"first")
+    yield path
+    media_cache.clear()
+
+
+def encode(path):
+    return blueprint_study_sessions.encode_media_file("learner", path.name, str(path), os.stat(path))
+
+
+def test_media_encodings_are_reused_while_the_file_is_unchanged(sound):
+    first = encode(sound)
+    hits = media_cache.hits
+    assert encode(sound) == first == ("Zmlyc3Q=", "audio/mpeg")
+    assert media_cache.hits == hits + 1
+
+
+def test_a_changed_media_file_is_encoded_again(sound):
+    encode(sound)
+    stat = os.stat(sound)
+    sound.write_bytes(b"other")
+    # Same size; only the modification time tells the files apart
+    os.utime(sound, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert encode(sound) == ("b3RoZXI=", "audio/mpeg")
+    assert len(media_cache) == 2
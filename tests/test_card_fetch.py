@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from anki.collection import AddNoteRequest
+from anki.decks import DeckId
+
+import blueprint_cards
+from card_fetch import fetch_notes
+from conftest import add_basic_notes, borrowed
+from streaming import NDJSON_MIMETYPE
+
+
+@pytest.fixture
+def note_ids(col):
+    """Notes of notetypes with different field layouts, including empty and non-ASCII fields."""
+    ids = add_basic_notes(col, ["plain", "", "ünïcode <b>html</b>"])
+    requests = []
+    for name, values in [("Basic (and reversed card)", ["front", "back"]),
+                         ("Cloze", ["{{c1::cloze}} text", "extra"])]:
+        note = col.new_note(col.models.by_name(name))
+        for position, value in enumerate(values):
+            note.fields[position] = value
+        requests.append(AddNoteRequest(note=note, deck_id=DeckId(1)))
+    col.add_notes(requests)
+    return ids + [request.note.id for request in requests]
+
+
+@pytest.mark.parametrize("inclusions", [["Front"], ["Back", "Front"], ["Text", "Back Extra"],
+                                        ["Missing"], ["Front", "Front", "Text"], []])
+def test_projected_fields_match_the_full_note(col, note_ids, inclusions):
+    full = fetch_notes(col, note_ids)
+    projected = fetch_notes(col, note_ids, inclusions)
+    assert projected.keys() == full.keys()
+    for note_id, note in projected.items():
+        assert note.field_dict() == full[note_id].field_dict(inclusions)
+        assert (note.mid, note.tags) == (full[note_id].mid, full[note_id].tags)
+        assert note.field_dict() == {name: value for name, value in col.get_note(note_id).items()
+                                     if name in inclusions}
+
+
+def test_tags_only(col, note_ids):
+    col.tags.bulk_add(note_ids[:2], "picked")
+    notes = fetch_notes(col, note_ids, fields=False)
+    assert {note_id: note.tags for note_id, note in notes.items() if note.tags} == {
+        note_ids[0]: ["picked"], note_ids[1]: ["picked"]}
+    assert all(note.fields == [] for note in notes.values())
+
+
+def test_routes_return_only_the_included_fields(client, username, add_notes):
+    add_notes(["apple", "pear"], tags=["fruit"])
+    response = client.get("/api/cards/by-tag", json={"username": username, "tag": "fruit",
+                                                     "inclusions": ["Back"]})
+    assert sorted(card["fields"]["Back"] for card in response.json) == ["back of apple", "back of pear"]
+    assert all(card["fields"].keys() == {"Back"} for card in response.json)
+
+
+def test_listings_read_each_note_once_per_batch(client, username, add_notes, monkeypatch):
+    # One single-card note first, so a two-card note straddles the 500-card batch boundary
+    add_notes(["single"], tags=["pair"])
+    with borrowed(username) as col:
+        notetype = col.models.by_name("Basic (and reversed card)")
+        requests = []
+        for i in range(300):
+            note = col.new_note(notetype)
+            note["Front"], note["Back"] = f"front {i}", f"back of front {i}"
+            note.tags = ["pair"]
+            requests.append(AddNoteRequest(note=note, deck_id=DeckId(1)))
+        col.add_notes(requests)
+    reads = []
+
+    def recording(col, note_ids, *args, **kwargs):
+        reads.append(list(note_ids))
+        return fetch_notes(col, note_ids, *args, **kwargs)
+
+    monkeypatch.setattr(blueprint_cards, "fetch_notes", recording)
+    response = client.get("/api/cards/by-tag", json={"username": username, "tag": "pair"},
+                          headers={"Accept": NDJSON_MIMETYPE})
+    cards = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    response.close()
+    assert len(cards) == 601 and len(reads) == 2
+    assert all(len(batch) == len(set(batch)) for batch in reads)
+    # Only the note whose two cards straddle the batch boundary is read twice
+    assert sum(len(batch) for batch in reads) == 302
+    assert all(card["fields"]["Back"] == f"back of {card['fields']['Front']}" for card in cards)
+    assert "X-Note-Loads-Saved" not in response.headers
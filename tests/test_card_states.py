@@ -0,0 +1,64 @@
+import pytest
+
+from anki.utils import ids2str
+from conftest import borrowed, card_ids
+
+QUEUES = {"new": 0, "due": 2, "suspended": -1}
+
+
+@pytest.fixture
+def decks(username, add_notes, deck_named):
+    """Cards in every queue, in a deck, its child and another deck, some tagged."""
+    add_notes([f"plain {i}" for i in range(6)], deck_name="States")
+    add_notes([f"child {i}" for i in range(6)], deck_name="States::Child", tags=["t"])
+    add_notes([f"other {i}" for i in range(6)], deck_name="Other", tags=["t"])
+    with borrowed(username) as col:
+        for position, card_id in enumerate(col.db.list("select id from cards order by id")):
+            queue = list(QUEUES.values())[position % 3]
+            col.db.execute("update cards set queue = ?, type = ? where id = ?", queue, max(queue, 0), card_id)
+    return {"deck": deck_named("States"), "child": deck_named("States::Child"), "other": deck_named("Other")}
+
+
+def expected(username, state, deck_id=None, tag=None):
+    with borrowed(username) as col:
+        where = ["queue = ?"]
+        if deck_id is not None:
+            where.append(f"did in {ids2str(col.decks.deck_and_child_ids(deck_id))}")
+        if tag is not None:
+            where.append(f"nid in {ids2str(col.find_notes(f'tag:{tag}'))}")
+        return sorted(col.db.list(f"select id from cards where {' and '.join(where)}", QUEUES[state]))
+
+
+@pytest.mark.parametrize("state", QUEUES)
+@pytest.mark.parametrize("route", ["by-state", "by-state-without-fields"])
+def test_deck_state_routes(client, username, decks, state, route):
+    url = f"/api/cards/{decks['deck']}/{route}"
+    everything = client.get(url, json={"username": username, "state": state})
+    assert card_ids(everything) == expected(username, state, decks["deck"])
+    assert {card["queue"] for card in everything.json} == {QUEUES[state]}
+    tagged = client.get(url, json={"username": username, "state": state, "tag": "t"})
+    assert card_ids(tagged) == expected(username, state, decks["deck"], "t") != []
+
+
+@pytest.mark.parametrize("state", QUEUES)
+@pytest.mark.parametrize("route", ["by-tag-and-state", "by-tag-and-state-without-fields"])
+def test_tag_state_routes(client, username, decks, state, route):
+    url = f"/api/cards/{route}"
+    everywhere = client.get(url, json={"username": username, "state": state, "tag": "t"})
+    assert card_ids(everywhere) == expected(username, state, tag="t")
+    in_deck = client.get(url, json={"username": username, "state": state, "tag": "t", "deck_id": decks["other"]})
+    assert card_ids(in_deck) == expected(username, state, decks["other"], "t") != []
+
+
+def test_fields_are_only_read_when_listed(client, username, decks):
+    body = {"username": username, "state": "new", "tag": "t"}
+    with_fields = client.get("/api/cards/by-tag-and-state", json=body).json
+    without = client.get("/api/cards/by-tag-and-state-without-fields", json=body).json
+    assert all(card["fields"]["Front"] for card in with_fields)
+    assert all("fields" not in card for card in without)
+
+
+@pytest.mark.parametrize("state", [None, "lapsed"])
+def test_unknown_states_are_rejected(client, username, decks, state):
+    response = client.get(f"/api/cards/{decks['deck']}/by-state", json={"username": username, "state": state})
+    assert response.status_code == 400
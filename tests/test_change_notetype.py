@@ -0,0 +1,34 @@
+from conftest import borrowed
+
+
+def test_change_notetype_bulk_groups_by_old_notetype(client, username, add_notes):
+    basic = add_notes(["one", "two"])
+    with borrowed(username) as col:
+        reversed_type = col.models.by_name("Basic (and reversed card)")
+        note = col.new_note(reversed_type)
+        note["Front"], note["Back"] = "three", "back"
+        col.add_note(note, 1)
+        target = col.models.by_name("Basic (optional reversed card)")["id"]
+    note_ids = basic + [note.id, 1]
+    response = client.post("/api/cards/change-notetype-bulk",
+                           json={"username": username, "note_ids": note_ids, "new_notetype_id": target})
+    assert response.status_code == 200
+    assert sorted(group["notes"] for group in response.json["groups"]) == [1, 2]
+    assert response.json["count"] == 3
+    with borrowed(username) as col:
+        assert {col.get_note(note_id).mid for note_id in note_ids[:3]} == {target}
+        assert col.get_note(note.id)["Front"] == "three"
+
+
+def test_change_notetype_bulk_dry_run_changes_nothing(client, username, add_notes):
+    note_ids = add_notes(["one", "two"], tags=["convert"])
+    with borrowed(username) as col:
+        basic = col.models.by_name("Basic")["id"]
+        target = col.models.by_name("Basic (and reversed card)")["id"]
+    response = client.post("/api/cards/change-notetype-bulk",
+                           json={"username": username, "search": "tag:convert", "new_notetype_id": target,
+                                 "dry_run": True})
+    assert response.status_code == 200
+    assert response.json["count"] == 2
+    with borrowed(username) as col:
+        assert {col.get_note(note_id).mid for note_id in note_ids} == {basic}
@@ -0,0 +1,86 @@
+import time
+
+from conftest import borrowed
+
+
+def feed(client, username, **marks):
+    response = client.get("/api/changes", json={"username": username, **marks})
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def next_usn_marks(high_water):
+    return {"since_usn": high_water["usn"], "since_local_mtime": high_water["local_mtime"],
+            "since_graves": high_water["graves"]}
+
+
+def kinds(changes):
+    return sorted((change["kind"], change.get("type")) for change in changes)
+
+
+def wait_for_next_second():
+    # Mtimes are whole seconds; changes in the current second are listed again
+    time.sleep(1.05 - time.time() % 1)
+
+
+def test_usn_feed_moves_past_local_changes(client, username, add_notes):
+    note_ids = add_notes(["one", "two", "three"])
+    wait_for_next_second()
+    first = feed(client, username, since_usn=0)
+    assert ("note", None) in kinds(first["changes"])
+
+    quiet = feed(client, username, **next_usn_marks(first["high_water"]))
+    assert quiet["changes"] == []
+
+    wait_for_next_second()
+    with borrowed(username) as col:
+        note = col.get_note(note_ids[0])
+        note["Front"] = "edited"
+        col.update_note(note)
+    edited = feed(client, username, **next_usn_marks(quiet["high_water"]))
+    assert [change["id"] for change in edited["changes"] if change["kind"] == "note"] == [note_ids[0]]
+    assert edited["high_water"]["local_mtime"] > first["high_water"]["local_mtime"]
+
+
+def test_deletions_are_listed_once_per_change(client, username, add_notes):
+    note_ids = add_notes(["keep", "drop"])
+    wait_for_next_second()
+    first = feed(client, username, since_mtime=0)
+
+    with borrowed(username) as col:
+        col.remove_notes([note_ids[1]])
+    marks = {"since_mtime": first["high_water"]["mtime"] + 1, "since_graves": first["high_water"]["graves"]}
+    deleted = feed(client, username, **marks)
+    assert kinds(deleted["changes"]) == [("deleted", "card"), ("deleted", "note")]
+    assert deleted["high_water"]["graves"] != first["high_water"]["graves"]
+
+    marks["since_graves"] = deleted["high_water"]["graves"]
+    assert feed(client, username, **marks)["changes"] == []
+
+
+def test_mtime_feed_high_water_only_grows(client, username, add_notes):
+    first = feed(client, username, since_mtime=0)
+    add_notes(["new"])
+    second = feed(client, username, since_mtime=first["high_water"]["mtime"])
+    assert second["high_water"]["mtime"] >= first["high_water"]["mtime"]
+    assert "local_mtime" not in second["high_water"]
+
+
+def test_bad_marks(client, username):
+    for marks in ({}, {"since_usn": 0, "since_mtime": 0}, {"since_usn": "0"},
+                  {"since_mtime": 0, "since_local_mtime": 0}, {"since_usn": 0, "since_graves": 3}):
+        assert client.get("/api/changes", json={"username": username, **marks}).status_code == 400
+
+
+def test_current_second_is_repeated_until_it_is_over(client, username, add_notes):
+    add_notes(["fresh"])
+    with borrowed(username) as col:
+        written = col.db.scalar("select max(mod) from notes")
+    first = feed(client, username, since_usn=0)
+    if first["high_water"]["local_mtime"] == written:
+        # Still the same second: the next call lists those changes again, then moves on
+        wait_for_next_second()
+        assert feed(client, username, **next_usn_marks(first["high_water"]))["changes"]
+        first = feed(client, username, since_usn=0)
+    assert first["high_water"]["local_mtime"] == written + 1
+    assert feed(client, username, **next_usn_marks(first["high_water"]))["changes"] == []
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+import collection_executor
+from collection_executor import executor_for
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """Record the thread each write runs on, by profile."""
+    threads = []
+    run_write = collection_executor.CollectionExecutor.run_write
+
+    def recording(self, fn, *args, **kwargs):
+        def run(*args, **kwargs):
+            threads.append((self.username, threading.current_thread().name))
+            return fn(*args, **kwargs)
+        return run_write(self, run, *args, **kwargs)
+
+    monkeypatch.setattr(collection_executor.CollectionExecutor, "run_write", recording)
+    return threads
+
+
+def test_writes_run_on_the_profiles_writer_thread(client, username, writes):
+    response = client.post("/api/decks/create/Writer", json={"username": username})
+    assert response.status_code == 201, response.json
+    assert writes == [(username, f"collection-writer-{username}")]
+    assert executor_for(username).stats()["writer_running"]
+
+
+def test_reads_run_inline(client, username, writes):
+    assert client.get("/api/decks", json={"username": username}).status_code == 200
+    assert writes == []
+
+
+def test_study_with_only_a_session_id_is_ordered_with_the_profiles_writes(client, username, add_notes, writes):
+    add_notes(["one", "two"])
+    session_id = client.post("/api/study/sessions", json={"username": username}).json["session_id"]
+    response = client.post("/api/study", json={"session_id": session_id, "action": "start", "deck_id": 1})
+    assert response.status_code == 200, response.json
+    answered = client.post("/api/study", json={"session_id": session_id, "action": "3"})
+    assert answered.status_code == 200, answered.json
+    client.post("/api/study", json={"session_id": session_id, "action": "close"})
+    assert writes == [(username, f"collection-writer-{username}")] * 4
+
+
+@pytest.mark.parametrize("body", [{}, {"session_id": "no-such-session", "action": "start", "deck_id": 1}])
+def test_writes_that_name_no_profile_are_rejected(client, body, writes):
+    response = client.post("/api/study", json=body)
+    assert response.status_code == 400
+    assert "error" in response.json
+    assert writes == []
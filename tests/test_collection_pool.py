@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+
+import pytest
+
+import blueprint_cards
+import blueprint_study_sessions
+from collection_pool import pool
+from conftest import borrowed, pool_refs
+from streaming import NDJSON_MIMETYPE
+
+
+@pytest.fixture
+def deck_id(add_notes, deck_named):
+    add_notes(["one", "two", "three"], deck_name="Pool", tags=["pool"])
+    return deck_named("Pool")
+
+
+def test_borrowers_share_one_handle(username):
+    with borrowed(username) as first, borrowed(username) as second:
+        assert first is second
+        assert pool_refs(username) == 2
+    assert pool_refs(username) == 0
+    assert first.db is not None
+
+
+def test_evict_waits_for_the_last_borrower(username):
+    with borrowed(username) as col:
+        assert pool.evict(username)
+        # Still usable by the request that borrowed it
+        assert col.db.scalar("select count() from notes") == 0
+    assert col.db is None
+    with borrowed(username) as reopened:
+        assert reopened is not col and reopened.db is not None
+
+
+def test_acquire_racing_an_evict_does_not_keep_the_old_handle(username):
+    with borrowed(username) as old:
+        pass
+    entry = pool._entries[username]
+    acquired = []
+    with entry.lock:
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire(username)))
+        thread.start()
+        deadline = time.monotonic() + 5
+        while entry.refs == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.evict(username)
+    thread.join(5)
+    (col,) = acquired
+    try:
+        assert col is not old and old.db is None
+        assert pool._entries[username].col is col
+    finally:
+        pool.release(col)
+    assert pool_refs(username) == 0
+
+
+ERROR_REQUESTS = [
+    ("/api/cards/advanced-field-search", "POST", {"field_conditions": ["bad"]}, 400),
+    ("/api/cards/advanced-field-search", "POST",
+     {"field_conditions": [{"field_name": "Front", "operation": "regex", "value": "("}]}, 400),
+    ("/api/cards/by-field-content", "GET", {"field_name": "Front", "field_content": "one", "deck_id": "abc"}, 400),
+    ("/api/cards/by-field-substring", "GET", {"field_name": "Front", "substring": "("}, 400),
+    ("/api/cards/bulk", "POST", {"search": "tag:(", "operation": "suspend"}, 400),
+    ("/api/cards/bulk", "POST", {"search": "tag:pool", "operation": "move", "params": {"deck_id": 424242}}, 404),
+    ("/api/notetypes/update-note/1", "POST", {"fields": {"Front": "x"}}, 404),
+    ("/api/changes", "GET", {"since_usn": 0, "since_graves": 5}, 400),
+]
+
+
+@pytest.mark.parametrize("url, method, body, status", ERROR_REQUESTS)
+def test_error_paths_release_the_collection(client, username, deck_id, url, method, body, status):
+    response = client.open(url, method=method, json={"username": username, **body})
+    assert response.status_code == status, response.json
+    assert pool_refs(username) == 0
+
+
+def test_study_counts_restores_deck_and_releases_on_error(client, username, deck_id, monkeypatch):
+    with borrowed(username) as col:
+        previous = col.decks.get_current_id()
+
+    def fail(self):
+        raise RuntimeError("scheduler failed")
+
+    monkeypatch.setattr(blueprint_study_sessions.V3Scheduler, "counts", fail)
+    response = client.post("/api/study/counts", json={"username": username, "deck_id": deck_id})
+    assert response.status_code == 500
+    assert pool_refs(username) == 0
+    with borrowed(username) as col:
+        assert col.decks.get_current_id() == previous
+
+
+def stream_lines(client, username):
+    response = client.get("/api/cards/by-tag", json={"username": username, "tag": "pool"},
+                          headers={"Accept": NDJSON_MIMETYPE})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    response.close()
+    return lines
+
+
+def test_stream_releases_the_collection_when_closed(client, username, deck_id):
+    assert len(stream_lines(client, username)) == 3
+    assert pool_refs(username) == 0
+
+
+def test_stream_releases_the_collection_after_a_failure(client, username, deck_id, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("note read failed")
+
+    monkeypatch.setattr(blueprint_cards, "fetch_notes", fail)
+    assert stream_lines(client, username) == [{"error": "note read failed"}]
+    assert pool_refs(username) == 0
+
+
+def test_pool_stats_report_nothing_in_use_after_errors(client, username, deck_id):
+    for url, method, body, _ in ERROR_REQUESTS:
+        client.open(url, method=method, json={"username": username, **body})
+    assert client.get("/api/db/pool-stats").json["pool"]["in_use"] == 0
@@ -0,0 +1,36 @@
+import pytest
+
+from conftest import borrowed
+
+
+@pytest.fixture
+def deck_id(deck_named):
+    return deck_named("Batch")
+
+
+def test_create_batch_reports_each_bad_note(client, username, deck_id):
+    notes = [
+        {"fields": {"Front": "good one"}, "tags": ["batch"]},
+        {"fields": {"Nope": "x"}},
+        {"note_type": "Missing", "fields": {"Front": "x"}},
+        {"deck_id": 424242, "fields": {"Front": "x"}},
+        "not an object",
+        {"note_type": "Basic (and reversed card)", "fields": {"Front": "good two", "Back": "b"}},
+    ]
+    response = client.post("/api/cards/create-batch",
+                           json={"username": username, "note_type": "Basic", "deck_id": deck_id, "notes": notes})
+    assert response.status_code == 201
+    results = response.json["results"]
+    assert [("error" in result) for result in results] == [False, True, True, True, True, False]
+    assert response.json["created"] == 2 and response.json["failed"] == 4
+    assert len(results[0]["card_ids"]) == 1 and len(results[5]["card_ids"]) == 2
+    with borrowed(username) as col:
+        assert col.note_count() == 2
+        assert col.find_notes("deck:Batch tag:batch") == [results[0]["note_id"]]
+
+
+def test_create_batch_with_only_bad_notes(client, username, deck_id):
+    response = client.post("/api/cards/create-batch",
+                           json={"username": username, "deck_id": deck_id, "notes": [{"fields": {"Front": "x"}}]})
+    assert response.status_code == 400
+    assert response.json["created"] == 0
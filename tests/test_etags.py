@@ -0,0 +1,42 @@
+import collection_pool
+
+
+def test_etag_answers_304_until_a_write(client, username, add_notes, deck_named):
+    add_notes(["apple"], deck_name="Fruit")
+    url = f"/api/decks/{deck_named('Fruit')}/cards"
+
+    first = client.get(url, json={"username": username})
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    again = client.get(url, json={"username": username}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    created = client.post("/api/cards/create", json={"username": username, "note_type": "Basic",
+                                                     "deck_id": deck_named("Fruit"),
+                                                     "fields": {"Front": "pear", "Back": ""}})
+    assert created.status_code == 201
+    after_write = client.get(url, json={"username": username}, headers={"If-None-Match": etag})
+    assert after_write.status_code == 200
+    assert after_write.headers["ETag"] != etag
+    assert len(after_write.json) == 2
+
+
+def test_etag_depends_on_the_request(client, username):
+    first = client.get("/api/decks", json={"username": username})
+    other = client.get("/api/cards/by-tag", json={"username": username, "tag": "x"})
+    assert first.headers["ETag"] != other.headers["ETag"]
+
+
+def test_change_feed_is_not_tagged(client, username):
+    response = client.get("/api/changes", json={"username": username, "since_usn": 0})
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+
+def test_gets_that_do_not_read_the_collection_leave_it_closed(client, username):
+    collection_pool.pool.evict(username)
+    for url in ("/api/decks/config/enums", "/api/study/sessions", "/api/db/pool-stats"):
+        response = client.get(url, json={"username": username})
+        assert response.status_code == 200, url
+        assert "ETag" not in response.headers
+    assert username not in collection_pool.pool.stats()["users"]
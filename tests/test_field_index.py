@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+import field_index
+from conftest import add_basic_notes, card_ids
+from result_cache import result_cache
+
+WORDS = ["apple pie", "apple tart", "banana split", "cherry tart", "date loaf", "elderberry wine"]
+
+SEARCHES = [
+    ("Front", "apple", "exact", '"Front:apple"'),
+    ("Front", "tart", "contains", '"Front:*tart*"'),
+    ("Front", "ppl", "substring", '"Front:re:.*ppl.*"'),
+    ("Front", "app.*(pie|cake)", "regex", '"Front:re:app.*(pie|cake)"'),
+]
+
+
+@pytest.fixture
+def index(col):
+    add_basic_notes(col, WORDS)
+    built = field_index.FieldIndex("test")
+    with built._lock:
+        built._refresh(col, full=True)
+    built.ready = True
+    return built
+
+
+def assert_matches_backend(col, index):
+    for field, value, mode, query in SEARCHES:
+        candidates = index.candidates(col, [(field, value, mode)])
+        assert candidates is not None, query
+        indexed = field_index.find_notes_among(col, query, candidates)
+        assert sorted(indexed) == sorted(col.find_notes(query)), query
+
+
+def bump_collection_mod(col):
+    # What any write, including a sync, does to the collection's change stamp
+    col.db.execute("update col set mod = ?", col.mod + 1000)
+
+
+def test_indexed_search_matches_backend(col, index):
+    assert_matches_backend(col, index)
+
+
+def test_edit_after_build(col, index):
+    note = col.get_note(col.find_notes('"Front:date loaf"')[0])
+    note["Front"] = "apple crumble"
+    col.update_note(note)
+    assert_matches_backend(col, index)
+
+
+def test_edit_with_older_mtime(col, index):
+    note_id = col.find_notes('"Front:date loaf"')[0]
+    older = int(time.time()) - 86400
+    # A sync writes the server's copy of a note with the server's older mtime
+    col.db.execute("update notes set flds = ?, mod = ? where id = ?", "apple strudel\x1fback", older, note_id)
+    bump_collection_mod(col)
+    assert_matches_backend(col, index)
+    assert col.find_notes('"Front:*strudel*"') == [note_id]
+
+
+def test_delete_and_add_with_older_mtime(col, index):
+    col.remove_notes(col.find_notes('"Front:banana split"'))
+    (note_id,) = add_basic_notes(col, ["apple cake"])
+    # Same note count as before, and the new note is older than the last refresh
+    col.db.execute("update notes set mod = ? where id = ?", int(time.time()) - 86400, note_id)
+    bump_collection_mod(col)
+    assert_matches_backend(col, index)
+    assert note_id in index.candidates(col, [("Front", "apple", "exact")])
+
+
+ROUTE_SEARCHES = [
+    ("/api/cards/by-field-content", "GET", {"field_name": "Front", "field_content": "apple pie"}),
+    ("/api/cards/by-field-content", "GET", {"field_name": "Front", "field_content": "tart", "exact_match": False}),
+    ("/api/cards/by-field-substring", "GET", {"field_name": "Front", "substring": "err"}),
+    ("/api/cards/advanced-field-search", "POST", {"join_operator": "AND", "field_conditions": [
+        {"field_name": "Front", "operation": "contains", "value": "tart"},
+        {"field_name": "Back", "operation": "regex", "value": "cher+y"}]}),
+    ("/api/cards/advanced-field-search", "POST", {"join_operator": "OR", "field_conditions": [
+        {"field_name": "Front", "operation": "is", "value": "date loaf"},
+        {"field_name": "Front", "operation": "contains", "value": "apple"}]}),
+]
+
+
+def route_card_ids(client, username, url, method, body):
+    return card_ids(client.open(url, method=method, json={"username": username, **body}))
+
+
+def test_routes_match_with_and_without_the_index(client, username, add_notes, monkeypatch):
+    add_notes(WORDS * 3)
+    monkeypatch.setattr(field_index, "FIELD_INDEX_ENABLED", False)
+    expected = [route_card_ids(client, username, *search) for search in ROUTE_SEARCHES]
+    assert all(expected)
+
+    monkeypatch.setattr(field_index, "FIELD_INDEX_ENABLED", True)
+    field_index.index_for(username)
+    deadline = time.monotonic() + 10
+    while field_index.index_for(username) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    try:
+        assert field_index.index_for(username) is not None
+        result_cache.clear()
+        lookups = field_index.index_for(username).lookups
+        assert [route_card_ids(client, username, *search) for search in ROUTE_SEARCHES] == expected
+        assert field_index.index_for(username).lookups > lookups
+    finally:
+        field_index.drop_index(username)
@@ -0,0 +1,38 @@
+import pytest
+
+from conftest import borrowed
+
+
+@pytest.fixture
+def deck_id(add_notes, deck_named):
+    add_notes([f"cram {i}" for i in range(10)], deck_name="Batch")
+    return deck_named("Batch")
+
+
+def test_filtered_deck_actions_report_each_item(client, username, deck_id):
+    items = [
+        {"action": "build", "name": "Cram", "search": "deck:Batch", "limit": 4},
+        {"action": "build", "search": "deck:Batch"},
+        {"action": "rebuild", "deck_id": deck_id},
+        {"action": "empty", "deck_id": 424242},
+        {"action": "explode"},
+    ]
+    response = client.post("/api/decks/filtered", json={"username": username, "decks": items})
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert results[0]["cards"] == 4
+    assert [("error" in result) for result in results] == [False, True, True, True, True]
+    assert response.json["failed"] == 4
+
+
+def test_filtered_deck_lifecycle(client, username, deck_id):
+    built = client.post("/api/decks/filtered", json={"username": username, "decks": [
+        {"action": "build", "name": "Cram", "search": "deck:Batch", "limit": 4}]}).json
+    cram = built["results"][0]["deck_id"]
+    rotated = client.post("/api/decks/filtered", json={"username": username, "decks": [
+        {"action": "empty", "deck_id": cram}, {"action": "rebuild", "deck_id": cram},
+        {"action": "delete", "deck_id": cram}]}).json
+    assert [result["cards"] for result in rotated["results"]] == [4, 4, 4]
+    with borrowed(username) as col:
+        assert col.db.scalar("select count() from cards where odid != 0") == 0
+        assert col.decks.get(cram, default=False) is None
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+import learning_metrics
+from conftest import add_basic_notes
+
+pytest.importorskip("numpy")
+
+CASES = [
+    {},
+    {"bounds": {"factor": (None, 2300)}},
+    {"bounds": {"reviews": (3, None), "interval": (1, 30)}},
+    {"bounds": {"ratio": (0.5, None)}, "sort_by": "ratio", "descending": True},
+    {"bounds": {"lapses": (1, 4)}, "sort_by": "lapses", "limit": 25},
+    {"sort_by": "interval", "descending": True, "limit": 40},
+    {"sort_by": "factor", "by_id": True, "after": [2300, 0]},
+    {"sort_by": "ratio", "descending": True, "by_id": True, "after": [float("inf"), 0]},
+    {"by_id": True, "limit": 30},
+]
+
+
+@pytest.fixture
+def deck_id(col):
+    add_basic_notes(col, [f"card {i}" for i in range(300)], deck_name="Metrics")
+    rng = random.Random(0)
+    for card_id in col.db.list("select id from cards"):
+        # Repeated values, zero intervals (infinite ratio) and ties on every metric
+        col.db.execute("update cards set reps = ?, ivl = ?, factor = ?, lapses = ? where id = ?",
+                       rng.randint(0, 12), rng.choice([0, 0, 1, 3, 7, 30, 90]),
+                       rng.choice([1300, 2300, 2500, 2800]), rng.randint(0, 5), card_id)
+    return col.decks.id("Metrics")
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_numpy_and_python_select_the_same_cards(col, deck_id, monkeypatch, case):
+    with_numpy = learning_metrics.select_cards(col, deck_id, **case)
+    monkeypatch.setattr(learning_metrics, "np", None)
+    without_numpy = learning_metrics.select_cards(col, deck_id, **case)
+    assert with_numpy == without_numpy
+    assert with_numpy
+
+
+def all_sorted_pages(col, deck_id, page_size, **options):
+    rows, after = [], None
+    while True:
+        page = learning_metrics.select_cards(col, deck_id, limit=page_size + 1, after=after, by_id=True, **options)
+        rows.extend(page[:page_size])
+        if len(page) <= page_size:
+            return rows
+        after = learning_metrics.cursor_key(page[page_size - 1], options["sort_by"])
+
+
+@pytest.mark.parametrize("options", [
+    {"sort_by": "interval"},
+    {"sort_by": "ratio", "descending": True},
+    {"sort_by": "ratio", "bounds": {"factor": (None, 2300)}},
+    {"sort_by": "factor", "descending": True, "bounds": {"reviews": (4, 9)}},
+])
+def test_sorted_pages_cover_the_sorted_result(col, deck_id, monkeypatch, options):
+    monkeypatch.setattr(learning_metrics, "SORTED_CHUNK_SIZE", 7)
+    unpaged = learning_metrics.select_cards(col, deck_id, **options)
+    key = options["sort_by"]
+    sign = -1 if options.get("descending") else 1
+    assert unpaged == sorted(unpaged, key=lambda row: (sign * getattr(row, key), row.id))
+    assert all_sorted_pages(col, deck_id, 11, **options) == unpaged
+    monkeypatch.setattr(learning_metrics, "np", None)
+    assert all_sorted_pages(col, deck_id, 11, **options) == unpaged
+
+
+def test_sorted_pages_read_from_the_cursor_on(col, deck_id, monkeypatch):
+    read = []
+    load_rows = learning_metrics._load_rows
+
+    def recording(*args, **kwargs):
+        rows = load_rows(*args, **kwargs)
+        read.extend(rows)
+        return rows
+
+    monkeypatch.setattr(learning_metrics, "_load_rows", recording)
+    first = learning_metrics.select_cards(col, deck_id, sort_by="interval", limit=11, by_id=True)
+    read.clear()
+    after = learning_metrics.cursor_key(first[-1], "interval")
+    learning_metrics.select_cards(col, deck_id, sort_by="interval", limit=11, after=after, by_id=True)
+    assert len(read) <= learning_metrics.SORTED_CHUNK_SIZE
+    assert all((row[5], row[0]) > tuple(after) for row in read)
+
+
+@pytest.mark.parametrize("after", [["abc", 1], [None, 1], [1], [True, 1]])
+def test_sorted_cursors_are_checked(col, deck_id, after):
+    assert not learning_metrics.valid_cursor(after, "interval")
+    with pytest.raises(ValueError):
+        learning_metrics.select_cards(col, deck_id, sort_by="interval", after=after, by_id=True)
@@ -0,0 +1,81 @@
+import base64
+import os
+
+import pytest
+
+from anki_paths import media_path
+
+PNG = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+@pytest.fixture
+def picture(username):
+    path = os.path.join(media_path(username), "pic.png")
+    with open(path, "wb") as f:
+        f.write(PNG)
+    return path
+
+
+def start_study(client, username, **options):
+    response = client.post("/api/study", json={"username": username, "action": "start", "deck_id": 1, **options})
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def test_study_links_media_by_url(client, username, add_notes, picture):
+    add_notes(['<img src="pic.png">'])
+    front = start_study(client, username)
+    url = f"/api/media/{username}/pic.png"
+    assert front["media_files"] == {"pic.png": url}
+    assert front["front"]["Front"] == f'<img src="{url}">'
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == PNG
+    assert response.headers["Content-Type"] == "image/png"
+    assert "max-age=" in response.headers["Cache-Control"]
+
+
+def test_inline_media_is_opt_in(client, username, add_notes, picture):
+    add_notes(['<img src="pic.png">'])
+    front = start_study(client, username, media_mode="inline")
+    encoded = base64.b64encode(PNG).decode()
+    assert front["media_files"] == {"pic.png": encoded}
+    assert front["front"]["Front"] == f'<img src="data:image/png;base64,{encoded}">'
+
+
+def test_bad_media_mode_is_rejected(client, username):
+    response = client.post("/api/study", json={"username": username, "action": "start", "deck_id": 1,
+                                               "media_mode": "base64"})
+    assert response.status_code == 400
+
+
+def test_unchanged_media_is_answered_with_304(client, username, picture):
+    url = f"/api/media/{username}/pic.png"
+    first = client.get(url)
+    etag, modified = first.headers["ETag"], first.headers["Last-Modified"]
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-Modified-Since": modified}).status_code == 304
+
+    with open(picture, "wb") as f:
+        f.write(PNG + b"\0")
+    os.utime(picture, (os.path.getatime(picture), os.path.getmtime(picture) + 10))
+    changed = client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_media_supports_ranges(client, username, picture):
+    response = client.get(f"/api/media/{username}/pic.png", headers={"Range": "bytes=0-7"})
+    assert response.status_code == 206
+    assert response.data == PNG[:8]
+
+
+@pytest.mark.parametrize("path", ["missing.png", "../collection.anki2", "%2e%2e/collection.anki2"])
+def test_only_existing_media_files_are_served(client, username, path):
+    assert client.get(f"/api/media/{username}/{path}").status_code == 404
+
+
+def test_unknown_user_has_no_media(client):
+    assert client.get("/api/media/nobody/pic.png").status_code == 404
@@ -0,0 +1,74 @@
+import pytest
+
+from conftest import borrowed
+from pagination import encode_cursor
+
+
+@pytest.fixture
+def deck_id(add_notes, deck_named):
+    add_notes([f"card {i}" for i in range(23)], deck_name="Paged")
+    add_notes([f"child {i}" for i in range(4)], deck_name="Paged::Child")
+    return deck_named("Paged")
+
+
+def all_pages(client, url, body, page_size):
+    items, cursor, pages = [], None, 0
+    while True:
+        response = client.get(url, json={**body, "page_size": page_size, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.json
+        page = response.json
+        assert len(page["cards"]) <= page_size
+        items.extend(page["cards"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, pages
+
+
+def test_deck_pages_cover_the_unpaged_list(client, username, deck_id):
+    url = f"/api/decks/{deck_id}/cards"
+    unpaged = client.get(url, json={"username": username}).json
+    paged, pages = all_pages(client, url, {"username": username}, page_size=5)
+    assert pages == 6
+    assert [card["id"] for card in paged] == sorted(card["id"] for card in unpaged)
+
+
+def test_page_boundary_has_no_empty_last_page(client, username, deck_id):
+    _, pages = all_pages(client, f"/api/decks/{deck_id}/cards", {"username": username}, page_size=27)
+    assert pages == 1
+
+
+def test_cards_added_behind_the_cursor_are_not_repeated(client, username, deck_id, add_notes):
+    url = f"/api/decks/{deck_id}/cards"
+    first = client.get(url, json={"username": username, "page_size": 10}).json
+    add_notes(["late arrival"], deck_name="Paged")
+    rest, _ = all_pages(client, url, {"username": username, "cursor": first["next_cursor"]}, page_size=10)
+    ids = [card["id"] for card in first["cards"] + rest]
+    assert len(ids) == len(set(ids)) == 28
+
+
+def test_metrics_pages_follow_the_sort(client, username, deck_id):
+    with borrowed(username) as col:
+        for position, card_id in enumerate(col.db.list("select id from cards order by id")):
+            col.db.execute("update cards set type = 2, queue = 2, ivl = ?, reps = 5 where id = ?",
+                           position % 4 + 1, card_id)
+    body = {"username": username, "deck_id": deck_id, "sort_by": "interval", "descending": True,
+            "limit": 1000, "include_fields": False}
+    unpaged = client.get("/api/cards/by-learning-metrics", json=body).json
+    paged, _ = all_pages(client, "/api/cards/by-learning-metrics", body, page_size=4)
+    assert [card["id"] for card in paged] == [card["id"] for card in
+                                              sorted(unpaged, key=lambda card: (-card["interval"], card["id"]))]
+
+
+@pytest.mark.parametrize("params", [{"page_size": 0}, {"page_size": "5"}, {"cursor": "abc"},
+                                    {"page_size": 5, "cursor": "not-a-cursor"}])
+def test_bad_paging_parameters(client, username, deck_id, params):
+    response = client.get(f"/api/decks/{deck_id}/cards", json={"username": username, **params})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("key", [[2], ["long", 2]])
+def test_metrics_cursor_must_match_the_sort(client, username, deck_id, key):
+    body = {"username": username, "deck_id": deck_id, "page_size": 5, "sort_by": "interval",
+            "cursor": encode_cursor(key)}
+    assert client.get("/api/cards/by-learning-metrics", json=body).status_code == 400
@@ -0,0 +1,38 @@
+from result_cache import result_cache
+
+
+def test_result_cache_serves_repeats_and_drops_them_after_a_write(client, username, add_notes):
+    (note_id,) = add_notes(["apple pie"])
+    body = {"username": username, "field_name": "Front", "field_content": "apple", "exact_match": False}
+
+    first = client.get("/api/cards/by-field-content", json=body)
+    assert first.headers["X-Result-Cache"] == "miss"
+    hits = result_cache.hits
+    repeat = client.get("/api/cards/by-field-content", json=body)
+    assert repeat.headers["X-Result-Cache"] == "hit"
+    assert result_cache.hits == hits + 1
+    assert repeat.json == first.json
+
+    updated = client.post(f"/api/notetypes/update-note/{note_id}",
+                          json={"username": username, "fields": {"Front": "pear tart"}})
+    assert updated.status_code == 200
+    after_write = client.get("/api/cards/by-field-content", json=body)
+    assert after_write.headers["X-Result-Cache"] == "miss"
+    assert after_write.json == []
+
+
+def test_result_cache_is_keyed_on_the_parameters(client, username, add_notes):
+    add_notes(["apple pie", "apple tart"])
+    body = {"username": username, "field_name": "Front", "exact_match": False}
+    pie = client.get("/api/cards/by-field-content", json={**body, "field_content": "pie"})
+    tart = client.get("/api/cards/by-field-content", json={**body, "field_content": "tart"})
+    assert tart.headers["X-Result-Cache"] == "miss"
+    assert pie.json != tart.json
+
+
+def test_result_cache_skips_errors(client, username):
+    body = {"username": username, "field_name": "Front", "field_content": "x", "deck_id": "not a number"}
+    assert client.get("/api/cards/by-field-content", json=body).status_code == 400
+    entries = len(result_cache)
+    assert client.get("/api/cards/by-field-content", json=body).status_code == 400
+    assert len(result_cache) == entries
@@ -0,0 +1,84 @@
+import pytest
+from anki.errors import InvalidInput, SearchError
+
+import field_index
+import search_planner
+from conftest import add_basic_notes
+
+FRONTS = [f"{word} {i}" for i in range(40) for word in ("apple", "banana", "cherry")]
+
+CONDITIONS = [
+    [{"field_name": "Front", "operation": "regex", "value": "^(apple|cherry)"},
+     {"field_name": "Back", "operation": "is", "value": "back of apple 7"}],
+    [{"field_name": "Front", "operation": "contains", "value": "an"},
+     {"field_name": "Back", "operation": "regex", "value": "1$"}],
+    [{"field_name": "Front", "operation": "is", "value": "cherry 3"},
+     {"field_name": "Front", "operation": "contains", "value": "apple"}],
+    [{"field_name": "Front", "operation": "regex", "value": "CHERRY", "case_sensitive": True}],
+]
+
+
+@pytest.fixture
+def deck_id(col):
+    add_basic_notes(col, FRONTS[:60], deck_name="Planner::Child")
+    add_basic_notes(col, FRONTS[60:], deck_name="Other")
+    # A second notetype, so index-narrowed and backend stages order differently
+    notetype = col.models.by_name("Basic (and reversed card)")
+    for front in ("apple tart", "cherry 3"):
+        note = col.new_note(notetype)
+        note["Front"], note["Back"] = front, f"back of {front}"
+        col.add_note(note, col.decks.id("Planner"))
+    return col.decks.id("Planner")
+
+
+@pytest.fixture(params=[False, True], ids=["statistics", "index"])
+def index(request, col, deck_id, monkeypatch):
+    built = None
+    if request.param:
+        built = field_index.FieldIndex("test")
+        with built._lock:
+            built._refresh(col, full=True)
+        built.ready = True
+    monkeypatch.setattr(field_index, "index_for", lambda username: built)
+    return built
+
+
+@pytest.mark.parametrize("join", ["AND", "OR"])
+@pytest.mark.parametrize("field_conditions", CONDITIONS)
+@pytest.mark.parametrize("in_deck", [False, True])
+def test_results_match_the_single_search(col, deck_id, index, join, field_conditions, in_deck):
+    conditions = search_planner.parse_conditions(field_conditions)
+    deck_ids = col.decks.deck_and_child_ids(deck_id) if in_deck else None
+    note_ids, plan = search_planner.run_search(col, "test", conditions, join, deck_id if in_deck else None)
+    query = search_planner.combined_query(conditions, join, deck_ids)
+    assert plan["query"] == query
+    assert note_ids == sorted(col.find_notes(query))
+
+
+def test_selective_conditions_run_first(col, deck_id, index):
+    conditions = search_planner.parse_conditions(CONDITIONS[0])
+    note_ids, plan = search_planner.run_search(col, "test", conditions)
+    planned = next(stage for stage in plan["stages"] if stage["stage"] == "plan")
+    assert planned["order"] == [1, 0]
+    first, second = [stage for stage in plan["stages"] if stage["stage"] == "condition"]
+    assert first["condition"] == 1 and first["estimated_notes"] <= second["estimated_notes"]
+    # The regex only looks at what the exact match left
+    assert second["input"] == first["output"] == 1
+    assert len(note_ids) == 1
+
+
+def test_nothing_left_skips_later_conditions(col, deck_id, index):
+    conditions = search_planner.parse_conditions([
+        {"field_name": "Front", "operation": "regex", "value": "apple"},
+        {"field_name": "Front", "operation": "is", "value": "no such note"},
+    ])
+    note_ids, plan = search_planner.run_search(col, "test", conditions)
+    assert note_ids == []
+    regex_stage = plan["stages"][-1]
+    assert regex_stage["condition"] == 0 and regex_stage["skipped"]
+
+
+def test_malformed_regex_raises_a_backend_error(col, deck_id, index):
+    conditions = search_planner.parse_conditions([{"field_name": "Front", "operation": "regex", "value": "("}])
+    with pytest.raises((SearchError, InvalidInput)):
+        search_planner.run_search(col, "test", conditions)
@@ -0,0 +1,91 @@
+import pytest
+
+import study_session_registry
+from conftest import borrowed
+from study_session_registry import registry
+
+AGAIN, EASY = "1", "4"
+
+
+@pytest.fixture
+def study(client, username):
+    """Start a session with a prefetched queue; returns ``(answer, session)``."""
+    def start(prefetch=10, deck_id=1):
+        response = client.post("/api/study", json={"username": username, "action": "start",
+                                                   "deck_id": deck_id, "prefetch": prefetch})
+        assert response.status_code == 200, response.json
+        session_id = response.json["session_id"]
+
+        def answer(action):
+            response = client.post("/api/study", json={"session_id": session_id, "action": action})
+            assert response.status_code == 200, response.json
+            return response.json
+        return answer, registry.get(session_id)
+    return start
+
+
+def add_reversed_notes(username, fronts):
+    with borrowed(username) as col:
+        notetype = col.models.by_name("Basic (and reversed card)")
+        for front in fronts:
+            note = col.new_note(notetype)
+            note["Front"], note["Back"] = front, f"back of {front}"
+            col.add_note(note, 1)
+
+
+def test_answers_are_served_from_the_prefetched_queue(study, add_notes):
+    add_notes([f"card {i}" for i in range(5)])
+    answer, session = study()
+    seen = {session.current_card.id}
+    for _ in range(4):
+        seen.add(answer(EASY)["card_id"])
+    assert len(seen) == 5
+    assert session.queue_fetches == 1
+    assert answer(EASY)["status"] == "finished"
+
+
+def test_changes_outside_the_session_refetch_the_queue(study, add_notes):
+    add_notes([f"card {i}" for i in range(5)])
+    answer, session = study()
+    add_notes(["added while studying"])
+    answer(EASY)
+    assert session.queue_fetches == 2
+
+
+def test_a_learning_card_coming_back_refetches_the_queue(study, add_notes):
+    add_notes([f"card {i}" for i in range(5)])
+    answer, session = study()
+    answer(AGAIN)
+    assert session.queue_fetches == 2
+
+
+def test_answering_a_card_with_queued_siblings_refetches_the_queue(study, username):
+    add_reversed_notes(username, ["one", "two"])
+    answer, session = study()
+    queued_notes = [entry[0].card.note_id for entry in session._queue]
+    assert session.current_card.nid in queued_notes
+    answer(EASY)
+    assert session.queue_fetches == 2
+
+
+def test_an_old_queue_is_refetched(study, add_notes, monkeypatch):
+    add_notes([f"card {i}" for i in range(5)])
+    answer, session = study()
+    monkeypatch.setattr(study_session_registry, "PREFETCH_MAX_AGE", 0)
+    answer(EASY)
+    assert session.queue_fetches == 2
+
+
+def test_without_prefetch_every_answer_fetches(study, add_notes):
+    add_notes([f"card {i}" for i in range(3)])
+    answer, session = study(prefetch=0)
+    answer(EASY)
+    answer(EASY)
+    assert session.queue_fetches == 3
+
+
+@pytest.mark.parametrize("prefetch", ["abc", [], -1, 2.5])
+def test_bad_prefetch_is_rejected(client, username, prefetch):
+    response = client.post("/api/study", json={"username": username, "action": "start", "deck_id": 1,
+                                               "prefetch": prefetch})
+    assert response.status_code == 400
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from conftest import pool_refs
+from study_session_registry import StudySessionRegistry
+
+
+@pytest.fixture
+def other_user(client):
+    name = "other-learner"
+    assert client.post(f"/api/users/create/{name}").status_code == 201
+    yield name
+    client.delete(f"/api/users/delete/{name}")
+
+
+def open_session(client, username, **options):
+    response = client.post("/api/study/sessions", json={"username": username, **options})
+    assert response.status_code == 201, response.json
+    return response.json["session_id"]
+
+
+def test_listing_is_scoped_to_the_user_and_hides_tokens(client, username, other_user):
+    mine = open_session(client, username)
+    open_session(client, other_user)
+    open_session(client, other_user)
+
+    listing = client.get("/api/study/sessions", json={"username": username})
+    assert listing.status_code == 200
+    assert listing.json["count"] == 1
+    assert [session["username"] for session in listing.json["sessions"]] == [username]
+    assert mine not in listing.get_data(as_text=True)
+    assert "session_id" not in listing.json["sessions"][0]
+    assert client.get(f"/api/study/sessions?username={other_user}").json["count"] == 2
+
+
+def test_listing_requires_a_username(client, username):
+    open_session(client, username)
+    assert client.get("/api/study/sessions").status_code == 400
+
+
+def test_sessions_are_isolated_per_user(client, username, other_user, add_notes):
+    add_notes(["one"])
+    session_id = open_session(client, username)
+    response = client.post("/api/study", json={"username": other_user, "session_id": session_id,
+                                               "action": "start", "deck_id": 1})
+    assert response.status_code == 403
+
+    mine = client.post("/api/study", json={"session_id": session_id, "action": "start", "deck_id": 1})
+    assert mine.status_code == 200 and mine.json["session_id"] == session_id
+    # The other user's default session is separate and has nothing to study
+    theirs = client.post("/api/study", json={"username": other_user, "action": "start", "deck_id": 1})
+    assert theirs.json["status"] == "finished" and theirs.json["session_id"] != session_id
+
+
+def test_closed_sessions_are_gone(client, username):
+    session_id = open_session(client, username)
+    assert client.post("/api/study", json={"session_id": session_id, "action": "close"}).status_code == 200
+    response = client.post("/api/study", json={"username": username, "session_id": session_id, "action": "flip"})
+    assert response.status_code == 404
+
+
+def test_idle_sessions_expire_and_release_their_collection(username):
+    registry = StudySessionRegistry(idle_timeout=0.2)
+    idle = registry.create(username)
+    active = registry.create(username)
+    assert pool_refs(username) == 2
+    time.sleep(0.15)
+    active.touch()
+    time.sleep(0.1)
+    assert registry.get(idle.session_id) is None
+    assert registry.get(active.session_id) is active
+    assert pool_refs(username) == 1
+    assert registry.stats(username)["count"] == 1
+    registry.close(active.session_id)
+    assert pool_refs(username) == 0
@@ -0,0 +1,47 @@
+from anki.collection import Collection
+
+from conftest import borrowed
+
+
+def test_update_notes_reports_each_entry(client, username, add_notes):
+    first, second = add_notes(["first", "second"])
+    updates = [
+        {"note_id": first, "fields": {"Front": "first"}},
+        {"note_id": second, "fields": {"Back": "changed"}, "tags": ["edited"]},
+        {"note_id": 1, "fields": {"Front": "x"}},
+        {"note_id": first, "fields": {"Nope": "x"}},
+        {"note_id": "abc", "fields": {"Front": "x"}},
+        {"note_id": first},
+    ]
+    response = client.post("/api/notetypes/update-notes", json={"username": username, "notes": updates, "echo": True})
+    assert response.status_code == 200
+    results = response.json["results"]
+    assert [result.get("status") for result in results] == ["unchanged", "updated", None, None, None, None]
+    assert results[1]["fields"]["Back"] == "changed" and results[1]["tags"] == ["edited"]
+    assert response.json["failed"] == 4
+    with borrowed(username) as col:
+        assert col.get_note(second)["Back"] == "changed"
+
+
+def test_only_changed_notes_are_loaded(client, username, add_notes, monkeypatch):
+    note_ids = add_notes([f"note {i}" for i in range(5)], tags=["same"])
+    loaded = []
+    get_note = Collection.get_note
+
+    def recording(self, note_id):
+        loaded.append(note_id)
+        return get_note(self, note_id)
+
+    monkeypatch.setattr(Collection, "get_note", recording)
+    updates = [{"note_id": note_id, "fields": {"Front": f"note {i}"}, "tags": ["same"]}
+               for i, note_id in enumerate(note_ids)]
+    updates[2]["fields"]["Back"] = "new back"
+    updates[4]["tags"] = ["other", "same"]
+    response = client.post("/api/notetypes/update-notes", json={"username": username, "notes": updates})
+    assert response.json["updated"] == 2 and response.json["unchanged"] == 3
+    assert sorted(loaded) == sorted([note_ids[2], note_ids[4]])
+    monkeypatch.undo()
+    with borrowed(username) as col:
+        assert col.get_note(note_ids[2])["Back"] == "new back"
+        assert col.get_note(note_ids[4]).tags == ["other", "same"]
+        assert col.get_note(note_ids[0])["Back"] == "back of note 0"